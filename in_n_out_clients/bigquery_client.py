@@ -1,3 +1,442 @@
+import datetime
+import io
+import logging
+import uuid
+from typing import Iterator, List
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from google.api_core.exceptions import NotFound
+from google.cloud import bigquery
+
+from in_n_out_clients.deduplication import drop_duplicate_keys
+from in_n_out_clients.in_n_out_types import (
+    APIResponse,
+    ConflictResolutionStrategy,
+)
+
+logger = logging.getLogger(__name__)
+
+# -- maximum (in-memory) size of the data sent in a single load job
+DEFAULT_MAX_BYTES_PER_LOAD_JOB = 256 * 1024 * 1024
+# -- staging tables are deleted after a write, and expire after this long if
+# the write crashes before deleting them
+_STAGING_TABLE_EXPIRATION = datetime.timedelta(days=1)
+
+
 class BigQueryClient:
-    def __init__(self):
-        pass
+    """Client for interfacing with BigQuery. Data is written using load jobs
+    from in-memory parquet files, which unlike streaming inserts are free and
+    land in columnar storage straight away.
+
+    :param database_name: id of the google cloud project, defaults to the
+        project inferred from the environment
+    :param client: an existing `bigquery.Client` to use, e.g. one pointed
+        at an emulator, defaults to None
+    :param max_bytes_per_load_job: (in-memory) byte budget of the data sent
+        in each load job, defaults to DEFAULT_MAX_BYTES_PER_LOAD_JOB
+    """
+
+    def __init__(
+        self,
+        database_name: str | None = None,
+        client: bigquery.Client | None = None,
+        max_bytes_per_load_job: int = DEFAULT_MAX_BYTES_PER_LOAD_JOB,
+    ):
+        self.project = database_name
+        self.max_bytes_per_load_job = max_bytes_per_load_job
+        # -- clients passed in are closed by whoever created them
+        self._owns_client = client is None
+        self.client = client if client is not None else self.initialise()
+
+    def initialise(self):
+        logger.info("Initialising client...")
+        return bigquery.Client(project=self.project)
+
+    def close(self):
+        """Close the connections of the bigquery client, if it was created
+        by this client."""
+        if self._owns_client:
+            self.client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _get_table_id(self, table_name: str, dataset_name: str | None):
+        if dataset_name is None:
+            # -- assume table_name is of the form `dataset.table`
+            return table_name
+        return f"{dataset_name}.{table_name}"
+
+    def _table_exists(self, table_id: str) -> bool:
+        try:
+            self.client.get_table(table_id)
+        except NotFound:
+            return False
+        return True
+
+    def _asset_exists(self, table_name: str, dataset_name: str | None) -> bool:
+        return self._table_exists(self._get_table_id(table_name, dataset_name))
+
+    def _write(
+        self,
+        table_name: str,
+        data: pd.DataFrame,
+        on_data_conflict: str = "append",
+        on_asset_conflict: str = "append",
+        dataset_name: str | None = None,
+        data_conflict_properties: List[str] | None = None,
+        duplicate_keys_policy: str | dict | None = None,
+    ) -> APIResponse:
+        """Internal function that is used by `InNOutClient` as a universal
+        write entry.
+
+        :param table_name: name of the table to write to
+        :param data: dataframe to write
+        :param on_data_conflict: how to behave if some of the rows to
+                write already exist, defaults to "append"
+        :param on_asset_conflict: how to behave if the table already exists,
+                defaults to "append"
+        :param dataset_name: name of the dataset that table belongs to. If
+                None, `table_name` must be of the form `dataset.table`,
+                defaults to None
+        :param data_conflict_properties: columns to check for conflicts,
+                defaults to None
+        :param duplicate_keys_policy: how rows of the data with the same
+                data_conflict_properties are deduplicated before writing,
+                since a MERGE fails if a row of the table matches several
+                rows of the data. "first" or "last" keeps the first or last
+                row, a dict maps columns to the aggregation used to combine
+                them. Defaults to "last" for on_data_conflict="replace",
+                otherwise to "first". Not applied when
+                on_data_conflict="append"
+        """
+        resp = self.write(
+            df=data,
+            table_name=table_name,
+            dataset_name=dataset_name,
+            on_asset_conflict=on_asset_conflict,
+            on_data_conflict=on_data_conflict,
+            data_conflict_properties=data_conflict_properties,
+            duplicate_keys_policy=duplicate_keys_policy,
+        )
+
+        return resp
+
+    def write(
+        self,
+        df: pd.DataFrame,
+        table_name: str,
+        dataset_name: str | None,
+        on_asset_conflict: str,
+        on_data_conflict: str,
+        data_conflict_properties: List[str] | None = None,
+        duplicate_keys_policy: str | dict | None = None,
+    ) -> APIResponse:
+        table_id = self._get_table_id(table_name, dataset_name)
+        table_exists = self._table_exists(table_id)
+
+        if table_exists:
+            match on_asset_conflict:
+                case ConflictResolutionStrategy.FAIL:
+                    _msg = (
+                        f"table `{table_id}` exists and "
+                        f"on_asset_conflict=`{on_asset_conflict}`"
+                    )
+                    logger.error(_msg)
+                    return {"status_code": 409, "msg": _msg}
+                case ConflictResolutionStrategy.IGNORE:
+                    _msg = (
+                        f"table `{table_id}` exists but request dropped "
+                        "since on_asset_conflict=`ignore`"
+                    )
+                    logger.info(_msg)
+                    return {"status_code": 200, "msg": _msg}
+
+        replace_table = on_asset_conflict == ConflictResolutionStrategy.REPLACE
+        if df.empty:
+            # -- load jobs need data, and a replaced table must be emptied
+            if replace_table and table_exists:
+                self.client.query(f"TRUNCATE TABLE `{table_id}`").result()
+                _msg = f"Truncated `{table_id}` since there is no data"
+            else:
+                _msg = f"No data to write to `{table_id}`"
+            logger.info(_msg)
+            return {"status_code": 200, "msg": _msg, "data": [{"num_rows": 0}]}
+
+        df, num_duplicate_rows = drop_duplicate_keys(
+            df,
+            on_data_conflict=on_data_conflict,
+            data_conflict_properties=data_conflict_properties,
+            duplicate_keys_policy=duplicate_keys_policy,
+        )
+        # -- conflicts can only occur against an existing table that is kept
+        if (
+            on_data_conflict == ConflictResolutionStrategy.APPEND
+            or not table_exists
+            or replace_table
+        ):
+            load_metadata = self._load_dataframe(
+                df, table_id, truncate=replace_table
+            )
+            load_metadata["num_duplicate_rows_dropped"] = num_duplicate_rows
+            _msg = f"Successfully wrote {len(df)} rows to `{table_id}`"
+            logger.info(_msg)
+            return {"status_code": 200, "msg": _msg, "data": [load_metadata]}
+
+        if not data_conflict_properties:
+            _msg = (
+                f"on_data_conflict=`{on_data_conflict}` requires "
+                "data_conflict_properties"
+            )
+            logger.error(_msg)
+            return {"status_code": 400, "msg": _msg}
+
+        staging_table_id = self._get_staging_table_id(table_id)
+        try:
+            self._create_expiring_table(staging_table_id)
+            load_metadata = self._load_chunks(
+                df, staging_table_id, truncate=True
+            )
+            load_metadata["num_duplicate_rows_dropped"] = num_duplicate_rows
+            resp = self._merge_from_staging(
+                table_id=table_id,
+                staging_table_id=staging_table_id,
+                columns=df.columns.tolist(),
+                on_data_conflict=on_data_conflict,
+                data_conflict_properties=data_conflict_properties,
+            )
+        finally:
+            self.client.delete_table(staging_table_id, not_found_ok=True)
+
+        resp.setdefault("data", []).insert(0, load_metadata)
+        return resp
+
+    @staticmethod
+    def _get_staging_table_id(table_id: str) -> str:
+        return f"{table_id}__staging_{uuid.uuid4().hex[:8]}"
+
+    def _create_expiring_table(self, table_id: str):
+        """Create an empty table that expires after
+        `_STAGING_TABLE_EXPIRATION`. Load jobs that truncate the table
+        replace its schema but keep its expiration."""
+        table = bigquery.Table(
+            bigquery.TableReference.from_string(
+                table_id, default_project=self.client.project
+            )
+        )
+        table.expires = (
+            datetime.datetime.now(datetime.timezone.utc)
+            + _STAGING_TABLE_EXPIRATION
+        )
+        self.client.create_table(table)
+
+    def _load_dataframe(
+        self, df: pd.DataFrame, table_id: str, truncate: bool
+    ) -> dict:
+        """Load a dataframe into a table. If the table is overwritten and
+        the data needs more than one load job, it is loaded into a staging
+        table first and copied over the table with a single copy job, so
+        readers never see partially loaded data.
+
+        :param df: dataframe to load
+        :param table_id: id of the destination table
+        :param truncate: if True, the table is overwritten by the load
+        :return: metadata on the load
+        """
+        num_chunks = -(-len(df) // self._get_rows_per_chunk(df))
+        if not truncate or num_chunks <= 1:
+            return self._load_chunks(df, table_id, truncate=truncate)
+
+        staging_table_id = self._get_staging_table_id(table_id)
+        try:
+            load_metadata = self._load_chunks(
+                df, staging_table_id, truncate=True
+            )
+            logger.debug(f"Copying staging table to `{table_id}`...")
+            self.client.copy_table(
+                staging_table_id,
+                table_id,
+                job_config=bigquery.CopyJobConfig(
+                    write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
+                ),
+            ).result()
+        finally:
+            self.client.delete_table(staging_table_id, not_found_ok=True)
+        return load_metadata
+
+    def _load_chunks(
+        self, df: pd.DataFrame, table_id: str, truncate: bool
+    ) -> dict:
+        """Load a dataframe into a table using one parquet load job per
+        chunk of at most `max_bytes_per_load_job` bytes.
+
+        :param df: dataframe to load
+        :param table_id: id of the destination table
+        :param truncate: if True, the table is overwritten by the first job
+        :return: metadata on the load
+        """
+        num_bytes = 0
+        jobs = []
+        for chunk_count, parquet_file in enumerate(
+            self._serialise_to_parquet(df)
+        ):
+            write_disposition = (
+                bigquery.WriteDisposition.WRITE_TRUNCATE
+                if truncate and chunk_count == 0
+                else bigquery.WriteDisposition.WRITE_APPEND
+            )
+            job_config = bigquery.LoadJobConfig(
+                source_format=bigquery.SourceFormat.PARQUET,
+                write_disposition=write_disposition,
+                create_disposition=bigquery.CreateDisposition.CREATE_IF_NEEDED,
+            )
+            num_bytes += parquet_file.getbuffer().nbytes
+            logger.debug(
+                f"Submitting load job {chunk_count+1} to `{table_id}`..."
+            )
+            job = self.client.load_table_from_file(
+                parquet_file, table_id, rewind=True, job_config=job_config
+            )
+            # -- later jobs append, so the truncating job must finish first
+            if write_disposition == bigquery.WriteDisposition.WRITE_TRUNCATE:
+                job.result()
+            jobs.append(job)
+
+        for job in jobs:
+            job.result()
+
+        return {
+            "num_rows": len(df),
+            "num_load_jobs": len(jobs),
+            "num_bytes": num_bytes,
+        }
+
+    def _get_rows_per_chunk(self, df: pd.DataFrame) -> int:
+        num_bytes = df.memory_usage(deep=True, index=False).sum()
+        bytes_per_row = max(1, num_bytes // max(1, len(df)))
+        return max(1, self.max_bytes_per_load_job // bytes_per_row)
+
+    def _serialise_to_parquet(self, df: pd.DataFrame) -> Iterator[io.BytesIO]:
+        """Serialise a dataframe to in-memory parquet files, chunked so that
+        each chunk is at most `max_bytes_per_load_job` bytes in memory."""
+        num_rows = len(df)
+        if num_rows == 0:
+            return
+        rows_per_chunk = self._get_rows_per_chunk(df)
+
+        for start in range(0, num_rows, rows_per_chunk):
+            end = start + rows_per_chunk
+            arrow_table = pa.Table.from_pandas(
+                df.iloc[start:end], preserve_index=False
+            )
+            parquet_file = io.BytesIO()
+            pq.write_table(
+                arrow_table,
+                parquet_file,
+                coerce_timestamps="us",
+                allow_truncated_timestamps=True,
+            )
+            yield parquet_file
+
+    def _merge_from_staging(
+        self,
+        table_id: str,
+        staging_table_id: str,
+        columns: List[str],
+        on_data_conflict: str,
+        data_conflict_properties: List[str],
+    ) -> APIResponse:
+        join_condition = " AND ".join(
+            f"T.`{column}` = S.`{column}`"
+            for column in data_conflict_properties
+        )
+        column_list = ", ".join(f"`{column}`" for column in columns)
+        insert_clause = (
+            f"INSERT ({column_list}) VALUES "
+            f"({', '.join(f'S.`{column}`' for column in columns)})"
+        )
+
+        match on_data_conflict:
+            case ConflictResolutionStrategy.FAIL:
+                key_list = ", ".join(
+                    f"S.`{column}`" for column in data_conflict_properties
+                )
+                conflicts = list(
+                    self.client.query(
+                        f"SELECT COUNT(*) OVER () AS num_conflicts, "
+                        f"{key_list} FROM `{staging_table_id}` S "
+                        f"JOIN `{table_id}` T ON {join_condition} LIMIT 5"
+                    ).result()
+                )
+                if conflicts:
+                    num_conflicts = conflicts[0]["num_conflicts"]
+                    logger.error("Exiting process since on_data_conflict=fail")
+                    return {
+                        "status_code": 409,
+                        "msg": f"Found {num_conflicts} conflicting rows",
+                        "data": [
+                            {
+                                "data_conflict_properties": (
+                                    data_conflict_properties
+                                ),
+                                "first_5_conflicting_rows": [
+                                    {
+                                        column: row[column]
+                                        for column in data_conflict_properties
+                                    }
+                                    for row in conflicts
+                                ],
+                            }
+                        ],
+                    }
+                statement = (
+                    f"INSERT INTO `{table_id}` ({column_list}) "
+                    f"SELECT {column_list} FROM `{staging_table_id}`"
+                )
+            case ConflictResolutionStrategy.REPLACE:
+                update_columns = [
+                    column
+                    for column in columns
+                    if column not in data_conflict_properties
+                ]
+                update_clause = ""
+                if update_columns:
+                    set_clause = ", ".join(
+                        f"`{column}` = S.`{column}`"
+                        for column in update_columns
+                    )
+                    update_clause = (
+                        f"WHEN MATCHED THEN UPDATE SET {set_clause} "
+                    )
+                statement = (
+                    f"MERGE `{table_id}` T USING `{staging_table_id}` S "
+                    f"ON {join_condition} {update_clause}"
+                    f"WHEN NOT MATCHED THEN {insert_clause}"
+                )
+            case ConflictResolutionStrategy.IGNORE:
+                statement = (
+                    f"MERGE `{table_id}` T USING `{staging_table_id}` S "
+                    f"ON {join_condition} "
+                    f"WHEN NOT MATCHED THEN {insert_clause}"
+                )
+            case _:
+                raise NotImplementedError(
+                    f"on_data_conflict=`{on_data_conflict}` is not supported"
+                )
+
+        query_job = self.client.query(statement)
+        query_job.result()
+        num_affected_rows = query_job.num_dml_affected_rows
+        _msg = f"Successfully wrote data to `{table_id}`"
+        logger.info(_msg)
+        return {
+            "status_code": 200,
+            "msg": _msg,
+            "data": [{"num_affected_rows": num_affected_rows}],
+        }
@@ -0,0 +1,354 @@
+import glob
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+from typing import Callable, List
+
+import pandas as pd
+
+from in_n_out_clients.in_n_out_types import APIResponse
+from in_n_out_clients.instrumentation import get_instrumentation
+
+logger = logging.getLogger(__name__)
+
+# -- subdirectory of the spool directory with the rows that could not be
+# written, which are not replayed
+DEAD_LETTER_DIR_NAME = "dead-letter"
+
+
+class BufferedWriter:
+    """Buffers small writes in memory and writes them to a client in bulk,
+    from a background thread, once `max_rows` rows are buffered or every
+    `flush_interval` seconds.
+
+    Writes are buffered per table and conflict resolution strategy. If
+    `spool_dir` is given, buffered rows are also appended to a spool file so
+    that they survive a crash: rows spooled by a previous process are
+    buffered again when a writer is created with the same `spool_dir`.
+
+    Once `max_buffered_rows` rows are buffered, `write` blocks until a flush
+    frees up space.
+
+    Rows that fail to be written because of an exception or a 5xx response
+    are buffered again and retried on the next flush, up to `max_attempts`
+    times. Rows rejected with a 4xx response (e.g. a 409 conflict) are not
+    retried. Rows that are not retried are dead lettered: they are passed to
+    `on_dead_letter`, and written to the `dead-letter` subdirectory of
+    `spool_dir` if it is given.
+
+    :param client: client to write to, e.g. an `InNOutClient`
+    :param max_rows: number of buffered rows that triggers a flush, defaults
+        to 10000
+    :param flush_interval: maximum seconds between flushes, defaults to 1
+    :param max_buffered_rows: number of buffered rows at which `write`
+        blocks, defaults to 100000
+    :param spool_dir: directory of the spool files, defaults to None (no
+        spooling)
+    :param fsync: whether to fsync the spool file after every write, which
+        also protects against power loss, defaults to False
+    :param write_timeout: maximum seconds `write` blocks when the buffer is
+        full before raising a TimeoutError, defaults to None (no limit)
+    :param max_attempts: maximum number of flushes that try to write rows
+        before they are dead lettered, defaults to 5
+    :param on_dead_letter: function called with the write parameters, the
+        rows and the last response of rows that could not be written,
+        defaults to None
+    """
+
+    def __init__(
+        self,
+        client,
+        max_rows: int = 10000,
+        flush_interval: float = 1.0,
+        max_buffered_rows: int = 100000,
+        spool_dir: str | None = None,
+        fsync: bool = False,
+        write_timeout: float | None = None,
+        max_attempts: int = 5,
+        on_dead_letter: Callable[[dict, pd.DataFrame, APIResponse], None]
+        | None = None,
+    ):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.client = client
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.max_buffered_rows = max_buffered_rows
+        self.spool_dir = spool_dir
+        self.fsync = fsync
+        self.write_timeout = write_timeout
+        self.max_attempts = max_attempts
+        self.on_dead_letter = on_dead_letter
+
+        self._buffers = {}
+        self._num_failed_attempts = {}
+        self._num_buffered_rows = 0
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._spool_file = None
+        self._spool_path = None
+
+        if spool_dir is not None:
+            os.makedirs(spool_dir, exist_ok=True)
+            spooled_paths = sorted(
+                glob.glob(os.path.join(spool_dir, "*.spool"))
+            )
+            self._rotate_spool()
+            self._replay(spooled_paths)
+
+        self._thread = threading.Thread(
+            target=self._run, name="in-n-out-buffered-writer", daemon=True
+        )
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def write(
+        self,
+        table_name: str,
+        data: pd.DataFrame,
+        dataset_name: str | None = None,
+        on_data_conflict: str = "append",
+        on_asset_conflict: str = "append",
+        data_conflict_properties: List[str] | None = None,
+    ) -> APIResponse:
+        """Buffer data to be written, takes the same parameters as
+        `InNOutClient.write`.
+
+        :return: response with status code 202 once the data is buffered
+        """
+        if on_asset_conflict == "replace":
+            raise ValueError(
+                "on_asset_conflict=replace is not supported by buffered "
+                "writes, since every flush would replace the table"
+            )
+        key = (
+            table_name,
+            dataset_name,
+            on_data_conflict,
+            on_asset_conflict,
+            tuple(data_conflict_properties or ()),
+        )
+        num_rows = len(data)
+
+        with self._not_full:
+            if self._closed:
+                raise RuntimeError("Can not write to a closed BufferedWriter")
+            # -- backpressure: wait for a flush to free up space. A single
+            # write larger than the buffer is accepted once it is empty
+            is_not_full = self._not_full.wait_for(
+                lambda: self._num_buffered_rows == 0
+                or self._num_buffered_rows + num_rows
+                <= self.max_buffered_rows,
+                timeout=self.write_timeout,
+            )
+            if not is_not_full:
+                raise TimeoutError(
+                    f"Buffer still full after {self.write_timeout} seconds"
+                )
+            self._spool(key, data)
+            self._buffers.setdefault(key, []).append(data)
+            self._num_buffered_rows += num_rows
+            if self._num_buffered_rows >= self.max_rows:
+                self._wakeup.set()
+
+        return {
+            "status_code": 202,
+            "msg": f"buffered {num_rows} rows",
+            "data": [],
+        }
+
+    def flush(self) -> List[APIResponse]:
+        """Write all buffered data to the client.
+
+        :return: responses of the client, one for each table and conflict
+            resolution strategy
+        """
+        with self._flush_lock:
+            with self._lock:
+                buffers = self._buffers
+                num_rows = self._num_buffered_rows
+                self._buffers = {}
+                spool_path = self._spool_path
+                if buffers and self.spool_dir is not None:
+                    self._rotate_spool()
+
+            if not buffers:
+                return []
+
+            instrumentation = get_instrumentation()
+            with instrumentation.span("buffered_writer.flush") as span:
+                span.add("rows", num_rows)
+                responses = []
+                for key, frames in buffers.items():
+                    responses.append(self._flush_buffer(key, frames))
+                    span.add("round_trips")
+
+            with self._not_full:
+                self._num_buffered_rows -= num_rows
+                self._not_full.notify_all()
+            if spool_path is not None:
+                os.remove(spool_path)
+            return responses
+
+    def _flush_buffer(self, key: tuple, frames: List[pd.DataFrame]):
+        write_params = _get_write_params(key)
+        table_name = write_params["table_name"]
+        df = pd.concat(frames, ignore_index=True)
+        logger.debug(f"Flushing {len(df)} rows to `{table_name}`...")
+        try:
+            resp = self.client.write(data=df, **write_params)
+        except Exception as error:
+            logger.exception(f"Failed to flush rows to `{table_name}`")
+            resp = {"status_code": 500, "msg": str(error), "data": []}
+
+        status_code = resp.get("status_code", 200)
+        if status_code < 400:
+            self._num_failed_attempts.pop(key, None)
+            return resp
+
+        num_failed_attempts = self._num_failed_attempts.get(key, 0) + 1
+        if status_code >= 500 and num_failed_attempts < self.max_attempts:
+            # -- rows that failed transiently are buffered again and retried
+            # on the next flush, the buffer filling up applies backpressure
+            # to writers
+            logger.error(
+                f"Failed to flush {len(df)} rows to `{table_name}` "
+                f"({num_failed_attempts}/{self.max_attempts} attempts). "
+                f"Reason: {resp.get('msg')}. Retrying on next flush..."
+            )
+            self._num_failed_attempts[key] = num_failed_attempts
+            with self._lock:
+                self._spool(key, df)
+                self._buffers.setdefault(key, []).insert(0, df)
+                self._num_buffered_rows += len(df)
+            return resp
+
+        self._num_failed_attempts.pop(key, None)
+        self._dead_letter(key, df, resp)
+        return resp
+
+    def _dead_letter(self, key: tuple, df: pd.DataFrame, resp: APIResponse):
+        """Internal function to give up on writing rows."""
+        write_params = _get_write_params(key)
+        logger.error(
+            f"Dropping {len(df)} rows that could not be written to "
+            f"`{write_params['table_name']}`. Reason: {resp.get('msg')}..."
+        )
+        if self.spool_dir is not None:
+            dead_letter_dir = os.path.join(
+                self.spool_dir, DEAD_LETTER_DIR_NAME
+            )
+            os.makedirs(dead_letter_dir, exist_ok=True)
+            dead_letter_path = os.path.join(
+                dead_letter_dir, f"{time.time_ns()}-{uuid.uuid4().hex[:8]}.pkl"
+            )
+            with open(dead_letter_path, "wb") as f:
+                pickle.dump((write_params, df, resp), f)
+            logger.info(f"Wrote dropped rows to `{dead_letter_path}`...")
+        if self.on_dead_letter is not None:
+            try:
+                self.on_dead_letter(write_params, df, resp)
+            except Exception:
+                logger.exception("on_dead_letter failed")
+
+    def close(self):
+        """Flush all buffered data and stop the background thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+        with self._lock:
+            if self._spool_file is not None:
+                self._spool_file.close()
+                if not self._buffers:
+                    os.remove(self._spool_path)
+                self._spool_file = None
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            is_due = time.monotonic() - last_flush >= self.flush_interval
+            if self._closed or not (
+                is_due or self._num_buffered_rows >= self.max_rows
+            ):
+                continue
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Background flush failed")
+            last_flush = time.monotonic()
+
+    def _spool(self, key: tuple, df: pd.DataFrame):
+        if self._spool_file is None:
+            return
+        pickle.dump((key, df), self._spool_file)
+        self._spool_file.flush()
+        if self.fsync:
+            os.fsync(self._spool_file.fileno())
+
+    def _rotate_spool(self):
+        """Internal function to start a new spool file. Rows in the previous
+        file are deleted with it once they are written."""
+        if self._spool_file is not None:
+            self._spool_file.close()
+        self._spool_path = os.path.join(
+            self.spool_dir, f"{time.time_ns()}-{uuid.uuid4().hex[:8]}.spool"
+        )
+        self._spool_file = open(self._spool_path, "ab")
+
+    def _replay(self, spooled_paths: List[str]):
+        """Internal function to buffer the rows of spool files left behind by
+        a previous writer."""
+        for path in spooled_paths:
+            num_rows = 0
+            with open(path, "rb") as f:
+                while True:
+                    try:
+                        key, df = pickle.load(f)
+                    except EOFError:
+                        break
+                    except pickle.UnpicklingError:
+                        # -- the last record of a crashed writer may be
+                        # partially written
+                        logger.warning(f"Truncated record in spool `{path}`")
+                        break
+                    self._spool(key, df)
+                    self._buffers.setdefault(key, []).append(df)
+                    self._num_buffered_rows += len(df)
+                    num_rows += len(df)
+            logger.info(f"Recovered {num_rows} rows from spool `{path}`...")
+            os.remove(path)
+
+
+def _get_write_params(key: tuple) -> dict:
+    (
+        table_name,
+        dataset_name,
+        on_data_conflict,
+        on_asset_conflict,
+        data_conflict_properties,
+    ) = key
+    return {
+        "table_name": table_name,
+        "dataset_name": dataset_name,
+        "on_data_conflict": on_data_conflict,
+        "on_asset_conflict": on_asset_conflict,
+        "data_conflict_properties": list(data_conflict_properties) or None,
+    }
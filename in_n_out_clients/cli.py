@@ -0,0 +1,397 @@
+"""Command line interface, e.g.
+
+```
+in-n-out load --database-type pg --host localhost --port 5432 \
+    --username postgres --database-name postgres --table-name events \
+    --on-data-conflict ignore --data-conflict-properties id \
+    events-*.csv.gz
+```
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from in_n_out_clients.in_n_out_types import APIResponse
+from in_n_out_clients.main import DATABASE_TYPE_TO_CLIENT_MAPPING, InNOutClient
+from in_n_out_clients.transfer import run_transfer
+
+logger = logging.getLogger(__name__)
+
+FILE_FORMATS = ("csv", "parquet", "jsonl")
+
+# -- seconds between progress updates
+_PROGRESS_INTERVAL = 1.0
+
+
+def infer_file_format(path: str) -> str:
+    """Infer the format of a file from its extension, ignoring compression
+    extensions, e.g. `events.csv.gz` is csv."""
+    name = path.lower()
+    for compression_extension in (".gz", ".bz2", ".zst", ".xz", ".zip"):
+        name = name.removesuffix(compression_extension)
+    extension = os.path.splitext(name)[1].lstrip(".")
+    if extension == "json":
+        extension = "jsonl"
+    if extension not in FILE_FORMATS:
+        raise ValueError(f"Can not infer the format of `{path}`, use --format")
+    return extension
+
+
+def read_file_in_chunks(
+    path: str, file_format: str, chunksize: int
+) -> Iterator[pd.DataFrame]:
+    """Read a file in chunks of at most `chunksize` rows, so that files
+    larger than memory can be loaded.
+
+    :param path: path of the file, or "-" for stdin
+    :param file_format: one of FILE_FORMATS
+    :param chunksize: maximum number of rows per chunk
+    :return: iterator of dataframes
+    """
+    source = sys.stdin.buffer if path == "-" else path
+    match file_format:
+        case "csv":
+            with pd.read_csv(source, chunksize=chunksize) as reader:
+                yield from reader
+        case "jsonl":
+            with pd.read_json(
+                source, lines=True, chunksize=chunksize
+            ) as reader:
+                yield from reader
+        case "parquet":
+            if path == "-":
+                # -- parquet metadata is at the end of the file, so stdin
+                # has to be read fully
+                source = io.BytesIO(sys.stdin.buffer.read())
+            parquet_file = pq.ParquetFile(source)
+            for batch in parquet_file.iter_batches(batch_size=chunksize):
+                yield batch.to_pandas()
+        case _:
+            raise ValueError(
+                f"file_format must be one of {FILE_FORMATS}, got "
+                f"`{file_format}`"
+            )
+
+
+class _Progress:
+    """Thread safe counter of the rows written that periodically reports
+    progress and throughput to stderr."""
+
+    def __init__(self, num_files: int, stream=None):
+        self.num_files = num_files
+        self.stream = stream or sys.stderr
+        self.num_rows = 0
+        self.num_files_done = 0
+        self._start_time = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="in-n-out-progress", daemon=True
+        )
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._thread.join()
+        self.report(end="\n")
+        return False
+
+    def add_rows(self, num_rows: int):
+        with self._lock:
+            self.num_rows += num_rows
+
+    def file_done(self):
+        with self._lock:
+            self.num_files_done += 1
+
+    def report(self, end: str = ""):
+        seconds = time.perf_counter() - self._start_time
+        # -- terminals show a single updating line, logs one line per report
+        is_tty = self.stream.isatty()
+        self.stream.write(
+            ("\r" if is_tty else "")
+            + f"{self.num_files_done}/{self.num_files} files, "
+            f"{self.num_rows} rows, {self.num_rows / seconds:,.0f} rows/s"
+            + (end if is_tty else "\n")
+        )
+        self.stream.flush()
+
+    def _run(self):
+        while not self._stop.wait(_PROGRESS_INTERVAL):
+            self.report()
+
+
+class _ChunkWriter:
+    """Writes chunks of any file to a client. The first chunk written is
+    written on its own and applies `on_asset_conflict`, as resolved by
+    `InNOutClient.resolve_asset_conflict`, e.g. creates or replaces the
+    table, while the other chunks wait for it. Later chunks are appended in
+    parallel.
+
+    If the first chunk fails, later chunks are not written.
+    """
+
+    def __init__(
+        self, client: InNOutClient, write_params: dict, progress: _Progress
+    ):
+        self.client = client
+        self.write_params = write_params
+        self.progress = progress
+        self._first_response = None
+        self._lock = threading.Lock()
+
+    def __call__(self, chunk: pd.DataFrame, chunk_number: int) -> APIResponse:
+        if self._first_response is None:
+            with self._lock:
+                if self._first_response is None:
+                    try:
+                        self._first_response = self._write(
+                            chunk, self.write_params["on_asset_conflict"]
+                        )
+                    except Exception as error:
+                        self._first_response = {
+                            "status_code": 500,
+                            "msg": str(error),
+                            "data": [],
+                        }
+                        raise
+                    return self._first_response
+
+        if self._first_response.get("status_code", 200) >= 400:
+            return {
+                "status_code": 424,
+                "msg": "Chunk not written since the first chunk failed",
+                "data": [],
+            }
+        return self._write(chunk, "append")
+
+    def _write(self, chunk: pd.DataFrame, on_asset_conflict: str):
+        resp = self.client.write(
+            data=chunk,
+            **{**self.write_params, "on_asset_conflict": on_asset_conflict},
+        )
+        if resp.get("status_code", 200) < 400:
+            self.progress.add_rows(len(chunk))
+        return resp
+
+
+def load_file(
+    write_chunk: _ChunkWriter,
+    path: str,
+    file_format: str,
+    chunksize: int,
+    progress: _Progress,
+) -> APIResponse:
+    """Load a file, reading the next chunk while the previous one is
+    written."""
+    logger.debug(f"Loading `{path}`...")
+    try:
+        resp = run_transfer(
+            chunks=read_file_in_chunks(path, file_format, chunksize),
+            write_chunk=write_chunk,
+        )
+    finally:
+        progress.file_done()
+    return {**resp, "path": path}
+
+
+def _load_files(
+    args: argparse.Namespace,
+    client: InNOutClient,
+    write_params: dict,
+    file_formats: list,
+) -> list:
+    with _Progress(len(args.files)) as progress:
+        # -- the table is created (or replaced) by the first chunk written,
+        # before files are loaded in parallel
+        write_chunk = _ChunkWriter(client, write_params, progress)
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            return list(
+                executor.map(
+                    lambda path, file_format: load_file(
+                        write_chunk,
+                        path,
+                        file_format,
+                        chunksize=args.chunksize,
+                        progress=progress,
+                    ),
+                    args.files,
+                    file_formats,
+                )
+            )
+
+
+def load(args: argparse.Namespace) -> int:
+    """Run the `load` command.
+
+    :return: exit code
+    """
+    client = InNOutClient(
+        database_type=args.database_type,
+        database_name=args.database_name,
+        password=args.password or os.environ.get("IN_N_OUT_PASSWORD"),
+        username=args.username,
+        host=args.host,
+        port=args.port,
+    )
+    write_params = {
+        "table_name": args.table_name,
+        "dataset_name": args.dataset_name,
+        "on_data_conflict": args.on_data_conflict,
+        "on_asset_conflict": args.on_asset_conflict,
+        "data_conflict_properties": args.data_conflict_properties,
+        **dict(args.write_option or []),
+    }
+    file_formats = [
+        args.format or infer_file_format(path) for path in args.files
+    ]
+
+    with client:
+        (
+            resp,
+            write_params["on_asset_conflict"],
+        ) = client.resolve_asset_conflict(
+            args.table_name, args.dataset_name, args.on_asset_conflict
+        )
+        if resp is not None:
+            responses = [{**resp, "path": path} for path in args.files]
+        else:
+            responses = _load_files(args, client, write_params, file_formats)
+
+    json.dump(responses, sys.stdout, indent=2, default=str)
+    sys.stdout.write("\n")
+    return int(any(resp["status_code"] >= 400 for resp in responses))
+
+
+def _parse_write_option(write_option: str) -> tuple:
+    name, separator, value = write_option.partition("=")
+    if not separator:
+        raise argparse.ArgumentTypeError(
+            f"write options must be given as NAME=VALUE, got `{write_option}`"
+        )
+    try:
+        value = json.loads(value)
+    except json.JSONDecodeError:
+        pass
+    return name, value
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="in-n-out", description="Move data in and out of services."
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="log what is done"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    load_parser = subparsers.add_parser(
+        "load", help="Load CSV, Parquet or JSONL files into a service."
+    )
+    load_parser.add_argument(
+        "files",
+        nargs="+",
+        help='files to load, "-" reads from stdin (requires --format)',
+    )
+
+    connection = load_parser.add_argument_group("connection")
+    connection.add_argument(
+        "--database-type",
+        required=True,
+        choices=sorted(DATABASE_TYPE_TO_CLIENT_MAPPING),
+    )
+    connection.add_argument("--database-name")
+    connection.add_argument("--host")
+    connection.add_argument("--port", type=int)
+    connection.add_argument("--username")
+    connection.add_argument(
+        "--password",
+        help="defaults to the IN_N_OUT_PASSWORD environment variable",
+    )
+
+    target = load_parser.add_argument_group("target")
+    target.add_argument("--table-name", required=True)
+    target.add_argument("--dataset-name")
+    target.add_argument(
+        "--on-data-conflict",
+        default="append",
+        choices=["append", "ignore", "replace", "fail"],
+    )
+    target.add_argument(
+        "--on-asset-conflict",
+        default="append",
+        choices=["append", "ignore", "replace", "fail"],
+        help="applied by the first chunk written, the others are appended",
+    )
+    target.add_argument(
+        "--data-conflict-properties",
+        type=lambda value: value.split(","),
+        help="comma separated columns that identify a row",
+    )
+    target.add_argument(
+        "--write-option",
+        action="append",
+        type=_parse_write_option,
+        metavar="NAME=VALUE",
+        help=(
+            "client specific write option, e.g. dry_run=true, values are "
+            "parsed as JSON if possible. Can be repeated"
+        ),
+    )
+
+    reading = load_parser.add_argument_group("reading")
+    reading.add_argument(
+        "--format",
+        choices=FILE_FORMATS,
+        help="format of the files, defaults to inferring it from extensions",
+    )
+    reading.add_argument(
+        "--chunksize",
+        type=int,
+        default=100000,
+        help="number of rows written per request, defaults to 100000",
+    )
+    reading.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="number of files loaded in parallel, defaults to 4",
+    )
+    load_parser.set_defaults(run=load)
+    return parser
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if args.format is None:
+        if "-" in args.files:
+            parser.error("--format is required when reading from stdin")
+        for path in args.files:
+            try:
+                infer_file_format(path)
+            except ValueError as error:
+                parser.error(str(error))
+    # -- logs would interleave with the progress display
+    logging.getLogger().setLevel(
+        logging.DEBUG if args.verbose else logging.WARNING
+    )
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
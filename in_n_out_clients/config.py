@@ -6,3 +6,18 @@ GOOGLE_OAUTH_CREDENTIAL_FILE = os.environ.get(
 GOOGLE_OAUTH_TOKEN = os.environ.get(
     "GOOGLE_OAUTH_TOKEN", "google_oauth_token.json"
 )
+GOOGLE_SERVICE_ACCOUNT_FILE = os.environ.get("GOOGLE_SERVICE_ACCOUNT_FILE")
+# -- whether the browser based oauth flow may be run if no other
+# credentials are found. If unset (None), it is run only when attached to a
+# terminal, which is checked when the credentials are loaded
+_allow_interactive = os.environ.get("GOOGLE_OAUTH_ALLOW_INTERACTIVE")
+GOOGLE_OAUTH_ALLOW_INTERACTIVE = (
+    None
+    if _allow_interactive is None
+    else _allow_interactive.lower() in ("1", "true", "yes")
+)
+# -- seconds before expiry at which google credentials are refreshed in the
+# background
+GOOGLE_CREDENTIALS_REFRESH_MARGIN = int(
+    os.environ.get("GOOGLE_CREDENTIALS_REFRESH_MARGIN", "300")
+)
@@ -0,0 +1,73 @@
+import logging
+from typing import List
+
+import pandas as pd
+
+from in_n_out_clients.in_n_out_types import ConflictResolutionStrategy
+
+logger = logging.getLogger(__name__)
+
+
+def drop_duplicate_keys(
+    df: pd.DataFrame,
+    on_data_conflict: str,
+    data_conflict_properties: List[str] | None,
+    duplicate_keys_policy: str | dict | None = None,
+) -> tuple[pd.DataFrame, int]:
+    """Deduplicate the rows of a dataframe that have the same conflict keys,
+    see `duplicate_keys_policy` of `PostgresClient._write`.
+
+    :param df: dataframe to deduplicate
+    :param on_data_conflict: conflict resolution strategy of the write
+    :param data_conflict_properties: columns that identify a row
+    :param duplicate_keys_policy: "first", "last" or a dict mapping columns
+        to aggregations, defaults to None
+    :return: deduplicated dataframe and the number of rows dropped
+    """
+    if (
+        not data_conflict_properties
+        or on_data_conflict == ConflictResolutionStrategy.APPEND
+    ):
+        return df, 0
+    if duplicate_keys_policy is None:
+        duplicate_keys_policy = (
+            "last"
+            if on_data_conflict == ConflictResolutionStrategy.REPLACE
+            else "first"
+        )
+
+    # -- hashing the keys is cheap, so frames without duplicates are
+    # returned as they are
+    is_duplicate = df.duplicated(subset=data_conflict_properties, keep=False)
+    if not is_duplicate.any():
+        return df, 0
+
+    if isinstance(duplicate_keys_policy, dict):
+        aggregations = {
+            column: duplicate_keys_policy.get(column, "last")
+            for column in df.columns
+            if column not in data_conflict_properties
+        }
+        df_deduplicated = (
+            df.groupby(data_conflict_properties, sort=False, dropna=False)
+            .agg(aggregations)
+            .reset_index()[df.columns]
+        )
+    elif duplicate_keys_policy in ("first", "last"):
+        df_deduplicated = df[
+            ~df.duplicated(
+                subset=data_conflict_properties, keep=duplicate_keys_policy
+            )
+        ]
+    else:
+        raise ValueError(
+            "duplicate_keys_policy must be `first`, `last` or a dict of "
+            f"aggregations, got `{duplicate_keys_policy}`"
+        )
+
+    num_duplicate_rows = len(df) - len(df_deduplicated)
+    logger.info(
+        f"Dropped {num_duplicate_rows} rows with duplicate "
+        f"{data_conflict_properties}..."
+    )
+    return df_deduplicated, num_duplicate_rows
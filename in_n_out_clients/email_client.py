@@ -5,6 +5,8 @@ from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.utils import make_msgid
 
+from in_n_out_clients.instrumentation import get_instrumentation
+
 # from email.mime.text import MIMEText
 
 
@@ -100,20 +102,30 @@ class EmailClient:
         return session
 
     def send_email(self):
-        logger.info(
-            (
-                f"Starting `{self.connection_strategy}` connection to "
-                f"`{self.provider} SMTP server...`"
+        instrumentation = get_instrumentation()
+        with instrumentation.span(
+            "email.send_email", provider=self.provider
+        ) as span:
+            logger.info(
+                (
+                    f"Starting `{self.connection_strategy}` connection to "
+                    f"`{self.provider} SMTP server...`"
+                )
             )
-        )
 
-        session = getattr(self, f"_connect_{self.connection_strategy}")()
+            session = getattr(self, f"_connect_{self.connection_strategy}")()
+            span.add(
+                "round_trips", 2 if self.connection_strategy == "tls" else 1
+            )
 
-        logger.info("Connection made. Logging in...")
-        session.login(
-            self.sender_email, self.password
-        )  # login with mail_id and password
-        text = self.message.as_string()
-        session.sendmail(self.sender_email, self.recipient_email, text)
-        logger.info("Email sent")
-        session.quit()
+            logger.info("Connection made. Logging in...")
+            session.login(
+                self.sender_email, self.password
+            )  # login with mail_id and password
+            text = self.message.as_string()
+            session.sendmail(self.sender_email, self.recipient_email, text)
+            logger.info("Email sent")
+            session.quit()
+            span.add("round_trips", 3)
+            span.add("recipients", len(self.recipient_email))
+            span.add("bytes", len(text))
@@ -1,23 +1,20 @@
 from __future__ import print_function
 
+import hashlib
+import json
 import logging
-import os.path
+import time
 from typing import List
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
-from in_n_out_clients.config import (
-    GOOGLE_OAUTH_CREDENTIAL_FILE,
-    GOOGLE_OAUTH_TOKEN,
-)
+from in_n_out_clients.google_credentials import get_credentials
 from in_n_out_clients.in_n_out_types import (
     APIResponse,
     ConflictResolutionStrategy,
 )
+from in_n_out_clients.instrumentation import Span, get_instrumentation
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -36,38 +33,26 @@ class GoogleCalendarClient:
     def initialise(
         self,
     ):
-        credentials = None
-        if os.path.exists(GOOGLE_OAUTH_TOKEN):
-            logger.info("Detected google oauth token... validating...")
-            credentials = Credentials.from_authorized_user_file(
-                GOOGLE_OAUTH_TOKEN, SCOPES
-            )
-            if credentials.expired and credentials.refresh_token:
-                logger.info("Credentials have expired... refreshing...")
-                credentials.refresh(Request())
-                with open(GOOGLE_OAUTH_TOKEN, "w") as f:
-                    f.write(credentials.to_json())
-        else:
-            # TODO initial initialisation not working... need to fix this
-            try:
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    GOOGLE_OAUTH_CREDENTIAL_FILE, SCOPES
-                )
-            except FileNotFoundError as file_not_found_error:
-                raise ConnectionError(
-                    f"Could not find Google OAuth Credentals file: `{GOOGLE_OAUTH_CREDENTIAL_FILE}`"
-                ) from file_not_found_error
-
-            logger.info("Running flow...")
-            credentials = flow.run_local_server()
-            with open(GOOGLE_OAUTH_TOKEN, "w") as f:
-                f.write(credentials.to_json())
+        credentials = get_credentials(SCOPES)
 
         logger.info("Initialising client...")
-        client = build("calendar", "v3", credentials=credentials)
+        client = build(
+            "calendar", "v3", credentials=credentials, cache_discovery=False
+        )
 
         return client
 
+    def close(self):
+        """Close the http connections of the calendar api client."""
+        self.client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
     # ignore, replace, fail
     # -- ignore: if you find conflicts, you ignore the request.
     # No error returned but should indicate that table was not created
@@ -182,6 +167,45 @@ class GoogleCalendarClient:
 
         return conflict_metadata
 
+    def _generate_event_id(self, event, data_conflict_properties):
+        """Internal function to derive a stable event id from the values of
+        the conflict properties of an event. The id is a sha256 hex digest,
+        which is valid base32hex as required by the calendar api."""
+        event_conflict_identifiers = {
+            conflict_property: event[conflict_property]
+            for conflict_property in data_conflict_properties
+        }
+        return hashlib.sha256(
+            json.dumps(
+                event_conflict_identifiers, sort_keys=True, default=str
+            ).encode()
+        ).hexdigest()
+
+    def _insert_event_with_id(
+        self, events_session, calendar_id, event, on_data_conflict, span
+    ):
+        """Internal function to insert an event with a known id without
+        checking for conflicts first. If an event with the same id exists,
+        it is updated when on_data_conflict=`replace`.
+
+        :return: whether an event with the same id already existed
+        """
+        span.add("round_trips")
+        try:
+            events_session.insert(calendarId=calendar_id, body=event).execute()
+        except HttpError as http_error:
+            if http_error.status_code != 409:
+                raise
+        else:
+            return False
+
+        if on_data_conflict == ConflictResolutionStrategy.REPLACE:
+            span.add("round_trips")
+            events_session.update(
+                calendarId=calendar_id, eventId=event["id"], body=event
+            ).execute()
+        return True
+
     # TODO problem with doing it this way is that we won't be able to expose which parameters are doing what!
 
     def _write(
@@ -191,6 +215,7 @@ class GoogleCalendarClient:
         on_data_conflict: str = "fail",
         on_asset_conflict: str = "append",
         data_conflict_properties: List[str] | None = None,
+        idempotent: bool = False,
     ):
         """_summary_
 
@@ -204,6 +229,9 @@ class GoogleCalendarClient:
         :type on_data_conflict: _type_
         :param data_conflict_properties: _description_
         :type data_conflict_properties: _type_
+        :param idempotent: derive event ids from data_conflict_properties
+            instead of looking up conflicts, see `create_events`
+        :type idempotent: bool
         :raises NotImplementedError: _description_
         :raises NotImplementedError: _description_
         :raises NotImplementedError: _description_
@@ -218,6 +246,7 @@ class GoogleCalendarClient:
             on_asset_conflict=on_asset_conflict,
             on_data_conflict=on_data_conflict,
             data_conflict_properties=data_conflict_properties,
+            idempotent=idempotent,
         )
 
         return resp
@@ -233,6 +262,7 @@ class GoogleCalendarClient:
         on_data_conflict: str = "fail",
         data_conflict_properties: list | None = None,
         create_calendar_if_not_exist: bool = False,  # how to specify HOW to create the calendar...!
+        idempotent: bool = False,
     ) -> APIResponse:
         """Function to add events to a calendar.
 
@@ -251,7 +281,52 @@ class GoogleCalendarClient:
         :param data_conflict_properties: event properties to check for conflicts, defaults to None
         :param create_calendar_if_not_exist: flag to create a calendar
                 if it does not already exist, defaults to False
+        :param idempotent: derive the id of each event from a hash of its
+            data_conflict_properties and insert it without looking up
+            conflicts first. An event that already exists is then detected
+            by the 409 of the insert, which makes retries safe. Events that
+            already have an `id` keep it. With on_data_conflict=`fail`,
+            events written before the conflicting one are kept. Not
+            supported with on_data_conflict=`append`, defaults to False
         """
+        if (
+            idempotent
+            and on_data_conflict == ConflictResolutionStrategy.APPEND
+        ):
+            raise ValueError(
+                "idempotent writes can not append duplicate events, use "
+                "on_data_conflict=`ignore`, `replace` or `fail` instead"
+            )
+
+        with get_instrumentation().span(
+            "google_calendar.create_events", calendar_id=calendar_id
+        ) as span:
+            span.add("events", len(events))
+            return self._create_events(
+                calendar_id=calendar_id,
+                events=events,
+                on_asset_conflict=on_asset_conflict,
+                on_data_conflict=on_data_conflict,
+                data_conflict_properties=data_conflict_properties,
+                create_calendar_if_not_exist=create_calendar_if_not_exist,
+                idempotent=idempotent,
+                span=span,
+            )
+
+    def _create_events(
+        self,
+        calendar_id: str,
+        events: list,
+        on_asset_conflict: str,
+        on_data_conflict: str,
+        data_conflict_properties: list | None,
+        create_calendar_if_not_exist: bool,
+        idempotent: bool,
+        span: Span,
+    ) -> APIResponse:
+        """Internal function with the body of `create_events`, which it
+        calls inside its span."""
+        span.add("round_trips")
         try:
             calendars = self._get_calendars()
         except HttpError as http_error:
@@ -313,8 +388,13 @@ class GoogleCalendarClient:
                         "on_asset_conflict set to `append`... ignoring any conflicts..."
                     )
 
-        if on_data_conflict == ConflictResolutionStrategy.REPLACE:
-            raise NotImplementedError("No support for this yet")
+        if (
+            on_data_conflict == ConflictResolutionStrategy.REPLACE
+            and not idempotent
+        ):
+            raise NotImplementedError(
+                "No support for this yet, use idempotent=True"
+            )
 
         # if ignore --> if there is a conflict, then don't commit the conflicting item
         # if append --> don't do any checks
@@ -328,9 +408,25 @@ class GoogleCalendarClient:
         num_events_to_create = len(events_to_create)
         logger.info(f"Got {num_events_to_create} events to write")
 
-        if on_data_conflict != ConflictResolutionStrategy.APPEND:
+        conflict_events = []
+        if idempotent:
+            # -- conflicts are detected by the insert itself, see
+            # `_insert_event_with_id`
+            for event_id, event in events_to_create.items():
+                _data_conflict_properties = (
+                    list(event.keys())
+                    if data_conflict_properties is None
+                    else data_conflict_properties
+                )
+                events_to_create[event_id] = {
+                    "id": self._generate_event_id(
+                        event, _data_conflict_properties
+                    ),
+                    **event,
+                }
+        elif on_data_conflict != ConflictResolutionStrategy.APPEND:
             logger.info(f"Checking {num_events_to_create} for conflicts...")
-            conflict_events = []
+            conflict_check_start = time.perf_counter()
             for event_count, event_id in enumerate(
                 list(events_to_create.keys())
             ):
@@ -353,6 +449,7 @@ class GoogleCalendarClient:
                 logger.debug(
                     f"Searching calendar_id=`{calendar_id}` for events with the following properties: {_data_conflict_properties}"
                 )
+                span.add("round_trips")
                 try:
                     event_list = events_session.list(
                         calendarId=calendar_id, **conflict_metadata
@@ -417,6 +514,10 @@ class GoogleCalendarClient:
             # check that the input events contain the on conflict columns
             # if not, AND if on_conflict is fail, then you MUST delete the table created if it had been created
             # ?
+            span.add(
+                "conflict_check_seconds",
+                time.perf_counter() - conflict_check_start,
+            )
         # if failed writes, need to return 207 code. E.g. no guarantee of success
         # if all failed writes, need to return failure, e.g. 400
         if not events_to_create:
@@ -436,15 +537,26 @@ class GoogleCalendarClient:
         num_events_to_create = len(events_to_create)
         logger.info(f"Writing {num_events_to_create} events...")
         failed_writes = []
+        write_start = time.perf_counter()
         for event_count, (event_id, event) in enumerate(
             events_to_create.items()
         ):
             # TODO add debug logs
             try:
-                # TODO remember, replace needs to go here (e.g. update!)
-                events_session.insert(
-                    calendarId=calendar_id, body=event
-                ).execute()
+                if idempotent:
+                    event_exists = self._insert_event_with_id(
+                        events_session,
+                        calendar_id,
+                        event,
+                        on_data_conflict,
+                        span,
+                    )
+                else:
+                    span.add("round_trips")
+                    events_session.insert(
+                        calendarId=calendar_id, body=event
+                    ).execute()
+                    event_exists = False
             except HttpError as http_error:
                 status_code = http_error.status_code
                 logger.error(
@@ -460,8 +572,47 @@ class GoogleCalendarClient:
                         "status_code": status_code,
                     }
                 )
+                continue
+
+            if not event_exists:
+                continue
+            match on_data_conflict:
+                case ConflictResolutionStrategy.FAIL:
+                    logger.error(
+                        f"Event {event_count+1}/{num_events_to_create} already exists... exiting process since on_data_conflict=`fail`..."
+                    )
+                    return {
+                        "status_code": 409,
+                        "msg": (
+                            f"At least one event to write conflicts with events from calendar=`{calendar_id}` on the following conflict properties `{data_conflict_properties}`. {event_count} events were written before it"
+                        ),
+                        "data": [
+                            {
+                                "event_to_write": event,
+                                "event_id": event_id,
+                                "id_of_events_that_conflict": [event["id"]],
+                            }
+                        ],
+                    }
+                case ConflictResolutionStrategy.IGNORE:
+                    logger.info(
+                        f"Dropped event_id `{event_id}` since it already exists and on_data_conflict=`ignore`..."
+                    )
+                    conflict_events.append(
+                        {
+                            "event_to_write": event,
+                            "event_id": event_id,
+                            "id_of_events_that_conflict": [event["id"]],
+                        }
+                    )
+                case ConflictResolutionStrategy.REPLACE:
+                    logger.info(
+                        f"Replaced existing event with id `{event['id']}`..."
+                    )
+        span.add("write_seconds", time.perf_counter() - write_start)
 
         num_failed_writes = len(failed_writes)
+        span.add("failed_writes", num_failed_writes)
         if not failed_writes:
             _msg = f"Successfully wrote {num_events_to_create} events to calendar. No failures occurred in write process."
             logger.info(_msg)
@@ -0,0 +1,297 @@
+import contextlib
+import datetime
+import logging
+import os
+import sys
+import tempfile
+import threading
+import weakref
+from typing import List
+
+import google.auth
+from google.auth.credentials import Credentials as BaseCredentials
+from google.auth.exceptions import DefaultCredentialsError, GoogleAuthError
+from google.auth.transport.requests import Request
+from google.oauth2 import service_account
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+
+from in_n_out_clients.config import (
+    GOOGLE_CREDENTIALS_REFRESH_MARGIN,
+    GOOGLE_OAUTH_ALLOW_INTERACTIVE,
+    GOOGLE_OAUTH_CREDENTIAL_FILE,
+    GOOGLE_OAUTH_TOKEN,
+    GOOGLE_SERVICE_ACCOUNT_FILE,
+)
+
+try:
+    import fcntl
+except ImportError:  # -- not available on windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# -- seconds to wait before retrying a failed background refresh
+_REFRESH_RETRY_INTERVAL = 30
+
+
+@contextlib.contextmanager
+def _file_lock(path: str):
+    """Exclusive lock shared between processes, used so that only one
+    process refreshes and rewrites the token file at a time."""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _atomic_write(path: str, content: str):
+    """Write a file such that readers never see a partially written file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def _is_attached_to_terminal() -> bool:
+    """Whether the process can interact with a user, i.e. stdin is a
+    terminal. stdin is None e.g. in daemons and windows GUI apps."""
+    try:
+        return sys.stdin is not None and sys.stdin.isatty()
+    except ValueError:  # -- stdin is closed
+        return False
+
+
+def _seconds_to_expiry(credentials: BaseCredentials) -> float | None:
+    if credentials.expiry is None:
+        return None
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return (credentials.expiry - now).total_seconds()
+
+
+class GoogleCredentialProvider:
+    """Loads google credentials once per process without user interaction
+    and keeps them fresh by refreshing them in the background before they
+    expire.
+
+    Credentials are looked up in the following order:
+    1. service account key file (`GOOGLE_SERVICE_ACCOUNT_FILE`)
+    2. authorised user token file (`GOOGLE_OAUTH_TOKEN`)
+    3. application default credentials
+    4. browser based oauth flow, if `allow_interactive` is True
+
+    :param scopes: oauth scopes to request
+    :param token_file: path to the authorised user token file, defaults to
+        GOOGLE_OAUTH_TOKEN
+    :param credential_file: path to the oauth client secrets used by the
+        interactive flow, defaults to GOOGLE_OAUTH_CREDENTIAL_FILE
+    :param service_account_file: path to a service account key file,
+        defaults to GOOGLE_SERVICE_ACCOUNT_FILE
+    :param refresh_margin: seconds before expiry at which credentials are
+        refreshed, defaults to GOOGLE_CREDENTIALS_REFRESH_MARGIN
+    :param allow_interactive: whether the interactive oauth flow may be run,
+        if None it is run only when attached to a terminal, defaults to
+        GOOGLE_OAUTH_ALLOW_INTERACTIVE
+    """
+
+    def __init__(
+        self,
+        scopes: List[str],
+        token_file: str = GOOGLE_OAUTH_TOKEN,
+        credential_file: str = GOOGLE_OAUTH_CREDENTIAL_FILE,
+        service_account_file: str | None = GOOGLE_SERVICE_ACCOUNT_FILE,
+        refresh_margin: int = GOOGLE_CREDENTIALS_REFRESH_MARGIN,
+        allow_interactive: bool | None = GOOGLE_OAUTH_ALLOW_INTERACTIVE,
+    ):
+        self.scopes = scopes
+        self.token_file = token_file
+        self.credential_file = credential_file
+        self.service_account_file = service_account_file
+        self.refresh_margin = refresh_margin
+        self.allow_interactive = allow_interactive
+
+        self.credentials = None
+        self._uses_token_file = False
+        self._lock = threading.Lock()
+        self._refresh_timer = None
+        _credential_providers.add(self)
+
+    def get_credentials(self) -> BaseCredentials:
+        """Get the cached credentials, loading them on first use.
+
+        :return: google credentials
+        """
+        with self._lock:
+            if self.credentials is None:
+                self.credentials = self._load()
+            # -- e.g. expired token file or service account credentials
+            # that have not fetched a token yet
+            if not self.credentials.valid:
+                self._refresh()
+            elif self._refresh_timer is None:
+                self._schedule_refresh()
+            return self.credentials
+
+    def _load(self) -> BaseCredentials:
+        if self.service_account_file is not None:
+            logger.info("Loading google service account credentials...")
+            return service_account.Credentials.from_service_account_file(
+                self.service_account_file, scopes=self.scopes
+            )
+
+        if os.path.exists(self.token_file):
+            logger.info("Detected google oauth token...")
+            self._uses_token_file = True
+            return Credentials.from_authorized_user_file(
+                self.token_file, self.scopes
+            )
+
+        try:
+            credentials, _ = google.auth.default(scopes=self.scopes)
+        except DefaultCredentialsError:
+            logger.debug("No application default credentials found")
+        else:
+            logger.info("Using application default credentials...")
+            return credentials
+
+        allow_interactive = self.allow_interactive
+        if allow_interactive is None:
+            allow_interactive = _is_attached_to_terminal()
+        if not allow_interactive:
+            raise ConnectionError(
+                "Could not find google credentials. Provide a service "
+                "account file, an oauth token file or application default "
+                "credentials, or set GOOGLE_OAUTH_ALLOW_INTERACTIVE=true"
+            )
+
+        try:
+            flow = InstalledAppFlow.from_client_secrets_file(
+                self.credential_file, self.scopes
+            )
+        except FileNotFoundError as file_not_found_error:
+            raise ConnectionError(
+                "Could not find Google OAuth Credentals file: "
+                f"`{self.credential_file}`"
+            ) from file_not_found_error
+
+        logger.info("Running flow...")
+        credentials = flow.run_local_server()
+        with _file_lock(f"{self.token_file}.lock"):
+            _atomic_write(self.token_file, credentials.to_json())
+        self._uses_token_file = True
+        return credentials
+
+    def _refresh(self):
+        """Refresh the credentials in place, so every client holding them
+        sees the new token."""
+        if not self._uses_token_file:
+            self.credentials.refresh(Request())
+            self._schedule_refresh()
+            return
+
+        with _file_lock(f"{self.token_file}.lock"):
+            # -- another process may have refreshed the token already
+            credentials_on_disk = Credentials.from_authorized_user_file(
+                self.token_file, self.scopes
+            )
+            seconds_to_expiry = _seconds_to_expiry(credentials_on_disk)
+            if (
+                seconds_to_expiry is not None
+                and seconds_to_expiry > self.refresh_margin
+            ):
+                logger.debug("Using token refreshed by another process")
+                self.credentials.token = credentials_on_disk.token
+                self.credentials.expiry = credentials_on_disk.expiry
+            else:
+                logger.info("Refreshing google oauth token...")
+                self.credentials.refresh(Request())
+                _atomic_write(self.token_file, self.credentials.to_json())
+        self._schedule_refresh()
+
+    def _schedule_refresh(self, delay: float | None = None):
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+            self._refresh_timer = None
+
+        if delay is None:
+            seconds_to_expiry = _seconds_to_expiry(self.credentials)
+            if seconds_to_expiry is None:
+                return
+            delay = max(seconds_to_expiry - self.refresh_margin, 0)
+
+        self._refresh_timer = threading.Timer(delay, self._background_refresh)
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+
+    def _background_refresh(self):
+        with self._lock:
+            try:
+                self._refresh()
+            # -- e.g. RefreshError or a TransportError from a network blip,
+            # which would otherwise stop refreshes for the process
+            except (GoogleAuthError, OSError) as error:
+                logger.warning(
+                    f"Background refresh of google credentials failed. "
+                    f"Reason: {error}. Retrying in "
+                    f"{_REFRESH_RETRY_INTERVAL} seconds..."
+                )
+                self._schedule_refresh(delay=_REFRESH_RETRY_INTERVAL)
+
+    def close(self):
+        """Stop refreshing the credentials in the background."""
+        with self._lock:
+            if self._refresh_timer is not None:
+                self._refresh_timer.cancel()
+                self._refresh_timer = None
+
+    def _rearm_after_fork(self):
+        """Internal function to restart the background refresh in a forked
+        child process, which inherits the timer but not its thread."""
+        # -- the lock may have been held by a thread of the parent
+        self._lock = threading.Lock()
+        if self._refresh_timer is not None:
+            self._refresh_timer = None
+            self._schedule_refresh()
+
+
+# -- all credential providers, so that their background refresh can be
+# restarted in forked child processes
+_credential_providers = weakref.WeakSet()
+
+
+def _rearm_refresh_timers_after_fork():
+    for provider in list(_credential_providers):
+        provider._rearm_after_fork()
+
+
+if hasattr(os, "register_at_fork"):  # -- not available on windows
+    os.register_at_fork(after_in_child=_rearm_refresh_timers_after_fork)
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_credentials(scopes: List[str]) -> BaseCredentials:
+    """Get google credentials for the given scopes, shared by all clients in
+    the process.
+
+    :param scopes: oauth scopes to request
+    :return: google credentials
+    """
+    key = tuple(sorted(scopes))
+    with _providers_lock:
+        provider = _providers.get(key)
+        if provider is None:
+            provider = _providers[key] = GoogleCredentialProvider(list(key))
+    return provider.get_credentials()
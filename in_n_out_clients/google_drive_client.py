@@ -1,15 +1,501 @@
-from pydrive2.auth import GoogleAuth
-from pydrive2.drive import GoogleDrive
+import io
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Iterator
+
+import requests
+from google.auth.transport.requests import AuthorizedSession
+
+from in_n_out_clients.google_credentials import get_credentials
+from in_n_out_clients.in_n_out_types import (
+    APIResponse,
+    ConflictResolutionStrategy,
+)
+from in_n_out_clients.instrumentation import get_instrumentation
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ["https://www.googleapis.com/auth/drive"]
+
+DRIVE_API_URL = "https://www.googleapis.com"
+
+# -- drive requires upload chunks to be multiples of 256 KiB
+UPLOAD_CHUNK_SIZE_MULTIPLE = 256 * 1024
+DEFAULT_UPLOAD_CHUNK_SIZE = 32 * UPLOAD_CHUNK_SIZE_MULTIPLE
+DEFAULT_DOWNLOAD_CHUNK_SIZE = 32 * 1024 * 1024
+
+# -- status codes after which a request is retried
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class ResumableUploadError(Exception):
+    """Raised when a resumable upload fails after all retries. Raised with
+    `(msg, session_uri)`.
+
+    The session uri can be passed back to `GoogleDriveClient.upload` to
+    resume the upload from the last byte the server received.
+    """
+
+    @property
+    def session_uri(self) -> str:
+        return self.args[1]
+
+    def __str__(self):
+        return self.args[0]
+
+
+def _quote_query_value(value: str) -> str:
+    escaped_value = value.replace("\\", "\\\\").replace("'", "\\'")
+    return "'" + escaped_value + "'"
+
+
+def _get_offset_from_range_header(response: requests.Response) -> int:
+    """Get the offset to resume an upload from, using the `Range` header of
+    a 308 response, e.g. `bytes=0-1023` means the next byte is 1024."""
+    received_range = response.headers.get("Range")
+    if received_range is None:
+        return 0
+    return int(received_range.rsplit("-", 1)[1]) + 1
 
 
 class GoogleDriveClient:
-    def __init__(self):
-        pass
+    """Client for reading and writing files on Google Drive. Uploads use
+    the resumable upload protocol and downloads fetch byte ranges in
+    parallel.
+
+    :param session: an authorised `requests.Session`, defaults to a session
+        built from the google oauth token
+    :param api_url: base url of the drive api, defaults to DRIVE_API_URL
+    :param upload_chunk_size: number of bytes sent per upload request, must
+        be a multiple of 256 KiB, defaults to DEFAULT_UPLOAD_CHUNK_SIZE
+    :param download_chunk_size: number of bytes fetched per ranged download
+        request, defaults to DEFAULT_DOWNLOAD_CHUNK_SIZE
+    :param num_download_workers: number of ranges downloaded concurrently,
+        defaults to 4
+    :param max_retries: number of times a failed request is retried,
+        defaults to 5
+    """
+
+    def __init__(
+        self,
+        session: requests.Session | None = None,
+        api_url: str = DRIVE_API_URL,
+        upload_chunk_size: int = DEFAULT_UPLOAD_CHUNK_SIZE,
+        download_chunk_size: int = DEFAULT_DOWNLOAD_CHUNK_SIZE,
+        num_download_workers: int = 4,
+        max_retries: int = 5,
+    ):
+        if upload_chunk_size % UPLOAD_CHUNK_SIZE_MULTIPLE:
+            raise ValueError(
+                f"upload_chunk_size must be a multiple of "
+                f"{UPLOAD_CHUNK_SIZE_MULTIPLE} bytes"
+            )
+        self.api_url = api_url.rstrip("/")
+        self.upload_chunk_size = upload_chunk_size
+        self.download_chunk_size = download_chunk_size
+        self.num_download_workers = num_download_workers
+        self.max_retries = max_retries
+        # -- sessions passed in are closed by whoever created them
+        self._owns_session = session is None
+        self.session = (
+            session if session is not None else self.initialise_client()
+        )
 
     def initialise_client(self):
-        gauth = GoogleAuth()
-        gauth.LocalWebserverAuth()
-        self.drive = GoogleDrive(gauth)
+        credentials = get_credentials(SCOPES)
+        logger.info("Initialising client...")
+        return AuthorizedSession(credentials)
+
+    def close(self):
+        """Close the pooled connections of the session, if it was created by
+        this client."""
+        if self._owns_session:
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Send a request, retrying with exponential backoff on connection
+        errors and retryable status codes."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.ConnectionError as connection_error:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(
+                    f"Request to `{url}` failed. Reason: {connection_error}"
+                )
+            else:
+                if (
+                    response.status_code not in RETRYABLE_STATUS_CODES
+                    or attempt == self.max_retries
+                ):
+                    return response
+                logger.warning(
+                    f"Request to `{url}` failed with status code "
+                    f"{response.status_code}"
+                )
+            time.sleep(min(2**attempt * 0.1, 10))
+
+    def query(self, q: str, fields: str = "files(id, name, size)") -> list:
+        """List files matching a drive search query.
+
+        :param q: drive search query, see
+            https://developers.google.com/drive/api/guides/search-files
+        :param fields: file fields to return
+        :return: list of file metadata
+        """
+        files = []
+        params = {"q": q, "fields": f"nextPageToken, {fields}"}
+        while True:
+            response = self._request(
+                "GET", f"{self.api_url}/drive/v3/files", params=params
+            )
+            response.raise_for_status()
+            body = response.json()
+            files.extend(body.get("files", []))
+            page_token = body.get("nextPageToken")
+            if page_token is None:
+                return files
+            params["pageToken"] = page_token
+
+    def _find_files(self, name: str, parent_id: str | None) -> list:
+        q = f"name = {_quote_query_value(name)} and trashed = false"
+        if parent_id is not None:
+            q += f" and {_quote_query_value(parent_id)} in parents"
+        return self.query(q)
+
+    def _write(
+        self,
+        table_name: str,
+        data,
+        on_data_conflict: str = "append",
+        dataset_name: str | None = None,
+    ) -> APIResponse:
+        """Internal function that is used by `InNOutClient` as a universal
+        write entry.
+
+        :param table_name: name of the file to write
+        :param data: content of the file, either a path to a local file,
+            bytes or a binary file-like object
+        :param on_data_conflict: how to behave if a file with the same name
+            already exists in the folder, defaults to "append" (e.g. create
+            another file with the same name)
+        :param dataset_name: id of the folder to write the file to,
+            defaults to None
+        """
+        file_id = None
+        if on_data_conflict != ConflictResolutionStrategy.APPEND:
+            conflicting_files = self._find_files(table_name, dataset_name)
+            if conflicting_files:
+                match on_data_conflict:
+                    case ConflictResolutionStrategy.FAIL:
+                        _msg = (
+                            f"file `{table_name}` already exists and "
+                            f"on_data_conflict=`{on_data_conflict}`"
+                        )
+                        logger.error(_msg)
+                        return {
+                            "status_code": 409,
+                            "msg": _msg,
+                            "data": [{"conflicting_files": conflicting_files}],
+                        }
+                    case ConflictResolutionStrategy.IGNORE:
+                        _msg = (
+                            f"file `{table_name}` already exists but request "
+                            "dropped since on_data_conflict=`ignore`"
+                        )
+                        logger.info(_msg)
+                        return {"status_code": 200, "msg": _msg}
+                    case ConflictResolutionStrategy.REPLACE:
+                        file_id = conflicting_files[0]["id"]
+
+        if isinstance(data, (str, os.PathLike)):
+            with open(data, "rb") as file_obj:
+                return self._upload_with_response(
+                    file_obj, table_name, dataset_name, file_id
+                )
+        if isinstance(data, bytes):
+            data = io.BytesIO(data)
+        return self._upload_with_response(
+            data, table_name, dataset_name, file_id
+        )
+
+    def _upload_with_response(
+        self, file_obj, name, parent_id, file_id
+    ) -> APIResponse:
+        try:
+            file_metadata = self.upload(
+                file_obj, name=name, parent_id=parent_id, file_id=file_id
+            )
+        except ResumableUploadError as upload_error:
+            logger.error(str(upload_error))
+            return {
+                "status_code": 500,
+                "msg": str(upload_error),
+                "data": [{"session_uri": upload_error.session_uri}],
+            }
+        _msg = f"Successfully wrote file `{name}`"
+        logger.info(_msg)
+        return {"status_code": 201, "msg": _msg, "data": [file_metadata]}
+
+    def _start_upload_session(
+        self,
+        name: str,
+        parent_id: str | None,
+        file_id: str | None,
+        total_size: int,
+        mime_type: str,
+    ) -> str:
+        headers = {
+            "X-Upload-Content-Type": mime_type,
+            "X-Upload-Content-Length": str(total_size),
+            "Content-Type": "application/json; charset=UTF-8",
+        }
+        metadata = {"name": name}
+        if file_id is None:
+            if parent_id is not None:
+                metadata["parents"] = [parent_id]
+            method, url = "POST", f"{self.api_url}/upload/drive/v3/files"
+        else:
+            method = "PATCH"
+            url = f"{self.api_url}/upload/drive/v3/files/{file_id}"
+
+        response = self._request(
+            method,
+            url,
+            params={"uploadType": "resumable"},
+            headers=headers,
+            data=json.dumps(metadata),
+        )
+        response.raise_for_status()
+        return response.headers["Location"]
+
+    def _get_upload_offset(self, session_uri: str, total_size: int):
+        """Ask the server how many bytes of the upload it has received.
+
+        :return: the offset to resume from, or the file metadata if the
+            upload is already complete
+        """
+        response = self._request(
+            "PUT",
+            session_uri,
+            headers={"Content-Range": f"bytes */{total_size}"},
+        )
+        if response.status_code in (200, 201):
+            return response.json()
+        if response.status_code != 308:
+            response.raise_for_status()
+        return _get_offset_from_range_header(response)
+
+    def _upload_chunk(self, session_uri, file_obj, offset, total_size):
+        """Send the chunk of the file starting at `offset`.
+
+        :return: tuple of the response (None if the connection failed) and
+            the reason for failure
+        """
+        file_obj.seek(offset)
+        chunk = file_obj.read(self.upload_chunk_size)
+        if chunk:
+            end = offset + len(chunk) - 1
+            content_range = f"bytes {offset}-{end}/{total_size}"
+        else:
+            content_range = f"bytes */{total_size}"
+
+        try:
+            response = self.session.put(
+                session_uri,
+                headers={"Content-Range": content_range},
+                data=chunk,
+            )
+        except requests.ConnectionError as connection_error:
+            return None, f"chunk `{content_range}` failed ({connection_error})"
+        return (
+            response,
+            f"chunk `{content_range}` failed "
+            f"(status code {response.status_code})",
+        )
+
+    def upload(
+        self,
+        file_obj: BinaryIO,
+        name: str,
+        parent_id: str | None = None,
+        file_id: str | None = None,
+        mime_type: str = "application/octet-stream",
+        session_uri: str | None = None,
+    ) -> dict:
+        """Upload a file in chunks using a resumable upload session. If a
+        chunk fails, the upload resumes from the last byte the server
+        received.
+
+        :param file_obj: seekable binary file-like object to upload
+        :param name: name of the file on drive
+        :param parent_id: id of the folder to upload the file to, defaults
+            to None
+        :param file_id: id of an existing file to overwrite, defaults to None
+        :param mime_type: mime type of the file, defaults to
+            "application/octet-stream"
+        :param session_uri: uri of an interrupted upload session to resume,
+            defaults to None
+        :raises ResumableUploadError: if the upload fails after all retries
+        :return: metadata of the uploaded file
+        """
+        file_obj.seek(0, os.SEEK_END)
+        total_size = file_obj.tell()
+
+        with get_instrumentation().span(
+            "google_drive.upload", file_name=name
+        ) as span:
+            span.add("bytes", total_size)
+            if session_uri is None:
+                session_uri = self._start_upload_session(
+                    name, parent_id, file_id, total_size, mime_type
+                )
+                span.add("round_trips")
+                offset = 0
+            else:
+                offset = self._get_upload_offset(session_uri, total_size)
+                span.add("round_trips")
+                if isinstance(offset, dict):
+                    return offset
+
+            num_failures = 0
+            while True:
+                response, reason = self._upload_chunk(
+                    session_uri, file_obj, offset, total_size
+                )
+                span.add("round_trips")
+                if response is not None and response.status_code in (200, 201):
+                    return response.json()
+                if response is not None and response.status_code == 308:
+                    offset = _get_offset_from_range_header(response)
+                    num_failures = 0
+                    continue
+
+                num_failures += 1
+                span.add("retries")
+                if num_failures > self.max_retries:
+                    raise ResumableUploadError(
+                        f"Failed to upload `{name}` after {self.max_retries} "
+                        f"retries. Reason: {reason}",
+                        session_uri,
+                    )
+                logger.warning(
+                    f"Upload of `{name}`: {reason}... resuming upload"
+                )
+                time.sleep(min(2 ** (num_failures - 1) * 0.1, 10))
+                span.add("round_trips")
+                try:
+                    offset = self._get_upload_offset(session_uri, total_size)
+                except requests.RequestException as request_exception:
+                    raise ResumableUploadError(
+                        f"Failed to resume upload of `{name}`. "
+                        f"Reason: {request_exception}",
+                        session_uri,
+                    ) from request_exception
+                if isinstance(offset, dict):
+                    return offset
+
+    def _get_file_size(self, file_id: str) -> int:
+        response = self._request(
+            "GET",
+            f"{self.api_url}/drive/v3/files/{file_id}",
+            params={"fields": "size"},
+        )
+        response.raise_for_status()
+        return int(response.json()["size"])
+
+    def _download_range(self, file_id: str, start: int, end: int, fd: int):
+        response = self._request(
+            "GET",
+            f"{self.api_url}/drive/v3/files/{file_id}",
+            params={"alt": "media"},
+            headers={"Range": f"bytes={start}-{end}"},
+            stream=True,
+        )
+        response.raise_for_status()
+        offset = start
+        for content in response.iter_content(chunk_size=1024 * 1024):
+            os.pwrite(fd, content, offset)
+            offset += len(content)
+        if offset != end + 1:
+            raise ConnectionError(
+                f"Expected bytes {start}-{end} of file `{file_id}` but "
+                f"received {offset - start} bytes"
+            )
+
+    def download(self, file_id: str, path: str) -> APIResponse:
+        """Download a file to disk, fetching byte ranges concurrently and
+        writing each straight to its offset in the destination file.
+
+        :param file_id: id of the file to download
+        :param path: local path to write the file to
+        """
+        total_size = self._get_file_size(file_id)
+        ranges = [
+            (start, min(start + self.download_chunk_size, total_size) - 1)
+            for start in range(0, total_size, self.download_chunk_size)
+        ]
+        logger.info(
+            f"Downloading {total_size} bytes of file `{file_id}` in "
+            f"{len(ranges)} ranges..."
+        )
+
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, total_size)
+            with ThreadPoolExecutor(
+                max_workers=self.num_download_workers
+            ) as executor:
+                futures = [
+                    executor.submit(
+                        self._download_range, file_id, start, end, fd
+                    )
+                    for start, end in ranges
+                ]
+                for future in futures:
+                    future.result()
+        finally:
+            os.close(fd)
+
+        _msg = f"Successfully downloaded file `{file_id}` to `{path}`"
+        logger.info(_msg)
+        return {
+            "status_code": 200,
+            "msg": _msg,
+            "data": [{"num_bytes": total_size, "num_ranges": len(ranges)}],
+        }
+
+    def _read(
+        self, file_id: str, chunk_size: int | None = None
+    ) -> Iterator[bytes]:
+        """Internal function that is used by `InNOutClient` as a universal
+        read entry. Streams the content of a file in byte chunks.
 
-    def query(self):
-        pass
+        :param file_id: id of the file to read
+        :param chunk_size: number of bytes per chunk, defaults to
+            `download_chunk_size`
+        :returns: iterator of bytes
+        """
+        chunk_size = chunk_size or self.download_chunk_size
+        total_size = self._get_file_size(file_id)
+        for start in range(0, total_size, chunk_size):
+            end = min(start + chunk_size, total_size) - 1
+            response = self._request(
+                "GET",
+                f"{self.api_url}/drive/v3/files/{file_id}",
+                params={"alt": "media"},
+                headers={"Range": f"bytes={start}-{end}"},
+            )
+            response.raise_for_status()
+            yield response.content
@@ -0,0 +1,208 @@
+import threading
+import time
+from collections import defaultdict
+
+
+class Span:
+    """A timed unit of work, e.g. a write or one of its phases. The base
+    class records nothing, and is what is used when instrumentation is
+    disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set_attribute(self, key: str, value):
+        """Attach a descriptive attribute to the span, e.g. a table name."""
+        pass
+
+    def add(self, key: str, value: int | float = 1):
+        """Increment a counter on the span, e.g. rows, bytes or
+        round_trips."""
+        pass
+
+
+_NOOP_SPAN = Span()
+
+
+class Instrumentation:
+    """Instrumentation hook used by the clients. The base class is a no-op,
+    so instrumentation costs a single method call when disabled.
+
+    Clients check `enabled` before computing attributes that are expensive
+    to measure, e.g. the number of bytes in a dataframe.
+    """
+
+    enabled = False
+
+    def span(self, name: str, /, **attributes) -> Span:
+        """Start a span, to be used as a context manager.
+
+        :param name: name of the span, e.g. `postgres.write`
+        :param attributes: attributes to attach to the span
+        """
+        return _NOOP_SPAN
+
+
+class MetricsRegistry:
+    """Thread-safe in-process registry of counters and latency summaries."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._summaries = {}
+
+    def increment(self, name: str, value: int | float = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            summary = self._summaries.get(name)
+            if summary is None:
+                self._summaries[name] = {
+                    "count": 1,
+                    "sum": value,
+                    "min": value,
+                    "max": value,
+                }
+            else:
+                summary["count"] += 1
+                summary["sum"] += value
+                summary["min"] = min(summary["min"], value)
+                summary["max"] = max(summary["max"], value)
+
+    def snapshot(self) -> dict:
+        """Get a copy of all metrics recorded so far.
+
+        :return: dictionary with `counters` and `summaries`
+        """
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "summaries": {
+                    name: dict(summary)
+                    for name, summary in self._summaries.items()
+                },
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._summaries.clear()
+
+
+class _RecordingSpan(Span):
+    def __init__(self, name: str, registry: MetricsRegistry, attributes):
+        self.name = name
+        self.registry = registry
+        self.attributes = attributes
+        self.counters = {}
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.registry.observe(
+            f"{self.name}.duration_seconds", time.perf_counter() - self._start
+        )
+        self.registry.increment(f"{self.name}.calls")
+        if exc_type is not None:
+            self.registry.increment(f"{self.name}.errors")
+        for key, value in self.counters.items():
+            self.registry.increment(f"{self.name}.{key}", value)
+        return False
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def add(self, key: str, value: int | float = 1):
+        self.counters[key] = self.counters.get(key, 0) + value
+
+
+class MetricsInstrumentation(Instrumentation):
+    """Instrumentation that records span latencies and counters in a
+    `MetricsRegistry`.
+
+    :param registry: registry to record metrics in, defaults to a new one
+    """
+
+    enabled = True
+
+    def __init__(self, registry: MetricsRegistry | None = None):
+        self.registry = registry if registry is not None else MetricsRegistry()
+
+    def span(self, name: str, /, **attributes) -> Span:
+        return _RecordingSpan(name, self.registry, attributes)
+
+
+class _OpenTelemetrySpan(Span):
+    def __init__(self, tracer, name: str, attributes):
+        self._context_manager = tracer.start_as_current_span(
+            name, attributes=attributes
+        )
+        self._span = None
+        self.counters = {}
+
+    def __enter__(self):
+        self._span = self._context_manager.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for key, value in self.counters.items():
+            self._span.set_attribute(key, value)
+        return self._context_manager.__exit__(exc_type, exc_value, traceback)
+
+    def set_attribute(self, key: str, value):
+        self._span.set_attribute(key, value)
+
+    def add(self, key: str, value: int | float = 1):
+        self.counters[key] = self.counters.get(key, 0) + value
+
+
+class OpenTelemetryInstrumentation(Instrumentation):
+    """Instrumentation that emits OpenTelemetry spans. Counters are attached
+    to the span as attributes when it ends.
+
+    :param tracer: tracer to use, defaults to the tracer of the global
+        tracer provider
+    """
+
+    enabled = True
+
+    def __init__(self, tracer=None):
+        if tracer is None:
+            try:
+                from opentelemetry import trace
+            except ImportError as import_error:
+                raise ImportError(
+                    "OpenTelemetryInstrumentation requires `opentelemetry-api`"
+                    ". Install it with `pip install in-n-out-clients[otel]`"
+                ) from import_error
+            tracer = trace.get_tracer("in_n_out_clients")
+        self.tracer = tracer
+
+    def span(self, name: str, /, **attributes) -> Span:
+        return _OpenTelemetrySpan(self.tracer, name, attributes)
+
+
+_instrumentation = Instrumentation()
+
+
+def get_instrumentation() -> Instrumentation:
+    return _instrumentation
+
+
+def set_instrumentation(instrumentation: Instrumentation | None):
+    """Set the instrumentation used by all clients.
+
+    :param instrumentation: instrumentation to use, None disables it
+    """
+    global _instrumentation
+    _instrumentation = (
+        instrumentation if instrumentation is not None else Instrumentation()
+    )
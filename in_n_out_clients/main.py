@@ -1,18 +1,41 @@
 import inspect
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
 
+import pandas as pd
+
+from in_n_out_clients.bigquery_client import BigQueryClient
+from in_n_out_clients.buffered_writer import BufferedWriter
 from in_n_out_clients.google_calendar_client import GoogleCalendarClient
+from in_n_out_clients.google_drive_client import GoogleDriveClient
+from in_n_out_clients.in_n_out_types import (
+    APIResponse,
+    ConflictResolutionStrategy,
+)
+from in_n_out_clients.instrumentation import get_instrumentation
+from in_n_out_clients.parquet_client import ParquetClient
 from in_n_out_clients.postgres_client import PostgresClient
+from in_n_out_clients.transfer import run_transfer
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# -- `data_format` is the format of the data the `_write` method of the
+# client takes, data is converted to it once per format by `fan_out`
 DATABASE_TYPE_TO_CLIENT_MAPPING = {
     "pg": {
         "client_class": PostgresClient,
+        "data_format": "dataframe",
+    },
+    "google_calendar": {
+        "client_class": GoogleCalendarClient,
+        "data_format": "records",
     },
-    "google_calendar": {"client_class": GoogleCalendarClient},
-    "bq": {"client_class": None},
+    "google_drive": {"client_class": GoogleDriveClient, "data_format": None},
+    "bq": {"client_class": BigQueryClient, "data_format": "dataframe"},
+    "parquet": {"client_class": ParquetClient, "data_format": "dataframe"},
 }
 
 
@@ -42,6 +65,28 @@ def get_function_parameters(method, exclude_self=True):
     return params
 
 
+def _to_dataframe(data) -> pd.DataFrame:
+    if isinstance(data, pd.DataFrame):
+        return data
+    return pd.DataFrame(data)
+
+
+def _to_records(data) -> List[dict]:
+    if isinstance(data, pd.DataFrame):
+        return data.to_dict(orient="records")
+    return data
+
+
+DATA_FORMAT_CONVERTERS = {"dataframe": _to_dataframe, "records": _to_records}
+
+
+def _get_num_records(data) -> int:
+    try:
+        return len(data)
+    except TypeError:
+        return 0
+
+
 for database_type in DATABASE_TYPE_TO_CLIENT_MAPPING:
     client_class = DATABASE_TYPE_TO_CLIENT_MAPPING[database_type][
         "client_class"
@@ -126,6 +171,19 @@ class InNOutClient:
         client_instance = client_class(**connection_params)
         return client_instance
 
+    def close(self):
+        """Close the connections of the underlying client."""
+        close = getattr(self.client, "close", None)
+        if close is not None:
+            close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
     def create_asset(self):
         pass
 
@@ -144,6 +202,7 @@ class InNOutClient:
         on_data_conflict: str = "append",
         on_asset_conflict: str = "append",
         data_conflict_properties: list | None = None,
+        **write_options,
     ):
         """Generic function to write data to any resource. Note that the
         purpose of this is solely to write data to an existing resource.
@@ -157,6 +216,8 @@ class InNOutClient:
         :param on_asset_conflict: how to behave if there is an asset conflict,
             defaults to "append"
         :param data_conflict_properties: what properties to check for conflicts
+        :param write_options: client specific options passed to the `_write`
+            method of the client, e.g. `dry_run` for postgres
 
         Note: data can be of any type, not limited to dataframes. This is done
         to plan for the future when we add more clients!
@@ -180,6 +241,18 @@ class InNOutClient:
             self.database_type
         ]["write_method_params"]
 
+        supported_params = {
+            param_metadata["param_name"]
+            for param_metadata in write_method_params
+        }
+        unsupported_options = set(write_options) - supported_params
+        if unsupported_options:
+            raise TypeError(
+                f"Client for `{self.database_type}` does not support write "
+                f"options: {sorted(unsupported_options)}"
+            )
+        input_arguments.update(write_options)
+
         filtered_params = {}
         for param_metadata in write_method_params:
             is_required = param_metadata["is_required"]
@@ -201,14 +274,286 @@ class InNOutClient:
             f"Calling `_write` method of `{self.database_type}` client..."
         )
 
-        resp = self.client._write(**filtered_params)
+        instrumentation = get_instrumentation()
+        with instrumentation.span(
+            "in_n_out.write",
+            database_type=self.database_type,
+            table_name=table_name,
+            on_data_conflict=on_data_conflict,
+        ) as span:
+            if instrumentation.enabled:
+                span.add("rows", _get_num_records(data))
+            resp = self.client._write(**filtered_params)
+            span.set_attribute("status_code", resp.get("status_code"))
 
         return resp
 
-    def read(
+    def buffered_writer(self, **buffered_writer_params) -> BufferedWriter:
+        """Get a writer that buffers small writes to this client and writes
+        them in bulk, e.g.
+
+        ```
+        with client.buffered_writer(max_rows=5000) as writer:
+            writer.write("events", events_df)
+        ```
+
+        :param buffered_writer_params: parameters of `BufferedWriter`
+        :return: buffered writer, to be closed after use
+        """
+        return BufferedWriter(self, **buffered_writer_params)
+
+    def transaction(self):
+        """Run several writes in one transaction, for clients that support
+        it, e.g.
+
+        ```
+        with client.transaction():
+            client.write("dimension", dimension_df)
+            client.write("fact", fact_df)
+        ```
+        """
+        transaction = getattr(self.client, "transaction", None)
+        if transaction is None:
+            raise NotImplementedError(
+                f"Client for `{self.database_type}` does not support "
+                "transactions"
+            )
+        return transaction()
+
+    def read(self, **read_params):
+        """Generic function to read data from any resource that supports it.
+
+        :param read_params: parameters passed to the `_read` method of the
+            client, e.g. `query` and `chunksize` for postgres
+        :return: iterator of chunks of data
+        """
+        read_method = getattr(self.client, "_read", None)
+        if read_method is None:
+            raise NotImplementedError(
+                f"Client for `{self.database_type}` does not support reads"
+            )
+        return read_method(**read_params)
+
+    def resolve_asset_conflict(
         self,
-    ):
-        pass
+        table_name: str,
+        dataset_name: str | None = None,
+        on_asset_conflict: str = "append",
+    ) -> tuple:
+        """Resolve `on_asset_conflict` once for data that is written in
+        several chunks, before any chunk is written. Later chunks must be
+        appended, so a table that exists is never partially written to when
+        on_asset_conflict is `fail` or `ignore`.
+
+        :param table_name: name of the table the chunks are written to
+        :param dataset_name: name of the dataset the table belongs to, if
+            any, defaults to None
+        :param on_asset_conflict: how to behave if the table already exists,
+            defaults to "append"
+        :return: response to return instead of writing any chunk, or None if
+            the chunks should be written, and the `on_asset_conflict` to write
+            the first chunk with
+        """
+        if on_asset_conflict not in (
+            ConflictResolutionStrategy.FAIL,
+            ConflictResolutionStrategy.IGNORE,
+        ):
+            return None, on_asset_conflict
+
+        asset_exists = getattr(self.client, "_asset_exists", None)
+        if asset_exists is None:
+            raise NotImplementedError(
+                f"Client for `{self.database_type}` does not support "
+                f"on_asset_conflict=`{on_asset_conflict}` when writing in "
+                "chunks"
+            )
+        if asset_exists(table_name, dataset_name):
+            match on_asset_conflict:
+                case ConflictResolutionStrategy.FAIL:
+                    _msg = (
+                        f"table `{table_name}` exists and "
+                        f"on_asset_conflict=`{on_asset_conflict}`"
+                    )
+                    logger.error(_msg)
+                    return {"status_code": 409, "msg": _msg, "data": []}, None
+                case ConflictResolutionStrategy.IGNORE:
+                    _msg = (
+                        f"table `{table_name}` exists but request dropped "
+                        "since on_asset_conflict=`ignore`"
+                    )
+                    logger.info(_msg)
+                    return {"status_code": 200, "msg": _msg, "data": []}, None
+
+        # -- if the table is created by someone else before the first chunk
+        # is written, fail instead of appending the later chunks to it
+        return None, ConflictResolutionStrategy.FAIL.value
+
+    @staticmethod
+    def transfer(
+        source: "InNOutClient",
+        target: "InNOutClient",
+        table_name: str,
+        read_params: dict,
+        dataset_name: str | None = None,
+        on_data_conflict: str = "append",
+        on_asset_conflict: str = "append",
+        data_conflict_properties: list | None = None,
+        transform=None,
+        max_queue_size: int = 4,
+    ) -> APIResponse:
+        """Stream data from one client into another. Reading from `source`,
+        transforming and writing to `target` run concurrently, with at most
+        `max_queue_size` chunks buffered between stages.
+
+        :param source: client to read data from
+        :param target: client to write data to
+        :param table_name: name of the table to write data to
+        :param read_params: parameters for `source.read`
+        :param dataset_name: name of the dataset to write to, if any,
+            defaults to None
+        :param on_data_conflict: how to behave if there is a conflict,
+            defaults to "append"
+        :param on_asset_conflict: how to behave if there is an asset
+            conflict, defaults to "append". Resolved before any data is
+            read, see `resolve_asset_conflict`
+        :param data_conflict_properties: what properties to check for
+            conflicts
+        :param transform: function applied to each chunk before writing,
+            defaults to None
+        :param max_queue_size: maximum number of chunks buffered between
+            two stages, defaults to 4
+        :return: summary of the transfer
+        """
+
+        resp, first_chunk_on_asset_conflict = target.resolve_asset_conflict(
+            table_name, dataset_name, on_asset_conflict
+        )
+        if resp is not None:
+            return resp
+
+        def _write_chunk(chunk, chunk_number):
+            return target.write(
+                table_name=table_name,
+                data=chunk,
+                dataset_name=dataset_name,
+                on_data_conflict=on_data_conflict,
+                on_asset_conflict=(
+                    first_chunk_on_asset_conflict
+                    if chunk_number == 0
+                    else "append"
+                ),
+                data_conflict_properties=data_conflict_properties,
+            )
+
+        logger.info(
+            f"Transferring data from `{source.database_type}` client to "
+            f"`{target.database_type}` client..."
+        )
+        return run_transfer(
+            chunks=source.read(**read_params),
+            write_chunk=_write_chunk,
+            transform=transform,
+            max_queue_size=max_queue_size,
+        )
+
+    @staticmethod
+    def fan_out(
+        data, targets: List[dict], max_workers: int | None = None
+    ) -> APIResponse:
+        """Write the same data to several targets concurrently, e.g.
+
+        ```
+        InNOutClient.fan_out(
+            df,
+            targets=[
+                {"client": pg_client, "table_name": "events"},
+                {
+                    "client": calendar_client,
+                    "table_name": "calendar_id",
+                    "on_data_conflict": "ignore",
+                    "data_conflict_properties": ["id"],
+                },
+            ],
+        )
+        ```
+
+        The data is converted once for each format the clients take (e.g.
+        a dataframe for tables, records for calendar events) and shared by
+        all targets with that format, so it must not be modified by them.
+        Writes to the same table are not coordinated, so targets should
+        write to different tables.
+
+        :param data: the data to write, e.g. a dataframe or list of records
+        :param targets: targets to write to, each with the client to write
+            with as `client` and the parameters of `InNOutClient.write`
+            for the target, e.g. `table_name` and `on_data_conflict`
+        :param max_workers: maximum number of targets written to at the
+            same time, defaults to one per target
+        :return: response of each target with the seconds its write took.
+            The status code is 200 if all writes succeeded (status codes below
+            400), 207 otherwise
+        """
+        data_by_format = {}
+        for target in targets:
+            data_format = DATABASE_TYPE_TO_CLIENT_MAPPING[
+                target["client"].database_type
+            ]["data_format"]
+            if data_format not in data_by_format:
+                convert = DATA_FORMAT_CONVERTERS.get(data_format)
+                data_by_format[data_format] = (
+                    data if convert is None else convert(data)
+                )
+
+        def _write_to_target(target):
+            client = target["client"]
+            write_params = {
+                param_name: param_value
+                for param_name, param_value in target.items()
+                if param_name != "client"
+            }
+            data_format = DATABASE_TYPE_TO_CLIENT_MAPPING[
+                client.database_type
+            ]["data_format"]
+            start_time = time.perf_counter()
+            try:
+                resp = client.write(
+                    data=data_by_format[data_format], **write_params
+                )
+            except Exception as error:
+                logger.exception(
+                    f"Failed to write to `{target.get('table_name')}` with "
+                    f"`{client.database_type}` client"
+                )
+                resp = {"status_code": 500, "msg": str(error), "data": []}
+            return {
+                "database_type": client.database_type,
+                "table_name": target.get("table_name"),
+                "seconds": time.perf_counter() - start_time,
+                "response": resp,
+            }
+
+        logger.info(f"Writing data to {len(targets)} targets...")
+        start_time = time.perf_counter()
+        with get_instrumentation().span("in_n_out.fan_out") as span:
+            span.add("targets", len(targets))
+            with ThreadPoolExecutor(
+                max_workers=max_workers or max(1, len(targets))
+            ) as executor:
+                results = list(executor.map(_write_to_target, targets))
+
+        # -- e.g. created calendar events and uploaded files return 201
+        num_failed = sum(
+            result["response"].get("status_code", 200) >= 400
+            for result in results
+        )
+        return {
+            "status_code": 207 if num_failed else 200,
+            "msg": (
+                f"wrote to {len(targets) - num_failed} of {len(targets)} "
+                f"targets in {time.perf_counter() - start_time:.2f}s"
+            ),
+            "data": results,
+        }
 
 
 if __name__ == "__main__":
@@ -0,0 +1,595 @@
+import contextlib
+import logging
+import os
+import shutil
+import threading
+import urllib.parse
+import uuid
+from typing import Iterator, List
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from in_n_out_clients.deduplication import drop_duplicate_keys
+from in_n_out_clients.in_n_out_types import (
+    APIResponse,
+    ConflictResolutionStrategy,
+)
+
+try:
+    import fcntl
+except ImportError:  # -- windows, writes are only serialised per process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# -- sidecar file of a table with the conflict keys of every row and the file
+# the row is in. Files starting with `_` are ignored when reading a dataset
+KEY_INDEX_FILE_NAME = "_keys.parquet"
+_FILE_COLUMN = "_file"
+_KEYS_METADATA_KEY = b"in_n_out_keys"
+
+_table_locks = {}
+_table_locks_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _lock_table(table_path: str):
+    """Internal context manager to serialise writes to a table, across
+    threads with a lock per table and across processes with a lock file next
+    to the table. The lock file is outside of the table directory since
+    replacing a table renames it."""
+    table_path = os.path.abspath(table_path)
+    with _table_locks_lock:
+        lock = _table_locks.setdefault(table_path, threading.Lock())
+
+    parent_path, table_name = os.path.split(table_path)
+    os.makedirs(parent_path, exist_ok=True)
+    lock_path = os.path.join(parent_path, f".{table_name}.lock")
+    with lock, open(lock_path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+class ParquetClient:
+    """Client for writing to and reading from local parquet datasets. Each
+    table is a directory of parquet files at
+    `{database_name}/{dataset_name}/{table_name}`, optionally hive
+    partitioned by columns.
+
+    Conflicts are resolved using a key index sidecar in the table directory,
+    which maps the `data_conflict_properties` of every row to the file that
+    holds it, so that writes never need to scan the data files. Writes to a
+    table are serialised, across threads and processes, so that the key
+    index stays consistent with the data files.
+
+    :param database_name: root directory of the datasets, defaults to the
+        current directory
+    :param compression: parquet compression codec, defaults to "zstd"
+    :param row_group_size: maximum number of rows per row group, defaults to
+        131072
+    :param max_rows_per_file: maximum number of rows per file, defaults to
+        1048576
+    """
+
+    def __init__(
+        self,
+        database_name: str = ".",
+        compression: str = "zstd",
+        row_group_size: int = 128 * 1024,
+        max_rows_per_file: int = 1024 * 1024,
+    ):
+        self.root = database_name
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.max_rows_per_file = max_rows_per_file
+
+    def close(self):
+        """Nothing to close, files are closed after every read and write."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _get_table_path(self, table_name: str, dataset_name: str | None):
+        if dataset_name is None:
+            return os.path.join(self.root, table_name)
+        return os.path.join(self.root, dataset_name, table_name)
+
+    def _asset_exists(self, table_name: str, dataset_name: str | None) -> bool:
+        return os.path.isdir(self._get_table_path(table_name, dataset_name))
+
+    def _write(
+        self,
+        table_name: str,
+        data: pd.DataFrame,
+        on_data_conflict: str = "append",
+        on_asset_conflict: str = "append",
+        dataset_name: str | None = None,
+        data_conflict_properties: List[str] | None = None,
+        partition_cols: List[str] | None = None,
+        duplicate_keys_policy: str | dict | None = None,
+    ) -> APIResponse:
+        """Internal function that is used by `InNOutClient` as a universal
+        write entry.
+
+        :param table_name: name of the table to write to
+        :param data: dataframe to write
+        :param on_data_conflict: how to behave if some of the rows to
+                write already exist, defaults to "append"
+        :param on_asset_conflict: how to behave if the table already exists,
+                defaults to "append"
+        :param dataset_name: name of the directory that the table belongs
+                to, defaults to None
+        :param data_conflict_properties: columns to check for conflicts,
+                defaults to None
+        :param partition_cols: columns to hive partition the table by.
+                Must be the same for every write to a table, defaults to None
+        :param duplicate_keys_policy: how rows of the data with the same
+                data_conflict_properties are deduplicated before writing,
+                so that the key index has one row per key. "first" or "last"
+                keeps the first or last row, a dict maps columns to the
+                aggregation used to combine them. Defaults to "last" for
+                on_data_conflict="replace", otherwise to "first". Not applied
+                when on_data_conflict="append"
+        """
+        resp = self.write(
+            df=data,
+            table_name=table_name,
+            dataset_name=dataset_name,
+            on_asset_conflict=on_asset_conflict,
+            on_data_conflict=on_data_conflict,
+            data_conflict_properties=data_conflict_properties,
+            partition_cols=partition_cols,
+            duplicate_keys_policy=duplicate_keys_policy,
+        )
+
+        return resp
+
+    def write(
+        self,
+        df: pd.DataFrame,
+        table_name: str,
+        dataset_name: str | None,
+        on_asset_conflict: str,
+        on_data_conflict: str,
+        data_conflict_properties: List[str] | None = None,
+        partition_cols: List[str] | None = None,
+        duplicate_keys_policy: str | dict | None = None,
+    ) -> APIResponse:
+        table_path = self._get_table_path(table_name, dataset_name)
+        with _lock_table(table_path):
+            return self._write_locked(
+                df,
+                table_path,
+                on_asset_conflict,
+                on_data_conflict,
+                data_conflict_properties,
+                partition_cols,
+                duplicate_keys_policy,
+            )
+
+    def _write_locked(
+        self,
+        df: pd.DataFrame,
+        table_path: str,
+        on_asset_conflict: str,
+        on_data_conflict: str,
+        data_conflict_properties: List[str] | None,
+        partition_cols: List[str] | None,
+        duplicate_keys_policy: str | dict | None,
+    ) -> APIResponse:
+        table_exists = os.path.isdir(table_path)
+
+        if table_exists:
+            match on_asset_conflict:
+                case ConflictResolutionStrategy.FAIL:
+                    _msg = (
+                        f"table `{table_path}` exists and "
+                        f"on_asset_conflict=`{on_asset_conflict}`"
+                    )
+                    logger.error(_msg)
+                    return {"status_code": 409, "msg": _msg}
+                case ConflictResolutionStrategy.IGNORE:
+                    _msg = (
+                        f"table `{table_path}` exists but request dropped "
+                        "since on_asset_conflict=`ignore`"
+                    )
+                    logger.info(_msg)
+                    return {"status_code": 200, "msg": _msg}
+                case ConflictResolutionStrategy.REPLACE:
+                    return self._replace_table(
+                        df,
+                        table_path,
+                        data_conflict_properties,
+                        partition_cols,
+                    )
+
+        return self._write_table(
+            df,
+            table_path,
+            on_data_conflict=on_data_conflict,
+            data_conflict_properties=data_conflict_properties,
+            partition_cols=partition_cols,
+            duplicate_keys_policy=duplicate_keys_policy,
+        )
+
+    def _write_table(
+        self,
+        df: pd.DataFrame,
+        table_path: str,
+        on_data_conflict: str,
+        data_conflict_properties: List[str] | None,
+        partition_cols: List[str] | None,
+        duplicate_keys_policy: str | dict | None = None,
+    ) -> APIResponse:
+        """Internal function to write to a table. New rows are written to new
+        files first, then the files with rows they replace are rewritten and
+        the key index is written last, so a failed write never loses rows.
+        """
+        if on_data_conflict != ConflictResolutionStrategy.APPEND and (
+            not data_conflict_properties
+        ):
+            _msg = (
+                f"on_data_conflict=`{on_data_conflict}` requires "
+                "data_conflict_properties"
+            )
+            logger.error(_msg)
+            return {"status_code": 400, "msg": _msg}
+
+        df, num_duplicate_rows = drop_duplicate_keys(
+            df,
+            on_data_conflict=on_data_conflict,
+            data_conflict_properties=data_conflict_properties,
+            duplicate_keys_policy=duplicate_keys_policy,
+        )
+        key_index = None
+        is_replaced = None
+        if data_conflict_properties:
+            key_index = self._read_key_index(
+                table_path, data_conflict_properties
+            )
+            df, is_replaced, resp = self._resolve_conflicts(
+                df, key_index, on_data_conflict, data_conflict_properties
+            )
+            if resp is not None:
+                return resp
+
+        files = self._write_files(df, table_path, partition_cols)
+        if is_replaced is not None:
+            self._remove_rows(table_path, key_index, is_replaced)
+            key_index = key_index[~is_replaced]
+        if data_conflict_properties:
+            self._write_key_index(
+                table_path,
+                data_conflict_properties,
+                [
+                    key_index,
+                    _get_key_index(df, data_conflict_properties, files),
+                ],
+            )
+
+        _msg = f"Successfully wrote {len(df)} rows to `{table_path}`"
+        logger.info(_msg)
+        return {
+            "status_code": 200,
+            "msg": _msg,
+            "data": [
+                {
+                    "num_rows": len(df),
+                    "num_files": len(set(files)),
+                    "num_duplicate_rows_dropped": num_duplicate_rows,
+                }
+            ],
+        }
+
+    def _replace_table(
+        self,
+        df: pd.DataFrame,
+        table_path: str,
+        data_conflict_properties: List[str] | None,
+        partition_cols: List[str] | None,
+    ) -> APIResponse:
+        """Internal function to replace a table. The new table is written
+        next to the old one and swapped in with renames, so readers never
+        see a partially written table."""
+        new_table_path = f"{table_path}.tmp-{uuid.uuid4().hex[:8]}"
+        old_table_path = f"{table_path}.old-{uuid.uuid4().hex[:8]}"
+        try:
+            resp = self._write_table(
+                df,
+                new_table_path,
+                on_data_conflict=ConflictResolutionStrategy.APPEND,
+                data_conflict_properties=data_conflict_properties,
+                partition_cols=partition_cols,
+            )
+            os.rename(table_path, old_table_path)
+            os.rename(new_table_path, table_path)
+        finally:
+            shutil.rmtree(new_table_path, ignore_errors=True)
+        shutil.rmtree(old_table_path, ignore_errors=True)
+        resp["msg"] = f"Successfully replaced `{table_path}`"
+        return resp
+
+    def _resolve_conflicts(
+        self,
+        df: pd.DataFrame,
+        key_index: pd.DataFrame | None,
+        on_data_conflict: str,
+        data_conflict_properties: List[str],
+    ) -> tuple:
+        """Internal function to resolve conflicts between the data and the
+        table.
+
+        :return: data to write, which rows of the key index are replaced by
+            the data (None if there are none), and the response to return
+            instead of writing, if any
+        """
+        if key_index is None or key_index.empty:
+            return df, None, None
+
+        is_conflicting = _isin(df, key_index, data_conflict_properties)
+        num_conflicting_rows = int(is_conflicting.sum())
+        if not num_conflicting_rows:
+            return df, None, None
+        logger.info(f"Found {num_conflicting_rows} conflicting rows...")
+
+        match on_data_conflict:
+            case ConflictResolutionStrategy.FAIL:
+                logger.error("Exiting process since on_data_conflict=fail")
+                return (
+                    df,
+                    None,
+                    {
+                        "status_code": 409,
+                        "msg": f"Found {num_conflicting_rows} conflicting rows",
+                        "data": [
+                            {
+                                "data_conflict_properties": (
+                                    data_conflict_properties
+                                ),
+                                "first_5_conflicting_rows": (
+                                    df.loc[
+                                        is_conflicting,
+                                        data_conflict_properties,
+                                    ]
+                                    .head()
+                                    .astype(str)
+                                    .to_dict(orient="records")
+                                ),
+                            }
+                        ],
+                    },
+                )
+            case ConflictResolutionStrategy.IGNORE:
+                logger.info("Ignoring conflicting rows...")
+                return df[~is_conflicting], None, None
+            case ConflictResolutionStrategy.REPLACE:
+                is_replaced = _isin(key_index, df, data_conflict_properties)
+                return df, is_replaced, None
+        return df, None, None
+
+    def _remove_rows(
+        self, table_path: str, key_index: pd.DataFrame, is_removed: pd.Series
+    ):
+        """Internal function to remove rows from the files of a table. Rows
+        of the key index of each file are in the same order as in the file.
+        All files are rewritten to temporary files before any is swapped in,
+        so the table is unchanged if rewriting fails.
+        """
+        temp_paths = {}
+        removed_paths = []
+        try:
+            for file_name in key_index.loc[is_removed, _FILE_COLUMN].unique():
+                is_file = key_index[_FILE_COLUMN] == file_name
+                is_kept = ~is_removed[is_file].to_numpy()
+                file_path = os.path.join(table_path, file_name)
+                if not is_kept.any():
+                    removed_paths.append(file_path)
+                    continue
+                table = pq.read_table(file_path).filter(pa.array(is_kept))
+                temp_paths[file_path] = self._write_temp_file(table, file_path)
+        except Exception:
+            for temp_path in temp_paths.values():
+                os.remove(temp_path)
+            raise
+
+        for file_path, temp_path in temp_paths.items():
+            os.replace(temp_path, file_path)
+        for file_path in removed_paths:
+            os.remove(file_path)
+
+    def _write_files(
+        self,
+        df: pd.DataFrame,
+        table_path: str,
+        partition_cols: List[str] | None,
+    ) -> List[str]:
+        """Internal function to write a dataframe to new files of a table.
+
+        :return: name of the file, relative to the table, of each row
+        """
+        os.makedirs(table_path, exist_ok=True)
+        partition_cols = partition_cols or []
+        df = df.reset_index(drop=True)
+        if partition_cols:
+            groups = df.groupby(partition_cols, sort=False, dropna=False)
+        else:
+            groups = [((), df)]
+
+        files = np.empty(len(df), dtype=object)
+        for partition_values, partition_df in groups:
+            if not isinstance(partition_values, tuple):
+                partition_values = (partition_values,)
+            partition_dir = "".join(
+                f"{column}={urllib.parse.quote(str(value), safe='')}/"
+                for column, value in zip(
+                    partition_cols, partition_values, strict=True
+                )
+            )
+            os.makedirs(os.path.join(table_path, partition_dir), exist_ok=True)
+            file_data = partition_df.drop(columns=partition_cols)
+            for start in range(0, len(file_data), self.max_rows_per_file):
+                end = start + self.max_rows_per_file
+                file_name = f"{partition_dir}part-{uuid.uuid4().hex}.parquet"
+                self._write_file(
+                    pa.Table.from_pandas(
+                        file_data.iloc[start:end], preserve_index=False
+                    ),
+                    os.path.join(table_path, file_name),
+                )
+                # -- the index of `df` is its row positions
+                files[file_data.index[start:end]] = file_name
+        return files.tolist()
+
+    def _write_file(self, table: pa.Table, file_path: str):
+        """Internal function to write a parquet file such that readers never
+        see a partially written file."""
+        os.replace(self._write_temp_file(table, file_path), file_path)
+
+    def _write_temp_file(self, table: pa.Table, file_path: str) -> str:
+        """Internal function to write a parquet file next to `file_path`,
+        under a name that readers ignore.
+
+        :return: path of the written file
+        """
+        directory, file_name = os.path.split(file_path)
+        temp_path = os.path.join(
+            directory, f".{file_name}.{uuid.uuid4().hex}.tmp"
+        )
+        pq.write_table(
+            table,
+            temp_path,
+            row_group_size=self.row_group_size,
+            compression=self.compression,
+        )
+        return temp_path
+
+    def _read_key_index(
+        self, table_path: str, data_conflict_properties: List[str]
+    ) -> pd.DataFrame | None:
+        """Internal function to read the key index of a table, building it
+        from the data files if it is missing or for other keys.
+
+        :return: key index, or None if the table does not exist
+        """
+        if not os.path.isdir(table_path):
+            return None
+
+        key_index_path = os.path.join(table_path, KEY_INDEX_FILE_NAME)
+        if os.path.exists(key_index_path):
+            key_index = pq.read_table(key_index_path)
+            keys = (key_index.schema.metadata or {}).get(_KEYS_METADATA_KEY)
+            if keys == ",".join(data_conflict_properties).encode():
+                return key_index.to_pandas()
+
+        logger.info(f"Building key index of `{table_path}`...")
+        dataset = ds.dataset(table_path, format="parquet", partitioning="hive")
+        key_indices = [
+            fragment.to_table(
+                columns=data_conflict_properties, schema=dataset.schema
+            )
+            .to_pandas()
+            .assign(
+                **{_FILE_COLUMN: os.path.relpath(fragment.path, table_path)}
+            )
+            for fragment in dataset.get_fragments()
+        ]
+        key_index = pd.concat(
+            key_indices
+            or [
+                pd.DataFrame(columns=[*data_conflict_properties, _FILE_COLUMN])
+            ],
+            ignore_index=True,
+        )
+        self._write_key_index(
+            table_path, data_conflict_properties, [key_index]
+        )
+        return key_index
+
+    def _write_key_index(
+        self,
+        table_path: str,
+        data_conflict_properties: List[str],
+        key_indices: List[pd.DataFrame | None],
+    ):
+        key_index = pd.concat(
+            [
+                key_index
+                for key_index in key_indices
+                if key_index is not None and not key_index.empty
+            ]
+            or [
+                pd.DataFrame(columns=[*data_conflict_properties, _FILE_COLUMN])
+            ],
+            ignore_index=True,
+        )
+        table = pa.Table.from_pandas(key_index, preserve_index=False)
+        table = table.replace_schema_metadata(
+            {
+                **(table.schema.metadata or {}),
+                _KEYS_METADATA_KEY: ",".join(data_conflict_properties),
+            }
+        )
+        self._write_file(table, os.path.join(table_path, KEY_INDEX_FILE_NAME))
+
+    def _read(
+        self,
+        table_name: str,
+        dataset_name: str | None = None,
+        columns: List[str] | None = None,
+        filters=None,
+        chunksize: int = 100000,
+    ) -> Iterator[pd.DataFrame]:
+        """Internal function that is used by `InNOutClient` as a universal
+        read entry. Only the requested columns are read, and files, row
+        groups and partitions that can not match the filters are skipped.
+
+        :param table_name: name of the table to read
+        :param dataset_name: name of the directory that the table belongs
+            to, defaults to None
+        :param columns: columns to read, defaults to all columns
+        :param filters: filters in the `pyarrow.parquet` format, e.g.
+            `[("date", ">=", date)]`, or a `pyarrow.dataset.Expression`,
+            defaults to None
+        :param chunksize: maximum number of rows per yielded dataframe,
+            defaults to 100000
+        :returns: iterator of dataframes
+        """
+        table_path = self._get_table_path(table_name, dataset_name)
+        dataset = ds.dataset(table_path, format="parquet", partitioning="hive")
+        if filters is not None and not isinstance(filters, ds.Expression):
+            filters = pq.filters_to_expression(filters)
+        for batch in dataset.to_batches(
+            columns=columns, filter=filters, batch_size=chunksize
+        ):
+            if batch.num_rows:
+                yield batch.to_pandas()
+
+
+def _isin(
+    df: pd.DataFrame, other: pd.DataFrame, columns: List[str]
+) -> pd.Series:
+    """Internal function to find the rows of `df` whose values of `columns`
+    are in `other`, using a hash lookup."""
+    is_in = pd.MultiIndex.from_frame(df[columns]).isin(
+        pd.MultiIndex.from_frame(other[columns])
+    )
+    return pd.Series(is_in, index=df.index)
+
+
+def _get_key_index(
+    df: pd.DataFrame, data_conflict_properties: List[str], files: List[str]
+) -> pd.DataFrame:
+    return (
+        df[data_conflict_properties]
+        .assign(**{_FILE_COLUMN: files})
+        .reset_index(drop=True)
+    )
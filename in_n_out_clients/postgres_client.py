@@ -1,27 +1,92 @@
+import contextlib
 import datetime
+import gzip
+import hashlib
+import io
+import json
 import logging
+import os
+import re
+import threading
+import time
+import uuid
+import weakref
 from functools import partial
-from typing import List
+from typing import Iterable, Iterator, List
 
 import pandas as pd
 import sqlalchemy as db
-from pandas.api.types import is_datetime64tz_dtype
-from sqlalchemy import BOOLEAN, FLOAT, INTEGER, TIMESTAMP, VARCHAR
+from sqlalchemy import (
+    BIGINT,
+    BOOLEAN,
+    FLOAT,
+    INTEGER,
+    REAL,
+    SMALLINT,
+    TEXT,
+    VARCHAR,
+)
+from sqlalchemy.dialects.postgresql import (
+    ARRAY,
+    BYTEA,
+    DOUBLE_PRECISION,
+    ENUM,
+    JSONB,
+)
 
-from in_n_out_clients.in_n_out_types import ConflictResolutionStrategy
+from in_n_out_clients.deduplication import drop_duplicate_keys
+from in_n_out_clients.in_n_out_types import (
+    APIResponse,
+    ConflictResolutionStrategy,
+)
+from in_n_out_clients.instrumentation import get_instrumentation
+from in_n_out_clients.postgres_types import (
+    create_enum_types,
+    encode_categories,
+    get_pg_datatypes,
+)
+from in_n_out_clients.query_cache import (
+    QueryCache,
+    get_modified_tables,
+    get_referenced_tables,
+    is_read_query,
+)
+from in_n_out_clients.replica_router import ReplicaRouter
 
 # -- default values for use in upsert query when partial data provided: see
 # `insert_with_conflict_resolution`
 DEFAULT_VALUES_FOR_SQLALCHEMY_TYPES = {
     VARCHAR: "string",
+    TEXT: "string",
+    SMALLINT: -1,
     INTEGER: -1,
+    BIGINT: -1,
     FLOAT: -1.1,
+    REAL: -1.1,
+    DOUBLE_PRECISION: -1.1,
     BOOLEAN: False,
 }
 
 logger = logging.getLogger(__file__)
 
 
+# -- engines of all clients, so that their pools can be reset in forked
+# child processes
+_engines = weakref.WeakSet()
+
+
+def _reset_pools_after_fork():
+    """Internal function to drop the connections that a forked child
+    process inherited from its parent, without closing them, since they
+    are still used by the parent. The child opens its own connections."""
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+
+if hasattr(os, "register_at_fork"):  # -- not available on windows
+    os.register_at_fork(after_in_child=_reset_pools_after_fork)
+
+
 class OnDataConflictFail(Exception):
     """Raised when there are conflicts in the data if on_data_conflict is
     ConflictResolutionStrategy.FAIL."""
@@ -37,6 +102,14 @@ class PostgresClient:
     :param host: database host
     :param port: database port
     :param database_name: database name
+    :param query_cache: cache for the results of `query`, invalidated when
+        this client writes to a table, defaults to None (no caching)
+    :param replicas: read replicas of the database as "host" or
+        "host:port", with the same credentials and database name. Read only
+        queries outside of transactions are load balanced across the
+        replicas, everything else goes to the primary, defaults to None
+    :param max_replica_lag: maximum replication lag in seconds for a
+        replica to be read from, defaults to 10
     """
 
     def __init__(
@@ -46,12 +119,17 @@ class PostgresClient:
         host: str,
         port: int,
         database_name: str,
+        query_cache: QueryCache | None = None,
+        replicas: List[str] | None = None,
+        max_replica_lag: float = 10.0,
     ):
         self.db_user = username
         self.db_password = password
         self.db_host = host
         self.db_port = port
         self.db_name = database_name
+        self.query_cache = query_cache
+        self._local = threading.local()
         self.db_uri = (
             f"postgresql+psycopg2://{self.db_user}"
             f":{self.db_password}@{self.db_host}"
@@ -64,41 +142,389 @@ class PostgresClient:
                 "Could not connect to postgres client. "
                 f"Reason: {operational_error}"
             ) from operational_error
+        # -- monotonic time of the last write that invalidated cached results
+        self._last_invalidated_at = None
+        self.replica_router = None
+        if replicas:
+            self.replica_router = self._initialise_replica_router(
+                replicas, max_replica_lag
+            )
 
     def initialise_client(self):
         self.engine = db.create_engine(self.db_uri)
+        _engines.add(self.engine)
         return self.engine
 
-    def query(self, query: str) -> pd.DataFrame:
+    def close(self):
+        """Close all pooled connections of the client. Connections checked
+        out, e.g. by an open transaction, are closed when returned."""
+        self.engine.dispose()
+        if self.replica_router is not None:
+            self.replica_router.dispose()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _initialise_replica_router(
+        self, replicas: List[str], max_replica_lag: float
+    ) -> ReplicaRouter:
+        engines = []
+        for replica in replicas:
+            host, _, port = replica.partition(":")
+            engines.append(
+                db.create_engine(
+                    f"postgresql+psycopg2://{self.db_user}"
+                    f":{self.db_password}@{host}"
+                    f":{port or self.db_port}/{self.db_name}",
+                    # -- so that unreachable replicas fail health checks fast
+                    connect_args={"connect_timeout": 5},
+                )
+            )
+            _engines.add(engines[-1])
+        return ReplicaRouter(engines, max_lag=max_replica_lag)
+
+    @property
+    def in_transaction(self) -> bool:
+        """Whether the current thread is inside `transaction`."""
+        return getattr(self._local, "connection", None) is not None
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Run several calls of the client in one transaction, e.g.
+
+        ```
+        with client.transaction():
+            client.write(dimension_df, "dimension", ...)
+            client.write(fact_df, "fact", ...)
+        ```
+
+        All calls made by the current thread inside the block share one
+        connection and are committed together when the block exits, or
+        rolled back if it raises. Each write runs in a savepoint, and
+        conflicts with on_data_conflict=fail raise `OnDataConflictFail`
+        instead of returning a 409 response. Nested blocks use a savepoint.
+        Cached query results of the tables written to are invalidated once
+        the outermost block commits.
+
+        Enum types of category columns, and values added to them, are
+        committed before each write on a separate connection, since
+        postgres does not allow new enum values to be used in the
+        transaction that adds them. They are kept if the block rolls back.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            with connection.begin_nested():
+                yield self
+            return
+
+        tables_written = set()
+        with self.engine.begin() as connection:
+            self._local.connection = connection
+            self._local.tables_written = tables_written
+            try:
+                yield self
+            finally:
+                self._local.connection = None
+                self._local.tables_written = None
+        self._invalidate_cache(tables_written)
+
+    def _invalidate_cache(self, table_names: Iterable[str]):
+        """Internal function to invalidate the cached results of queries
+        that read from tables that were written to. Inside `transaction`,
+        the tables are invalidated when it commits, since other threads
+        read the old data until then."""
+        if self.query_cache is None:
+            return
+        tables_written = getattr(self._local, "tables_written", None)
+        if tables_written is not None:
+            tables_written.update(table_names)
+            return
+        # -- set before invalidating, so that a query that sees the new
+        # cache version also sees that replicas may not have the write yet
+        self._last_invalidated_at = time.monotonic()
+        for table_name in table_names:
+            self.query_cache.invalidate(table_name)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """Internal function to get the connection of the current
+        transaction, or a new connection if there is none."""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            yield connection
+            return
+        with self.engine.connect() as connection:
+            yield connection
+
+    @contextlib.contextmanager
+    def _connect_for_read(self, query: str, use_primary: bool = False):
+        """Internal function to get a connection to a healthy replica for a
+        read only query, or to the primary otherwise."""
+        engine = None
+        if not (
+            use_primary or self.replica_router is None or self.in_transaction
+        ) and is_read_query(query):
+            engine = self.replica_router.get_engine()
+
+        connection = None
+        if engine is not None:
+            try:
+                connection = engine.connect()
+            except db.exc.OperationalError:
+                logger.warning("Failed to connect to replica... using primary")
+                self.replica_router.mark_unhealthy(engine)
+
+        if connection is None:
+            with self._connect() as connection:
+                yield connection
+            return
+        with connection:
+            yield connection
+
+    def _replicas_have_writes(self) -> bool:
+        """Internal function to check whether the healthy replicas have
+        replayed the last write of the client that invalidated cached
+        results."""
+        return (
+            self.replica_router is None
+            or self._last_invalidated_at is None
+            or (
+                self.replica_router.replicated_until is not None
+                and self.replica_router.replicated_until
+                >= self._last_invalidated_at
+            )
+        )
+
+    @contextlib.contextmanager
+    def _begin(self):
+        """Internal function to begin a transaction, as a savepoint of the
+        current transaction if there is one."""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            with connection.begin_nested():
+                yield connection
+            return
+        with self.engine.begin() as connection:
+            yield connection
+
+    def query(
+        self,
+        query: str,
+        params: dict | None = None,
+        prepare: bool = False,
+        cache_ttl: float | None = None,
+        use_primary: bool = False,
+    ) -> pd.DataFrame:
         """Run a query against the databae.
 
-        :param query: query to run
+        :param query: query to run, with bound parameters given as `:name`
+        :param params: values of the bound parameters, defaults to None
+        :param prepare: if True, run the query as a server side prepared
+            statement so that postgres parses and plans it once per
+            connection rather than on every call, defaults to False
+        :param cache_ttl: seconds to cache the result for if the client has
+            a query cache, defaults to the ttl of the cache
+        :param use_primary: if True, run read only queries on the primary
+            even if the client has replicas, e.g. to read data that was just
+            written, defaults to False. Queries of clients with a query cache
+            run on the primary until the replicas are known to have replayed
+            the last write of the client, i.e. for at least
+            `max_replica_lag` seconds after it
         :returns: dataframe of the query result (tested only for delect queries)
         """
-        with self.engine.connect() as con:
-            query_result = con.execute(db.text(query))
-        data = query_result.fetchall()
-        columns = list(query_result.keys())
-
-        # TODO pandas hotfix: unable to understand date as a timevalue
-        dtype_mapping = None
-        for record in data:
-            indices_of_date_items = [
-                i
-                for i, item in enumerate(record)
-                if isinstance(item, datetime.date)
-            ]
-            dtype_mapping = {
-                columns[i]: "datetime64[ns]" for i in indices_of_date_items
-            }
-            break
+        cache_version = None
+        if self.query_cache is not None:
+            df = self.query_cache.get(query, params)
+            if df is not None:
+                return df
+            cache_version = self.query_cache.get_version()
+            # -- a stale result read from a replica would stay cached until
+            # the next write
+            use_primary = use_primary or not self._replicas_have_writes()
 
-        df = pd.DataFrame.from_records(data, columns=columns)
+        with get_instrumentation().span("postgres.query") as span:
+            with self._connect_for_read(query, use_primary) as con:
+                if prepare:
+                    statement, is_prepared_now = _prepare(con, query)
+                    span.add("round_trips", int(is_prepared_now))
+                    query_result = con.exec_driver_sql(statement, params)
+                else:
+                    query_result = con.execute(db.text(query), params)
+                data = query_result.fetchall()
+                columns = list(query_result.keys())
+                span.add("round_trips")
+                span.add("rows", len(data))
 
-        if dtype_mapping:
-            df = df.astype(dtype_mapping)
+                # -- results inside a transaction may include uncommitted
+                # writes, so they are not cached
+                is_cached = (
+                    cache_version is not None
+                    and not self.in_transaction
+                    and self.query_cache.is_cacheable(query)
+                )
+                view_dependencies = []
+                referenced_tables = (
+                    get_referenced_tables(query) if is_cached else None
+                )
+                if referenced_tables:
+                    view_dependencies = _get_view_dependencies(
+                        con, referenced_tables
+                    )
+                    span.add("round_trips")
+
+        df = _records_to_dataframe(data, columns)
+        if is_cached:
+            self.query_cache.set(
+                query,
+                df,
+                params=params,
+                ttl=cache_ttl,
+                version=cache_version,
+                dependent_tables=view_dependencies,
+            )
         return df
 
+    def query_many(
+        self, query: str, params_list: List[dict], page_size: int = 100
+    ) -> APIResponse:
+        """Run a statement once for each set of parameters, e.g. an INSERT or
+        UPDATE. The statement is prepared once, and executions are sent in
+        pages of `page_size` statements per round trip. All executions are
+        committed together. Results of the statement are discarded.
+
+        :param query: statement to run, with bound parameters given as
+            `:name`
+        :param params_list: values of the bound parameters for each
+            execution
+        :param page_size: number of executions sent per round trip,
+            defaults to 100
+        :return: number of executions
+        """
+        from psycopg2.extras import execute_batch
+
+        instrumentation = get_instrumentation()
+        with instrumentation.span("postgres.query_many") as span:
+            with self._begin() as con:
+                statement, is_prepared_now = _prepare(con, query)
+                span.add("round_trips", int(is_prepared_now))
+                with con.connection.cursor() as cursor:
+                    execute_batch(
+                        cursor, statement, params_list, page_size=page_size
+                    )
+            span.add("round_trips", -(-len(params_list) // page_size))
+            span.add("rows", len(params_list))
+
+        self._invalidate_cache(get_modified_tables(query))
+
+        return {
+            "status_code": 200,
+            "msg": f"executed query for {len(params_list)} parameter sets",
+            "data": [{"num_executions": len(params_list)}],
+        }
+
+    def _read(
+        self, query: str, chunksize: int = 10000, params: dict | None = None
+    ) -> Iterator[pd.DataFrame]:
+        """Internal function that is used by `InNOutClient` as a universal
+        read entry. Streams the query result in chunks using a server side
+        cursor so that the full result is never held in memory.
+
+        :param query: query to run
+        :param chunksize: number of rows per yielded dataframe, defaults to
+            10000
+        :param params: values of the bound parameters of the query, defaults
+            to None
+        :returns: iterator of dataframes
+        """
+        with self._connect_for_read(query) as con:
+            query_result = con.execution_options(
+                stream_results=True, max_row_buffer=chunksize
+            ).execute(db.text(query), params)
+            columns = list(query_result.keys())
+            for records in query_result.partitions(chunksize):
+                yield _records_to_dataframe(records, columns)
+
+    def export(
+        self,
+        query: str,
+        path,
+        format: str = "csv",
+        compression: str | None = None,
+        params: dict | None = None,
+        header: bool = True,
+    ) -> APIResponse:
+        """Export the result of a query to a file with `COPY ... TO STDOUT`.
+        The data is streamed from postgres straight into the (compressed)
+        file, so memory use is constant and no dataframe is created.
+
+        :param query: query to export, with bound parameters given as
+            `:name`
+        :param path: path of the file, or a binary file-like object to write
+            to, which is not closed
+        :param format: "csv" or "binary" (the postgres binary COPY format),
+            defaults to "csv"
+        :param compression: "gzip", "zstd" or None, defaults to None. zstd
+            requires `zstandard`, install it with
+            `pip install in-n-out-clients[zstd]`
+        :param params: values of the bound parameters, defaults to None
+        :param header: whether to write a header line for csv, defaults to
+            True
+        :return: number of rows and (uncompressed) bytes exported, and the
+            throughput in rows and bytes per second
+        """
+        if format not in ("csv", "binary"):
+            raise ValueError(f"format must be `csv` or `binary`, got {format}")
+        copy_options = f"FORMAT {format}"
+        if format == "csv" and header:
+            copy_options += ", HEADER"
+
+        instrumentation = get_instrumentation()
+        with instrumentation.span("postgres.export", format=format) as span:
+            start_time = time.perf_counter()
+            with contextlib.ExitStack() as stack:
+                sink = _CountingWriter(
+                    _open_export_sink(stack, path, compression)
+                )
+                con = stack.enter_context(self._connect_for_read(query))
+                cursor = stack.enter_context(con.connection.cursor())
+                if params:
+                    query = cursor.mogrify(
+                        _BIND_PARAMETER_PATTERN.sub(
+                            r"%(\1)s", query.replace("%", "%%")
+                        ),
+                        params,
+                    ).decode()
+                cursor.copy_expert(
+                    f"COPY ({query}) TO STDOUT WITH ({copy_options})", sink
+                )
+                num_rows = cursor.rowcount
+            seconds = time.perf_counter() - start_time
+            span.add("rows", num_rows)
+            span.add("bytes", sink.num_bytes)
+            span.add("round_trips")
+
+        logger.info(
+            f"Exported {num_rows} rows ({sink.num_bytes} bytes) in "
+            f"{seconds:.2f}s..."
+        )
+        return {
+            "status_code": 200,
+            "msg": f"exported {num_rows} rows",
+            "data": [
+                {
+                    "num_rows": num_rows,
+                    "num_bytes": sink.num_bytes,
+                    "seconds": seconds,
+                    "rows_per_second": num_rows / seconds,
+                    "bytes_per_second": sink.num_bytes / seconds,
+                }
+            ],
+        }
+
     def _write(
         self,
         table_name: str,
@@ -107,6 +533,16 @@ class PostgresClient:
         on_asset_conflict: str = "append",
         dataset_name: str | None = None,
         data_conflict_properties: List[str] | None = None,
+        dry_run: bool = False,
+        category_encoding: str = "enum",
+        create_conflict_index: bool = False,
+        partition_by: str | None = None,
+        partition_interval: str = "month",
+        replace_strategy: str = "drop",
+        duplicate_keys_policy: str | dict | None = None,
+        column_subset: bool = False,
+        skip_unchanged: bool = False,
+        row_hash_column: str | None = None,
     ):
         """Internal function that is used by `InNOutClient` as a universal
         write entry.
@@ -122,6 +558,58 @@ class PostgresClient:
         :param data_conflict_properties: rows to check for conflicts.
                 Note: these must match existing constraints on the
                 table, defaults to None
+        :param dry_run: if True, only report the rows that conflict with
+                existing data without writing anything, defaults to False
+        :param category_encoding: how to write category columns, either as
+                postgres enums ("enum") or as their integer codes ("codes"),
+                defaults to "enum"
+        :param create_conflict_index: if True, create a unique index on
+                `data_conflict_properties` if the table does not have one.
+                For new tables the index is created after the data is
+                loaded, in the same transaction, defaults to False
+        :param partition_by: timestamp or date column to range partition
+                the table on. Partitions missing for the data are created and
+                rows are written directly into their partition, defaults to
+                None
+        :param partition_interval: range of each partition, one of "day",
+                "month" or "year", defaults to "month"
+        :param replace_strategy: how an existing table is replaced when
+                on_asset_conflict="replace". "drop" drops and recreates it.
+                "swap" loads a shadow table, copies the indexes, primary key,
+                unique, check and foreign key constraints, NOT NULL,
+                defaults, serial sequences and grants of the table to it and
+                swaps it in with a rename, so readers are only blocked for
+                the swap. "truncate" truncates the table and loads it with
+                COPY, keeping its schema, if the columns are unchanged
+                (otherwise it swaps). Tables that other objects depend on
+                (e.g. views or foreign keys of other tables), or with
+                triggers, policies or identity columns, are truncated instead
+                of swapped, and can not be replaced if their columns changed.
+                Ignored for partitioned tables, defaults to "drop"
+        :param duplicate_keys_policy: how rows of the data with the same
+                data_conflict_properties are deduplicated before writing,
+                since postgres can not update a row twice in one statement.
+                "first" or "last" keeps the first or last row, a dict maps
+                columns to the aggregation (as in `DataFrame.agg`) used to
+                combine them, other columns keep their last value. Defaults
+                to "last" for on_data_conflict="replace", otherwise to
+                "first". Not applied when on_data_conflict="append"
+        :param column_subset: if True, only the columns in the data are
+                written. The data is copied into a temporary table, rows that
+                exist are updated from it (for on_data_conflict="replace")
+                and the remaining rows are inserted, leaving other columns
+                untouched or at their defaults. Defaults to False, in which
+                case non nullable columns missing from the data are filled
+                with placeholder values
+        :param skip_unchanged: if True, rows that conflict with a row whose
+                values are the same are not written when
+                on_data_conflict="replace", and the response reports the
+                number of inserted, updated and unchanged rows, defaults to
+                False
+        :param row_hash_column: column to store a hash of the non key
+                columns of the data in. If given, `skip_unchanged` compares the hashes
+                rather than every column. Existing tables must have the
+                column, as a bigint, defaults to None
         """
         resp = self.write(
             df=data,
@@ -130,6 +618,16 @@ class PostgresClient:
             on_asset_conflict=on_asset_conflict,
             on_data_conflict=on_data_conflict,
             data_conflict_properties=data_conflict_properties,
+            dry_run=dry_run,
+            category_encoding=category_encoding,
+            create_conflict_index=create_conflict_index,
+            partition_by=partition_by,
+            partition_interval=partition_interval,
+            replace_strategy=replace_strategy,
+            duplicate_keys_policy=duplicate_keys_policy,
+            column_subset=column_subset,
+            skip_unchanged=skip_unchanged,
+            row_hash_column=row_hash_column,
         )
 
         return resp
@@ -143,52 +641,120 @@ class PostgresClient:
         on_asset_conflict: str,
         on_data_conflict: str,
         data_conflict_properties: List[str] | None = None,
+        dry_run: bool = False,
+        category_encoding: str = "enum",
+        create_conflict_index: bool = False,
+        partition_by: str | None = None,
+        partition_interval: str = "month",
+        replace_strategy: str = "drop",
+        duplicate_keys_policy: str | dict | None = None,
+        column_subset: bool = False,
+        skip_unchanged: bool = False,
+        row_hash_column: str | None = None,
     ):
-        DTYPE_MAP = {
-            "int64": INTEGER,
-            "float64": FLOAT,
-            "datetime64[ns]": TIMESTAMP,
-            "datetime64[ns, UTC]": TIMESTAMP(timezone=True),
-            "bool": BOOLEAN,
-            "object": VARCHAR,
-        }
+        _validate_replace_strategy(replace_strategy)
+        df, num_duplicate_rows = drop_duplicate_keys(
+            df,
+            on_data_conflict=on_data_conflict,
+            data_conflict_properties=data_conflict_properties,
+            duplicate_keys_policy=duplicate_keys_policy,
+        )
+        df = add_row_hash(df, row_hash_column, data_conflict_properties)
+        dtypes = get_pg_datatypes(
+            df,
+            table_name=table_name,
+            dataset_name=dataset_name,
+            category_encoding=category_encoding,
+        )
+        # -- before checking for conflicts, since the keys are compared as
+        # they are written
+        df = encode_categories(df, category_encoding=category_encoding)
+        if dry_run or on_data_conflict == ConflictResolutionStrategy.FAIL:
+            resp = self._check_conflicts_before_write(
+                df=df,
+                table_name=table_name,
+                dataset_name=dataset_name,
+                on_asset_conflict=on_asset_conflict,
+                on_data_conflict=on_data_conflict,
+                data_conflict_properties=data_conflict_properties,
+                dry_run=dry_run,
+            )
+            if resp is not None:
+                return resp
 
-        def _get_pg_datatypes(df):
-            dtypes = {}
-            for col, dtype in df.dtypes.items():
-                if is_datetime64tz_dtype(dtype):
-                    dtypes[col] = DTYPE_MAP["datetime64[ns, UTC]"]
-                else:
-                    dtypes[col] = DTYPE_MAP[str(dtype)]
-            return dtypes
+        if any(isinstance(dtype, ENUM) for dtype in dtypes.values()):
+            # -- enum values can not be used in the transaction that adds
+            # them, so they are committed on their own connection, also
+            # inside `transaction`
+            with self.engine.connect() as con:
+                create_enum_types(
+                    con.execution_options(isolation_level="AUTOCOMMIT"), dtypes
+                )
 
-        dtypes = _get_pg_datatypes(df)
+        create_index_after_load = False
+        if create_conflict_index and data_conflict_properties:
+            create_index_after_load = self._prepare_conflict_index(
+                table_name=table_name,
+                dataset_name=dataset_name,
+                on_asset_conflict=on_asset_conflict,
+                data_conflict_properties=data_conflict_properties,
+            )
 
-        # -- define behavior:
-        # if on_data_conflict !=APPEND, AND no conflict columns provided...!
-        # Rejects this altogether. Do not want to allow this case
-        # We would be making the behaviour ambiguous.
-        # -- if we have provided conflict columns, then as per postgres
-        if on_data_conflict != ConflictResolutionStrategy.APPEND:
+        # -- conflicts are resolved by postgres with ON CONFLICT on the
+        # data_conflict_properties, unless on_data_conflict=append. Nothing
+        # can conflict with a new table, so it is bulk loaded without
+        # conflict resolution and the index is built once afterwards rather
+        # than maintained row by row
+        write_stats = {}  # -- filled in by the insert method
+        if (
+            on_data_conflict != ConflictResolutionStrategy.APPEND
+            and not create_index_after_load
+        ):
             method = partial(
-                insert_with_conflict_resolution,
+                (
+                    upsert_column_subset
+                    if column_subset
+                    else insert_with_conflict_resolution
+                ),
                 on_data_conflict=on_data_conflict,
                 data_conflict_properties=data_conflict_properties,
+                skip_unchanged=skip_unchanged,
+                row_hash_column=row_hash_column,
+                write_stats=write_stats,
             )
         else:
             method = "multi"
 
+        instrumentation = get_instrumentation()
         try:
-            df.to_sql(
-                table_name,
-                self.engine,
-                schema=dataset_name,
-                if_exists=on_asset_conflict,
-                index=False,
-                method=method,
-                dtype=dtypes,
-            )
+            with instrumentation.span(
+                "postgres.write",
+                table_name=table_name,
+                on_data_conflict=on_data_conflict,
+            ) as span:
+                if instrumentation.enabled:
+                    span.add("rows", len(df))
+                    span.add("bytes", int(df.memory_usage(deep=True).sum()))
+                self._load(
+                    df,
+                    table_name=table_name,
+                    dataset_name=dataset_name,
+                    on_asset_conflict=on_asset_conflict,
+                    method=method,
+                    dtypes=dtypes,
+                    partition_by=partition_by,
+                    partition_interval=partition_interval,
+                    replace_strategy=replace_strategy,
+                    unique_index=(
+                        data_conflict_properties
+                        if create_index_after_load
+                        else None
+                    ),
+                )
+                self._invalidate_cache([table_name])
         except OnDataConflictFail as on_data_conflict_fail:
+            if self.in_transaction:
+                raise
             logger.error("Exiting process since on_data_conflict=fail")
             return {"status_code": 409, **on_data_conflict_fail.args[0]}
 
@@ -241,7 +807,1101 @@ class PostgresClient:
                     "No conflicts found... proceeding with normal write process"
                 )"""
 
-        return {"status_code": 200, "msg": "successfully wrote data"}
+        return {
+            "status_code": 200,
+            "msg": "successfully wrote data",
+            "data": [
+                {
+                    "num_rows": len(df),
+                    "num_duplicate_rows_dropped": num_duplicate_rows,
+                    **write_stats,
+                }
+            ],
+        }
+
+    def _check_conflicts_before_write(
+        self,
+        df: pd.DataFrame,
+        table_name: str,
+        dataset_name: str | None,
+        on_asset_conflict: str,
+        on_data_conflict: str,
+        data_conflict_properties: List[str] | None,
+        dry_run: bool,
+    ) -> APIResponse | None:
+        """Internal function to check for conflicts before any data is
+        written. Returns the response of the write if it should not go ahead,
+        i.e. for dry runs and for conflicts when on_data_conflict is FAIL.
+        """
+        if not data_conflict_properties:
+            if not dry_run:
+                return None
+            return {
+                "status_code": 400,
+                "msg": "dry_run requires data_conflict_properties",
+                "data": [],
+            }
+
+        # -- a replaced table is dropped before writing, so nothing can
+        # conflict with it
+        table_exists = on_asset_conflict != "replace" and self._table_exists(
+            table_name, dataset_name
+        )
+        if table_exists:
+            resp = self.check_conflicts(
+                df=df,
+                table_name=table_name,
+                dataset_name=dataset_name,
+                data_conflict_properties=data_conflict_properties,
+            )
+        else:
+            resp = {
+                "status_code": 200,
+                "msg": "Found 0 conflicting rows",
+                "data": [
+                    {
+                        "data_conflict_properties": data_conflict_properties,
+                        "num_conflicting_rows": 0,
+                        "first_5_conflicting_rows": [],
+                    }
+                ],
+            }
+
+        if dry_run:
+            logger.info("Dry run, no data has been written...")
+            resp["msg"] = f"Dry run: {resp['msg']}"
+            return resp
+
+        if resp["data"][0]["num_conflicting_rows"]:
+            logger.error("Exiting process since on_data_conflict=fail")
+            resp = {**resp, "status_code": 409}
+            if self.in_transaction:
+                raise OnDataConflictFail(resp)
+            return resp
+
+        return None
+
+    def _prepare_conflict_index(
+        self,
+        table_name: str,
+        dataset_name: str | None,
+        on_asset_conflict: str,
+        data_conflict_properties: List[str],
+    ) -> bool:
+        """Internal function to make sure an existing table has a unique
+        index on `data_conflict_properties`.
+
+        :return: True if the table is new, in which case the index should be
+            created after the data is loaded
+        """
+        if on_asset_conflict == "replace" or not self._table_exists(
+            table_name, dataset_name
+        ):
+            return True
+        self.ensure_unique_index(
+            table_name, data_conflict_properties, dataset_name
+        )
+        return False
+
+    def _load(
+        self,
+        df: pd.DataFrame,
+        table_name: str,
+        dataset_name: str | None,
+        on_asset_conflict: str,
+        method,
+        dtypes: dict,
+        partition_by: str | None,
+        partition_interval: str,
+        replace_strategy: str = "drop",
+        unique_index: List[str] | None = None,
+    ):
+        """Internal function to load a dataframe into a table, or into the
+        partitions of a partitioned table, in a single transaction.
+
+        :param unique_index: columns of a unique index to create after the
+            data is loaded, in the same transaction, defaults to None
+        """
+        with self._begin() as con:
+            if (
+                partition_by is None
+                and on_asset_conflict == "replace"
+                and replace_strategy != "drop"
+                and db.inspect(con).has_table(table_name, schema=dataset_name)
+            ):
+                self._replace_table(
+                    con,
+                    df=df,
+                    table_name=table_name,
+                    dataset_name=dataset_name,
+                    dtypes=dtypes,
+                    replace_strategy=replace_strategy,
+                )
+            else:
+                self._load_partitions(
+                    con,
+                    df=df,
+                    table_name=table_name,
+                    dataset_name=dataset_name,
+                    on_asset_conflict=on_asset_conflict,
+                    method=method,
+                    dtypes=dtypes,
+                    partition_by=partition_by,
+                    partition_interval=partition_interval,
+                )
+            # -- so that data which violates the index is never committed
+            if unique_index:
+                self._ensure_unique_index(
+                    con, table_name, unique_index, dataset_name
+                )
+
+    def _load_partitions(
+        self,
+        con,
+        df: pd.DataFrame,
+        table_name: str,
+        dataset_name: str | None,
+        on_asset_conflict: str,
+        method,
+        dtypes: dict,
+        partition_by: str | None,
+        partition_interval: str,
+    ):
+        """Internal function to load a dataframe into a table, or into the
+        partitions of a partitioned table."""
+        if partition_by is None:
+            partitions = [(table_name, df)]
+        else:
+            partitions = self._prepare_partitions(
+                con,
+                df=df,
+                table_name=table_name,
+                dataset_name=dataset_name,
+                on_asset_conflict=on_asset_conflict,
+                dtypes=dtypes,
+                partition_by=partition_by,
+                partition_interval=partition_interval,
+            )
+            # -- the parent table now exists
+            on_asset_conflict = "append"
+        for partition_table_name, partition_df in partitions:
+            partition_df.to_sql(
+                partition_table_name,
+                con,
+                schema=dataset_name,
+                if_exists=on_asset_conflict,
+                index=False,
+                method=method,
+                dtype=dtypes,
+            )
+
+    def _replace_table(
+        self,
+        con,
+        df: pd.DataFrame,
+        table_name: str,
+        dataset_name: str | None,
+        dtypes: dict,
+        replace_strategy: str,
+    ):
+        """Internal function to replace the data of an existing table, see
+        `replace_strategy` of `write`."""
+        preparer = con.dialect.identifier_preparer
+        target = _qualified_table_name(preparer, table_name, dataset_name)
+        columns = db.inspect(con).get_columns(table_name, schema=dataset_name)
+        is_same_columns = {column["name"] for column in columns} == set(
+            df.columns
+        )
+
+        if replace_strategy == "swap" or not is_same_columns:
+            # -- objects depending on the table would either block dropping
+            # the old table or silently be left behind, so check before
+            # loading anything
+            swap_blockers = _get_swap_blockers(con, target)
+            if swap_blockers and not is_same_columns:
+                raise ValueError(
+                    f"Can not replace `{table_name}` with a table with "
+                    "different columns since the following depend on it: "
+                    f"{', '.join(swap_blockers)}. Drop them first, or use "
+                    "replace_strategy=drop"
+                )
+            if swap_blockers:
+                logger.warning(
+                    f"Can not swap `{table_name}` since the following depend "
+                    f"on it: {', '.join(swap_blockers)}... truncating it "
+                    "instead"
+                )
+                replace_strategy = "truncate"
+
+        if replace_strategy == "truncate" and is_same_columns:
+            logger.info(f"Truncating and reloading `{table_name}`...")
+            con.execute(db.text(f"TRUNCATE {target}"))
+            _bulk_load(con, df, table_name, dataset_name, dtypes)
+            return
+        if replace_strategy == "truncate":
+            logger.info(
+                f"Columns of `{table_name}` changed... replacing it with a "
+                "shadow table instead"
+            )
+        self._swap_table(con, df, table_name, dataset_name, dtypes)
+
+    def _swap_table(
+        self,
+        con,
+        df: pd.DataFrame,
+        table_name: str,
+        dataset_name: str | None,
+        dtypes: dict,
+    ):
+        """Internal function to load a dataframe into a shadow table and
+        swap it in place of an existing table."""
+        preparer = con.dialect.identifier_preparer
+        target = _qualified_table_name(preparer, table_name, dataset_name)
+        suffix = uuid.uuid4().hex[:8]
+        # -- postgres truncates names to 63 characters
+        shadow_table_name = f"{table_name[:40]}__shadow_{suffix}"
+        old_table_name = f"{table_name[:40]}__old_{suffix}"
+        shadow = _qualified_table_name(
+            preparer, shadow_table_name, dataset_name
+        )
+
+        indexes = con.execute(
+            db.text(
+                "SELECT i.relname, pg_get_indexdef(i.oid), c.conname, "
+                "c.contype FROM pg_index x "
+                "JOIN pg_class i ON i.oid = x.indexrelid "
+                "LEFT JOIN pg_constraint c ON c.conindid = x.indexrelid "
+                "AND c.contype IN ('p', 'u') "
+                "WHERE x.indrelid = CAST(:table AS regclass)"
+            ),
+            {"table": target},
+        ).fetchall()
+        constraints = _get_table_constraints(con, target, df.columns)
+        column_properties = [
+            properties
+            for properties in con.execute(
+                _COLUMN_PROPERTIES_QUERY, {"table": target}
+            ).fetchall()
+            if properties[0] in df.columns
+        ]
+        grants = con.execute(
+            db.text(
+                "SELECT grantee, privilege_type "
+                "FROM information_schema.role_table_grants "
+                "WHERE table_schema = COALESCE(:schema, current_schema()) "
+                "AND table_name = :table"
+            ),
+            {"schema": dataset_name, "table": table_name},
+        ).fetchall()
+
+        logger.info(f"Loading shadow table of `{table_name}`...")
+        db.Table(
+            shadow_table_name,
+            db.MetaData(),
+            *(db.Column(column, dtypes[column]) for column in df.columns),
+            schema=dataset_name,
+        ).create(con)
+        _bulk_load(con, df, shadow_table_name, dataset_name, dtypes)
+
+        shadow_index_names = _create_shadow_indexes(
+            con, indexes, table_name, shadow_table_name, dataset_name
+        )
+        _copy_column_properties(con, shadow, column_properties)
+        # -- a foreign key to the table itself is added after the swap, so
+        # that it references the new table
+        _add_constraints(
+            con,
+            shadow,
+            [constraint for constraint in constraints if not constraint[2]],
+        )
+        for grantee, privilege_type in grants:
+            if grantee != "PUBLIC":
+                grantee = preparer.quote(grantee)
+            con.execute(
+                db.text(f"GRANT {privilege_type} ON {shadow} TO {grantee}")
+            )
+        con.execute(db.text(f"ANALYZE {shadow}"))
+
+        logger.info(f"Swapping in shadow table of `{table_name}`...")
+        # -- sequences of serial columns would be dropped with the old table
+        for column, _, _, sequence in column_properties:
+            if sequence is not None:
+                con.execute(
+                    db.text(
+                        f"ALTER SEQUENCE {sequence} OWNED BY "
+                        f"{shadow}.{preparer.quote(column)}"
+                    )
+                )
+        con.execute(
+            db.text(
+                f"ALTER TABLE {target} RENAME TO "
+                f"{preparer.quote(old_table_name)}"
+            )
+        )
+        con.execute(
+            db.text(
+                f"ALTER TABLE {shadow} RENAME TO {preparer.quote(table_name)}"
+            )
+        )
+        con.execute(
+            db.text(
+                "DROP TABLE "
+                f"{_qualified_table_name(preparer, old_table_name, dataset_name)}"
+            )
+        )
+
+        for index_name, _, constraint_name, constraint_type in indexes:
+            if index_name not in shadow_index_names:
+                continue
+            shadow_index_name = shadow_index_names[index_name]
+            if constraint_name is not None:
+                constraint = (
+                    "PRIMARY KEY" if constraint_type == "p" else "UNIQUE"
+                )
+                statement = (
+                    f"ALTER TABLE {target} ADD CONSTRAINT "
+                    f"{preparer.quote(constraint_name)} {constraint} "
+                    f"USING INDEX {preparer.quote(shadow_index_name)}"
+                )
+            else:
+                shadow_index = _qualified_table_name(
+                    preparer, shadow_index_name, dataset_name
+                )
+                statement = (
+                    f"ALTER INDEX {shadow_index} RENAME TO "
+                    f"{preparer.quote(index_name)}"
+                )
+            con.execute(db.text(statement))
+        _add_constraints(
+            con,
+            target,
+            [constraint for constraint in constraints if constraint[2]],
+        )
+
+    def _prepare_partitions(
+        self,
+        con,
+        df: pd.DataFrame,
+        table_name: str,
+        dataset_name: str | None,
+        on_asset_conflict: str,
+        dtypes: dict,
+        partition_by: str,
+        partition_interval: str,
+    ) -> List[tuple]:
+        """Internal function to create a range partitioned table if it does
+        not exist, and any of its partitions that are missing for the data.
+
+        :return: list of (partition table name, partition data)
+        """
+        preparer = con.dialect.identifier_preparer
+        target = _qualified_table_name(preparer, table_name, dataset_name)
+        table_exists = db.inspect(con).has_table(
+            table_name, schema=dataset_name
+        )
+        if table_exists and on_asset_conflict == "fail":
+            raise ValueError(f"Table {table_name!r} already exists.")
+        if table_exists and on_asset_conflict == "replace":
+            con.execute(db.text(f"DROP TABLE {target}"))
+            table_exists = False
+        if not table_exists:
+            logger.info(
+                f"Creating table `{table_name}` partitioned by "
+                f"`{partition_by}`..."
+            )
+            db.Table(
+                table_name,
+                db.MetaData(),
+                *(db.Column(column, dtypes[column]) for column in df.columns),
+                schema=dataset_name,
+                postgresql_partition_by=(
+                    f"RANGE ({preparer.quote(partition_by)})"
+                ),
+            ).create(con)
+
+        partitions = []
+        for suffix, start, end, partition_df in _split_into_partitions(
+            df, partition_by, partition_interval
+        ):
+            partition_table_name = f"{table_name}_p{suffix}"
+            partition = _qualified_table_name(
+                preparer, partition_table_name, dataset_name
+            )
+            con.execute(
+                db.text(
+                    f"CREATE TABLE IF NOT EXISTS {partition} PARTITION OF "
+                    f"{target} FOR VALUES FROM ({start!r}) TO ({end!r})"
+                )
+            )
+            partitions.append((partition_table_name, partition_df))
+        return partitions
+
+    def _table_exists(
+        self, table_name: str, dataset_name: str | None = None
+    ) -> bool:
+        with self._connect() as con:
+            return db.inspect(con).has_table(table_name, schema=dataset_name)
+
+    def _asset_exists(self, table_name: str, dataset_name: str | None) -> bool:
+        return self._table_exists(table_name, dataset_name)
+
+    def ensure_unique_index(
+        self,
+        table_name: str,
+        data_conflict_properties: List[str],
+        dataset_name: str | None = None,
+    ) -> bool:
+        """Create a unique index on `data_conflict_properties` unless the
+        table already has a primary key, unique constraint or unique index
+        on exactly those columns. Such an index is required for
+        `ON CONFLICT` upserts.
+
+        :param table_name: name of the table
+        :param data_conflict_properties: columns that identify a row
+        :param dataset_name: name of the dataset (postgres schema) that
+            table belongs to, defaults to None
+        :return: True if an index was created
+        """
+        with self._begin() as con:
+            return self._ensure_unique_index(
+                con, table_name, data_conflict_properties, dataset_name
+            )
+
+    def _ensure_unique_index(
+        self,
+        con,
+        table_name: str,
+        data_conflict_properties: List[str],
+        dataset_name: str | None = None,
+    ) -> bool:
+        """Internal function for `ensure_unique_index` on a given
+        connection."""
+        key = set(data_conflict_properties)
+        inspector = db.inspect(con)
+        unique_keys = [
+            inspector.get_pk_constraint(table_name, schema=dataset_name)[
+                "constrained_columns"
+            ]
+        ]
+        unique_keys.extend(
+            constraint["column_names"]
+            for constraint in inspector.get_unique_constraints(
+                table_name, schema=dataset_name
+            )
+        )
+        # -- partial indexes can not be used to infer the conflict target
+        unique_keys.extend(
+            index["column_names"]
+            for index in inspector.get_indexes(table_name, schema=dataset_name)
+            if index["unique"]
+            and not index.get("dialect_options", {}).get("postgresql_where")
+        )
+        if any(set(unique_key) == key for unique_key in unique_keys):
+            logger.debug(
+                f"Found unique index on {data_conflict_properties} for table "
+                f"`{table_name}`"
+            )
+            return False
+
+        preparer = self.engine.dialect.identifier_preparer
+        index_name = preparer.quote(
+            f"{table_name}_{'_'.join(data_conflict_properties)}_key"[:63]
+        )
+        target = _qualified_table_name(preparer, table_name, dataset_name)
+        columns = ", ".join(
+            preparer.quote(column) for column in data_conflict_properties
+        )
+        logger.info(
+            f"Creating unique index on {data_conflict_properties} for table "
+            f"`{table_name}`..."
+        )
+        with get_instrumentation().span(
+            "postgres.ensure_unique_index", table_name=table_name
+        ):
+            con.execute(
+                db.text(
+                    f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} "
+                    f"ON {target} ({columns})"
+                )
+            )
+        return True
+
+    def check_conflicts(
+        self,
+        df: pd.DataFrame,
+        table_name: str,
+        data_conflict_properties: List[str],
+        dataset_name: str | None = None,
+        sample_size: int = 5,
+    ) -> APIResponse:
+        """Find rows in a dataframe whose keys already exist in a table,
+        without writing to the table.
+
+        The keys are bulk loaded into a temporary table and joined against
+        the target with a single `EXISTS` query, which postgres can answer
+        from the unique index on `data_conflict_properties`.
+
+        :param df: dataframe that would be written
+        :param table_name: name of the target table
+        :param data_conflict_properties: columns that identify a row
+        :param dataset_name: name of the dataset (postgres schema) that
+            table belongs to, defaults to None
+        :param sample_size: maximum number of conflicting keys to return,
+            defaults to 5
+        :return: number of conflicting rows and a sample of their keys
+        """
+        preparer = self.engine.dialect.identifier_preparer
+        target = _qualified_table_name(preparer, table_name, dataset_name)
+        keys_table = preparer.quote(f"in_n_out_keys_{uuid.uuid4().hex[:8]}")
+        key_columns = ", ".join(
+            preparer.quote(column) for column in data_conflict_properties
+        )
+        join_condition = " AND ".join(
+            f"t.{column} = k.{column}"
+            for column in (
+                preparer.quote(column) for column in data_conflict_properties
+            )
+        )
+
+        instrumentation = get_instrumentation()
+        with instrumentation.span(
+            "postgres.check_conflicts", table_name=table_name
+        ) as span:
+            span.add("rows", len(df))
+            with self._begin() as con:
+                con.execute(
+                    db.text(
+                        f"CREATE TEMP TABLE {keys_table} ON COMMIT DROP AS "
+                        f"SELECT {key_columns} FROM {target} WITH NO DATA"
+                    )
+                )
+                _copy_dataframe(con, df[data_conflict_properties], keys_table)
+                # -- count(*) OVER () is computed before the LIMIT, so a
+                # single query returns both the count and the sample. At
+                # least one row is fetched for the count
+                records = con.execute(
+                    db.text(
+                        f"SELECT count(*) OVER (), {key_columns} "
+                        f"FROM {keys_table} AS k WHERE EXISTS ("
+                        f"SELECT 1 FROM {target} AS t "
+                        f"WHERE {join_condition}) LIMIT :limit"
+                    ),
+                    {"limit": max(sample_size, 1)},
+                ).fetchall()
+            span.add("round_trips", 4)
+            num_conflicting_rows = records[0][0] if records else 0
+            span.add("conflicting_rows", num_conflicting_rows)
+
+        logger.info(f"Found {num_conflicting_rows} conflicting rows...")
+        return {
+            "status_code": 200,
+            "msg": f"Found {num_conflicting_rows} conflicting rows",
+            "data": [
+                {
+                    "data_conflict_properties": data_conflict_properties,
+                    "num_conflicting_rows": num_conflicting_rows,
+                    "first_5_conflicting_rows": [
+                        dict(
+                            zip(
+                                data_conflict_properties,
+                                map(str, record[1:]),
+                                strict=True,
+                            )
+                        )
+                        for record in records[:sample_size]
+                    ],
+                }
+            ],
+        }
+
+
+REPLACE_STRATEGIES = ("drop", "swap", "truncate")
+
+# -- matches the index name and table of `pg_get_indexdef`, which are
+# quoted if needed
+_IDENTIFIER_PATTERN = r'(?:"(?:[^"]|"")*"|[^\s."]+)'
+_INDEX_DEFINITION_PATTERN = re.compile(
+    rf"^(CREATE (?:UNIQUE )?INDEX )({_IDENTIFIER_PATTERN})( ON (?:ONLY )?)"
+    rf"({_IDENTIFIER_PATTERN}(?:\.{_IDENTIFIER_PATTERN})?)"
+)
+
+# -- objects that would block, or be lost by, swapping a table: objects
+# depending on it (e.g. views and foreign keys of other tables, but not its
+# own constraints), its triggers, policies and rules, and identity columns
+_SWAP_BLOCKERS_QUERY = db.text(
+    """
+SELECT pg_describe_object(d.classid, d.objid, d.objsubid)
+FROM pg_depend d
+WHERE d.refclassid = 'pg_class'::regclass
+AND d.refobjid = CAST(:table AS regclass)
+AND (
+    (
+        d.deptype = 'n'
+        AND NOT EXISTS (
+            SELECT 1 FROM pg_constraint c
+            WHERE d.classid = 'pg_constraint'::regclass
+            AND c.oid = d.objid AND c.conrelid = d.refobjid
+        )
+    )
+    OR (
+        d.deptype = 'a'
+        AND d.classid IN (
+            'pg_trigger'::regclass, 'pg_policy'::regclass,
+            'pg_rewrite'::regclass
+        )
+    )
+    OR (
+        d.deptype = 'i'
+        AND d.classid = 'pg_class'::regclass
+        AND EXISTS (
+            SELECT 1 FROM pg_class s WHERE s.oid = d.objid AND s.relkind = 'S'
+        )
+    )
+)
+ORDER BY 1
+"""
+)
+# -- check and foreign key constraints of a table, with their columns
+_TABLE_CONSTRAINTS_QUERY = db.text(
+    """
+SELECT c.conname, pg_get_constraintdef(c.oid), c.confrelid = c.conrelid,
+    ARRAY(
+        SELECT a.attname FROM pg_attribute a
+        WHERE a.attrelid = c.conrelid AND a.attnum = ANY(c.conkey)
+    )
+FROM pg_constraint c
+WHERE c.conrelid = CAST(:table AS regclass) AND c.contype IN ('c', 'f')
+ORDER BY c.conname
+"""
+)
+# -- NOT NULL, default and owned sequence of the columns of a table
+_COLUMN_PROPERTIES_QUERY = db.text(
+    """
+SELECT a.attname, a.attnotnull, pg_get_expr(ad.adbin, ad.adrelid),
+    (
+        SELECT CAST(CAST(d.objid AS regclass) AS text) FROM pg_depend d
+        JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+        WHERE d.classid = 'pg_class'::regclass AND d.deptype = 'a'
+        AND d.refobjid = a.attrelid AND d.refobjsubid = a.attnum
+    )
+FROM pg_attribute a
+LEFT JOIN pg_attrdef ad ON ad.adrelid = a.attrelid AND ad.adnum = a.attnum
+WHERE a.attrelid = CAST(:table AS regclass) AND a.attnum > 0
+AND NOT a.attisdropped
+ORDER BY a.attnum
+"""
+)
+
+# -- the given views and, recursively, the tables and views they read from
+_VIEW_DEPENDENCIES_QUERY = """
+WITH RECURSIVE dependencies(oid) AS (
+    SELECT c.oid FROM pg_class c
+    WHERE lower(c.relname) = ANY(%(table_names)s) AND c.relkind IN ('v', 'm')
+    UNION
+    SELECT d.refobjid FROM dependencies
+    JOIN pg_rewrite r ON r.ev_class = dependencies.oid
+    JOIN pg_depend d ON d.classid = 'pg_rewrite'::regclass
+        AND d.objid = r.oid
+        AND d.refclassid = 'pg_class'::regclass
+        AND d.refobjid <> dependencies.oid
+)
+SELECT DISTINCT lower(c.relname)
+FROM dependencies JOIN pg_class c ON c.oid = dependencies.oid
+"""
+
+# -- key of the names of the statements prepared on a postgres connection,
+# in the `info` of the pooled connection
+_PREPARED_STATEMENTS = "in_n_out_prepared_statements"
+_BIND_PARAMETER_PATTERN = re.compile(r"(?<![:\w\\]):(\w+)(?!:)")
+
+
+def _get_view_dependencies(conn, table_names) -> List[str]:
+    """Internal function to get the tables that the views among
+    `table_names` read from, so that cached results of queries on views are
+    invalidated by writes to those tables.
+
+    :param conn: SQLAlchemy connection
+    :param table_names: lower-cased names of tables and views
+    :return: lower-cased names of the views and the tables they read from
+    """
+    if not table_names:
+        return []
+    return list(
+        conn.exec_driver_sql(
+            _VIEW_DEPENDENCIES_QUERY, {"table_names": list(table_names)}
+        ).scalars()
+    )
+
+
+def _prepare(conn, query: str) -> tuple:
+    """Internal function to create a server side prepared statement for a
+    query, unless it was already prepared on the connection.
+
+    :param conn: SQLAlchemy connection
+    :param query: query with bound parameters given as `:name`
+    :return: the `EXECUTE` statement for the prepared statement, with
+        `%(name)s` placeholders, and whether the statement was prepared by
+        this call
+    """
+    param_names = list(dict.fromkeys(_BIND_PARAMETER_PATTERN.findall(query)))
+    positions = {name: i for i, name in enumerate(param_names, 1)}
+    statement_name = (
+        f"in_n_out_{hashlib.sha1(query.encode()).hexdigest()[:16]}"
+    )
+
+    # -- stored on the pooled DBAPI connection, since prepared statements
+    # live as long as the postgres session
+    prepared_statements = conn.connection.info.setdefault(
+        _PREPARED_STATEMENTS, set()
+    )
+    is_prepared_now = statement_name not in prepared_statements
+    if is_prepared_now:
+        positional_query = _BIND_PARAMETER_PATTERN.sub(
+            lambda match: f"${positions[match.group(1)]}", query
+        )
+        conn.exec_driver_sql(
+            f"PREPARE {statement_name} AS {positional_query}".replace(
+                "%", "%%"
+            )
+        )
+        prepared_statements.add(statement_name)
+
+    if not param_names:
+        return f"EXECUTE {statement_name}", is_prepared_now
+    placeholders = ", ".join(f"%({name})s" for name in param_names)
+    return f"EXECUTE {statement_name} ({placeholders})", is_prepared_now
+
+
+_PARTITION_INTERVALS = {
+    "day": ("D", "%Y%m%d"),
+    "month": ("M", "%Y%m"),
+    "year": ("Y", "%Y"),
+}
+
+
+def _split_into_partitions(
+    df: pd.DataFrame, partition_by: str, partition_interval: str
+) -> Iterator[tuple]:
+    """Internal function to split a dataframe by range partition.
+
+    :param df: dataframe to split
+    :param partition_by: timestamp or date column to partition on
+    :param partition_interval: one of "day", "month" or "year"
+    :return: iterator of (partition suffix, start bound, end bound,
+        partition data)
+    """
+    if partition_interval not in _PARTITION_INTERVALS:
+        raise ValueError(
+            "partition_interval must be one of "
+            f"{list(_PARTITION_INTERVALS)}, got `{partition_interval}`"
+        )
+    freq, suffix_format = _PARTITION_INTERVALS[partition_interval]
+
+    timestamps = pd.to_datetime(df[partition_by])
+    if timestamps.isna().any():
+        raise ValueError(
+            f"Partition column `{partition_by}` can not contain nulls"
+        )
+    # -- bounds of timezone aware columns are expressed in UTC
+    utc_offset = ""
+    if timestamps.dt.tz is not None:
+        timestamps = timestamps.dt.tz_convert("UTC").dt.tz_localize(None)
+        utc_offset = "+00:00"
+
+    bound_format = "%Y-%m-%d %H:%M:%S"
+    for period, partition_df in df.groupby(
+        timestamps.dt.to_period(freq).to_numpy(), sort=True
+    ):
+        yield (
+            period.strftime(suffix_format),
+            f"{period.start_time.strftime(bound_format)}{utc_offset}",
+            f"{(period + 1).start_time.strftime(bound_format)}{utc_offset}",
+            partition_df,
+        )
+
+
+def _qualified_table_name(
+    preparer, table_name: str, dataset_name: str | None = None
+) -> str:
+    """Internal function to get the quoted, schema qualified name of a
+    table."""
+    if dataset_name is None:
+        return preparer.quote(table_name)
+    return (
+        f"{preparer.quote_schema(dataset_name)}.{preparer.quote(table_name)}"
+    )
+
+
+def _get_swap_blockers(con, table: str) -> List[str]:
+    """Internal function to describe the objects that prevent a table from
+    being swapped with a shadow table.
+
+    :param con: SQLAlchemy connection
+    :param table: quoted, schema qualified name of the table
+    """
+    return con.execute(_SWAP_BLOCKERS_QUERY, {"table": table}).scalars().all()
+
+
+def _get_table_constraints(con, table: str, columns) -> List[tuple]:
+    """Internal function to get the check and foreign key constraints of a
+    table that can be copied to a table with `columns`.
+
+    :param con: SQLAlchemy connection
+    :param table: quoted, schema qualified name of the table
+    :param columns: columns of the new table
+    :return: list of (name, definition, is_self_referencing)
+    """
+    constraints = []
+    for (
+        name,
+        constraintdef,
+        is_self_referencing,
+        constraint_columns,
+    ) in con.execute(_TABLE_CONSTRAINTS_QUERY, {"table": table}).fetchall():
+        missing_columns = set(constraint_columns).difference(columns)
+        if missing_columns:
+            logger.warning(
+                f"Could not copy constraint `{name}` of {table} since "
+                f"columns {sorted(missing_columns)} no longer exist"
+            )
+            continue
+        constraints.append((name, constraintdef, is_self_referencing))
+    return constraints
+
+
+def _create_shadow_indexes(
+    con,
+    indexes,
+    table_name: str,
+    shadow_table_name: str,
+    dataset_name: str | None,
+) -> dict:
+    """Internal function to recreate the indexes of a table on its shadow
+    table.
+
+    :return: mapping of the names of the recreated indexes to the names of
+        their copies on the shadow table
+    """
+    preparer = con.dialect.identifier_preparer
+    shadow = _qualified_table_name(preparer, shadow_table_name, dataset_name)
+    # -- indexes are built once on the loaded data, under temporary names
+    # since the names of the old indexes are still taken
+    shadow_index_names = {}
+    for i, (index_name, indexdef, _, _) in enumerate(indexes):
+        shadow_index_name = f"{shadow_table_name}_{i}"
+        shadow_indexdef = _INDEX_DEFINITION_PATTERN.sub(
+            rf"\g<1>{preparer.quote(shadow_index_name)}\g<3>{shadow}",
+            indexdef,
+            count=1,
+        )
+        try:
+            with con.begin_nested():
+                con.execute(db.text(shadow_indexdef))
+        except db.exc.DBAPIError as error:
+            # -- e.g. the index is on a column that no longer exists
+            logger.warning(
+                f"Could not recreate index `{index_name}` on the new "
+                f"`{table_name}`. Reason: {str(error.orig).strip()}"
+            )
+            continue
+        shadow_index_names[index_name] = shadow_index_name
+    return shadow_index_names
+
+
+def _copy_column_properties(con, table: str, column_properties):
+    """Internal function to set the NOT NULL and default of columns.
+
+    :param con: SQLAlchemy connection
+    :param table: quoted, schema qualified name of the table
+    :param column_properties: rows of `_COLUMN_PROPERTIES_QUERY`
+    """
+    preparer = con.dialect.identifier_preparer
+    for column, is_not_null, default, _ in column_properties:
+        column = preparer.quote(column)
+        if is_not_null:
+            con.execute(
+                db.text(
+                    f"ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL"
+                )
+            )
+        if default is not None:
+            con.execute(
+                db.text(
+                    f"ALTER TABLE {table} ALTER COLUMN {column} "
+                    f"SET DEFAULT {default}"
+                )
+            )
+
+
+def _add_constraints(con, table: str, constraints: List[tuple]):
+    """Internal function to add constraints from `_get_table_constraints` to
+    a table."""
+    preparer = con.dialect.identifier_preparer
+    for constraint_name, constraintdef, _ in constraints:
+        con.execute(
+            db.text(
+                f"ALTER TABLE {table} ADD CONSTRAINT "
+                f"{preparer.quote(constraint_name)} {constraintdef}"
+            )
+        )
+
+
+def _copy_dataframe(
+    conn, df: pd.DataFrame, table_name: str, dtypes: dict | None = None
+):
+    """Internal function to bulk load a dataframe into a table using
+    `COPY`, which is much faster than batched inserts.
+
+    :param conn: SQLAlchemy connection
+    :param df: dataframe to load, columns must exist in the table
+    :param table_name: quoted, schema qualified name of the table
+    :param dtypes: postgres types of the columns, see `get_pg_datatypes`. If
+        given, JSONB values are serialised to JSON, defaults to None
+    """
+    converted_columns = {}
+    for column in df.columns:
+        series = df[column]
+        dtype = (dtypes or {}).get(column)
+        if dtype is JSONB or isinstance(dtype, JSONB):
+            converted_columns[column] = series.map(
+                json.dumps, na_action="ignore"
+            )
+        elif pd.api.types.is_timedelta64_dtype(series.dtype):
+            # -- written as integer nanoseconds, like `to_sql` does
+            converted_columns[column] = (
+                pd.Series(series.to_numpy().view("int64"), index=df.index)
+                .where(series.notna())
+                .astype("Int64")
+            )
+    if converted_columns:
+        df = df.assign(**converted_columns)
+
+    preparer = conn.dialect.identifier_preparer
+    columns = ", ".join(preparer.quote(column) for column in df.columns)
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    with conn.connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+
+
+def _validate_replace_strategy(replace_strategy: str):
+    if replace_strategy not in REPLACE_STRATEGIES:
+        raise ValueError(
+            f"replace_strategy must be one of {REPLACE_STRATEGIES}, "
+            f"got `{replace_strategy}`"
+        )
+
+
+def _bulk_load(
+    conn,
+    df: pd.DataFrame,
+    table_name: str,
+    dataset_name: str | None,
+    dtypes: dict,
+):
+    """Internal function to append a dataframe to an existing table with
+    `COPY`, or with multi-row inserts if it has columns that can not be
+    loaded from csv."""
+    if any(
+        dtype is BYTEA or isinstance(dtype, (ARRAY, BYTEA))
+        for dtype in dtypes.values()
+    ):
+        df.to_sql(
+            table_name,
+            conn,
+            schema=dataset_name,
+            if_exists="append",
+            index=False,
+            method="multi",
+            dtype=dtypes,
+        )
+        return
+    preparer = conn.dialect.identifier_preparer
+    _copy_dataframe(
+        conn,
+        df,
+        _qualified_table_name(preparer, table_name, dataset_name),
+        dtypes,
+    )
+
+
+class _CountingWriter:
+    """Internal file-like wrapper that counts the bytes written to it."""
+
+    def __init__(self, f):
+        self.f = f
+        self.num_bytes = 0
+
+    def write(self, data: bytes) -> int:
+        self.num_bytes += len(data)
+        return self.f.write(data)
+
+
+def _open_export_sink(
+    stack: contextlib.ExitStack, path, compression: str | None
+):
+    """Internal function to open the file to export to, wrapped in a
+    compressing stream if needed. Everything opened is closed by the exit
+    stack, except a file-like `path`."""
+    if isinstance(path, (str, os.PathLike)):
+        f = stack.enter_context(open(path, "wb"))
+    else:
+        f = path
+
+    match compression:
+        case None:
+            return f
+        case "gzip":
+            return stack.enter_context(
+                gzip.GzipFile(fileobj=f, mode="wb", compresslevel=6)
+            )
+        case "zstd":
+            try:
+                import zstandard
+            except ImportError as import_error:
+                raise ImportError(
+                    "zstd compression requires `zstandard`. Install it with "
+                    "`pip install in-n-out-clients[zstd]`"
+                ) from import_error
+            return stack.enter_context(
+                zstandard.ZstdCompressor().stream_writer(f, closefd=False)
+            )
+        case _:
+            raise ValueError(
+                "compression must be `gzip`, `zstd` or None, got "
+                f"{compression}"
+            )
+
+
+def _records_to_dataframe(records, columns: List[str]) -> pd.DataFrame:
+    """Internal function to convert query result records into a dataframe.
+
+    :param records: rows returned by the query
+    :param columns: names of the columns in the query result
+    :return: dataframe of the records
+    """
+    # TODO pandas hotfix: unable to understand date as a timevalue
+    dtype_mapping = None
+    for record in records:
+        indices_of_date_items = [
+            i
+            for i, item in enumerate(record)
+            if isinstance(item, datetime.date)
+        ]
+        dtype_mapping = {
+            columns[i]: "datetime64[ns]" for i in indices_of_date_items
+        }
+        break
+
+    df = pd.DataFrame.from_records(records, columns=columns)
+
+    if dtype_mapping:
+        df = df.astype(dtype_mapping)
+    return df
 
 
 def _generate_default_cols_when_partial_data(
@@ -302,72 +1962,304 @@ def _generate_default_cols_when_partial_data(
 
 
 def insert_with_conflict_resolution(
-    table, conn, keys, data_iter, on_data_conflict, data_conflict_properties
+    table,
+    conn,
+    keys,
+    data_iter,
+    on_data_conflict,
+    data_conflict_properties,
+    skip_unchanged=False,
+    row_hash_column=None,
+    write_stats=None,
 ):
     from sqlalchemy.dialects.postgresql import insert
 
     data = [dict(zip(keys, row, strict=True)) for row in data_iter]
 
-    sqlalchemy_table = table.table
-    table_name = sqlalchemy_table.name
+    instrumentation = get_instrumentation()
+    with instrumentation.span(
+        "postgres.insert_with_conflict_resolution",
+        on_data_conflict=on_data_conflict,
+    ) as span:
+        span.add("rows", len(data))
 
-    insert_statement = insert(sqlalchemy_table).values(data)
+        sqlalchemy_table = table.table
+        table_name = sqlalchemy_table.name
 
-    # -- find columns that need to be added to insert query in case of
-    # partial data
-    non_nullable_cols_with_no_default = (
-        _generate_default_cols_when_partial_data(
-            conn=conn, table_name=table_name, columns_in_data=keys
-        )
+        insert_statement = insert(sqlalchemy_table).values(data)
+
+        # -- find columns that need to be added to insert query in case of
+        # partial data
+        with instrumentation.span(
+            "postgres.insert_with_conflict_resolution.prepare"
+        ):
+            non_nullable_cols_with_no_default = (
+                _generate_default_cols_when_partial_data(
+                    conn=conn, table_name=table_name, columns_in_data=keys
+                )
+            )
+        span.add("round_trips")
+        for sqlalchemy_column in non_nullable_cols_with_no_default:
+            sqlalchemy_table.append_column(sqlalchemy_column)
+
+        match on_data_conflict:
+            case ConflictResolutionStrategy.REPLACE:
+                set_query = {
+                    c.key: c
+                    for c in insert_statement.excluded
+                    if c.key not in data_conflict_properties
+                }
+
+                for col in non_nullable_cols_with_no_default:
+                    set_query[col.key] = col
+
+                # -- conflicting rows whose values did not change are skipped
+                is_changed = None
+                if skip_unchanged:
+                    is_changed = _is_changed(
+                        sqlalchemy_table,
+                        insert_statement.excluded,
+                        _get_compared_columns(
+                            keys, data_conflict_properties, row_hash_column
+                        ),
+                    )
+                stmt = insert_statement.on_conflict_do_update(
+                    index_elements=data_conflict_properties,
+                    set_=set_query,
+                    where=is_changed,
+                )
+                if skip_unchanged:
+                    # -- xmax is 0 for rows that were inserted
+                    stmt = stmt.returning(db.literal_column("xmax = 0"))
+            case _:
+                stmt = insert_statement.on_conflict_do_nothing(
+                    index_elements=data_conflict_properties
+                )
+
+        with instrumentation.span(
+            "postgres.insert_with_conflict_resolution.write"
+        ):
+            result = conn.execute(stmt)
+        span.add("round_trips")
+        num_results = result.rowcount
+        if (
+            skip_unchanged
+            and on_data_conflict == ConflictResolutionStrategy.REPLACE
+        ):
+            is_inserted = result.scalars().all()
+            num_results = len(is_inserted)
+            _add_write_stats(
+                write_stats,
+                num_inserted=sum(is_inserted),
+                num_updated=num_results - sum(is_inserted),
+                num_rows=len(data),
+            )
+        span.add("rows_written", num_results)
+
+        if on_data_conflict == ConflictResolutionStrategy.FAIL:
+            if num_results != len(data):
+                # -- raising rolls back the transaction `to_sql` runs in
+                # TODO maybe can do a on_conflict_do_update query instead,
+                # then return the
+                # excluded values? E..g because at the moment the
+                # returned data is a misnomer!
+                raise OnDataConflictFail(
+                    {
+                        "msg": (
+                            f"Found {len(data) - num_results} conflicting rows"
+                        ),
+                        "data": [
+                            {
+                                "data_conflict_properties": (
+                                    data_conflict_properties
+                                ),
+                                "first_5_conflicting_rows": (str(data[:5])),
+                            }
+                        ],
+                    }
+                )
+
+    return num_results
+
+
+def upsert_column_subset(
+    table,
+    conn,
+    keys,
+    data_iter,
+    on_data_conflict,
+    data_conflict_properties,
+    skip_unchanged=False,
+    row_hash_column=None,
+    write_stats=None,
+):
+    """Insert method for `to_sql` that writes only the columns in the data.
+
+    Rows are copied into a temporary table, existing rows are updated from it
+    with a single `UPDATE ... FROM` for on_data_conflict="replace", and new
+    rows are inserted with `INSERT ... SELECT ... WHERE NOT EXISTS`.
+    """
+    sqlalchemy_table = table.table
+    preparer = conn.dialect.identifier_preparer
+    target = _qualified_table_name(
+        preparer, sqlalchemy_table.name, sqlalchemy_table.schema
     )
-    for sqlalchemy_column in non_nullable_cols_with_no_default:
-        sqlalchemy_table.append_column(sqlalchemy_column)
-
-    match on_data_conflict:
-        case ConflictResolutionStrategy.REPLACE:
-            set_query = {
-                c.key: c
-                for c in insert_statement.excluded
-                if c.key not in data_conflict_properties
-            }
+    staging_table_name = f"in_n_out_staging_{uuid.uuid4().hex[:8]}"
+    staging = preparer.quote(staging_table_name)
+    columns = [preparer.quote(key) for key in keys]
+    key_columns = [preparer.quote(key) for key in data_conflict_properties]
+    value_columns = [column for column in columns if column not in key_columns]
+    matches_key = " AND ".join(f"t.{key} = s.{key}" for key in key_columns)
 
-            for col in non_nullable_cols_with_no_default:
-                set_query[col.key] = col
+    instrumentation = get_instrumentation()
+    with instrumentation.span(
+        "postgres.upsert_column_subset", on_data_conflict=on_data_conflict
+    ) as span:
+        # -- the staging table takes the types of the target columns
+        conn.execute(
+            db.text(
+                f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS "
+                f"SELECT {', '.join(columns)} FROM {target} WITH NO DATA"
+            )
+        )
+        df = pd.DataFrame.from_records(list(data_iter), columns=keys)
+        span.add("rows", len(df))
+        dtypes = {column.name: column.type for column in sqlalchemy_table.c}
+        _bulk_load(conn, df, staging_table_name, None, dtypes)
 
-            stmt = insert_statement.on_conflict_do_update(
-                index_elements=data_conflict_properties,
-                set_=set_query,
+        num_updated = None
+        if (
+            on_data_conflict == ConflictResolutionStrategy.REPLACE
+            and value_columns
+        ):
+            set_columns = ", ".join(
+                f"{column} = s.{column}" for column in value_columns
             )
-        case _:
-            stmt = insert_statement.on_conflict_do_nothing(
-                index_elements=data_conflict_properties
+            is_changed = ""
+            if skip_unchanged:
+                compared_columns = _get_compared_columns(
+                    keys, data_conflict_properties, row_hash_column
+                )
+                is_changed = " OR ".join(
+                    f"t.{column} IS DISTINCT FROM s.{column}"
+                    for column in map(preparer.quote, compared_columns)
+                )
+                is_changed = f" AND ({is_changed or 'false'})"
+            num_updated = conn.execute(
+                db.text(
+                    f"UPDATE {target} t SET {set_columns} FROM {staging} s "
+                    f"WHERE {matches_key}{is_changed}"
+                )
+            ).rowcount
+        num_inserted = conn.execute(
+            db.text(
+                f"INSERT INTO {target} ({', '.join(columns)}) "
+                f"SELECT {', '.join(f's.{column}' for column in columns)} "
+                f"FROM {staging} s WHERE NOT EXISTS "
+                f"(SELECT 1 FROM {target} t WHERE {matches_key})"
             )
+        ).rowcount
+        conn.execute(db.text(f"DROP TABLE {staging}"))
+        # -- create, copy, insert and drop, plus the update
+        span.add("round_trips", 4 + int(num_updated is not None))
+        num_updated = num_updated or 0
+        span.add("rows_written", num_updated + num_inserted)
+    _add_write_stats(
+        write_stats,
+        num_inserted=num_inserted,
+        num_updated=num_updated,
+        num_rows=len(df),
+    )
 
-    result = conn.execute(stmt)
-    num_results = result.rowcount
+    logger.debug(
+        f"Updated {num_updated} and inserted {num_inserted} rows into "
+        f"`{sqlalchemy_table.name}`..."
+    )
+    if (
+        on_data_conflict == ConflictResolutionStrategy.FAIL
+        and num_inserted != len(df)
+    ):
+        raise OnDataConflictFail(
+            {
+                "msg": f"Found {len(df) - num_inserted} conflicting rows",
+                "data": [
+                    {"data_conflict_properties": data_conflict_properties}
+                ],
+            }
+        )
+    return num_updated + num_inserted
 
-    if on_data_conflict == ConflictResolutionStrategy.FAIL:
-        if num_results != len(data):
-            conn.rollback()
-            # TODO maybe can do a on_conflict_do_update query instead,
-            # then return the
-            # excluded values? E..g because at the moment the
-            # returned data is a misnomer!
-            raise OnDataConflictFail(
-                {
-                    "msg": f"Found {len(data) - num_results} conflicting rows",
-                    "data": [
-                        {
-                            "data_conflict_properties": (
-                                data_conflict_properties
-                            ),
-                            "first_5_conflicting_rows": (str(data[:5])),
-                        }
-                    ],
-                }
-            )
 
-    return num_results
+def add_row_hash(
+    df: pd.DataFrame,
+    row_hash_column: str | None,
+    data_conflict_properties: List[str] | None,
+) -> pd.DataFrame:
+    """Add a column with a 64 bit hash of the values of the non key columns
+    of each row, to detect changed rows by comparing a single column.
+
+    :param df: dataframe to hash
+    :param row_hash_column: name of the hash column, nothing is added if
+        None
+    :param data_conflict_properties: key columns, excluded from the hash
+    :return: dataframe with the hash column
+    """
+    if row_hash_column is None:
+        return df
+    value_columns = [
+        column
+        for column in df.columns
+        if column not in (data_conflict_properties or [])
+        and column != row_hash_column
+    ]
+    df_values = df[value_columns]
+    # -- object columns may hold unhashable values, e.g. dicts for JSONB
+    object_columns = df_values.select_dtypes("object").columns
+    df_values = df_values.astype({column: str for column in object_columns})
+    row_hash = pd.util.hash_pandas_object(df_values, index=False)
+    # -- postgres has no unsigned integers
+    return df.assign(**{row_hash_column: row_hash.to_numpy().view("int64")})
+
+
+def _get_compared_columns(
+    keys: List[str],
+    data_conflict_properties: List[str],
+    row_hash_column: str | None,
+) -> List[str]:
+    """Internal function to get the columns compared to detect changes."""
+    if row_hash_column is not None:
+        return [row_hash_column]
+    return [key for key in keys if key not in data_conflict_properties]
+
+
+def _is_changed(table, excluded, columns: List[str]):
+    """Internal function to build the condition under which a conflicting
+    row is updated, i.e. any of the columns changed."""
+    return db.or_(
+        db.false(),
+        *(
+            table.c[column].is_distinct_from(excluded[column])
+            for column in columns
+        ),
+    )
+
+
+def _add_write_stats(
+    write_stats: dict | None,
+    num_inserted: int,
+    num_updated: int,
+    num_rows: int,
+):
+    """Internal function to add the row counts of an insert to the
+    statistics of a write, which may span several inserts."""
+    if write_stats is None:
+        return
+    for stat, value in (
+        ("num_inserted", num_inserted),
+        ("num_updated", num_updated),
+        ("num_unchanged", num_rows - num_inserted - num_updated),
+    ):
+        write_stats[stat] = write_stats.get(stat, 0) + int(value)
 
 
 def postgres_fail():
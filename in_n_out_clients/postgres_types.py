@@ -0,0 +1,263 @@
+import logging
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import (
+    BIGINT,
+    BOOLEAN,
+    DATE,
+    FLOAT,
+    INTEGER,
+    NUMERIC,
+    REAL,
+    SMALLINT,
+    TIMESTAMP,
+    VARCHAR,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, BYTEA, ENUM, JSONB
+from sqlalchemy.types import TypeEngine
+
+logger = logging.getLogger(__name__)
+
+# -- category columns are written as postgres enums or as their integer codes
+CATEGORY_ENCODINGS = ("enum", "codes")
+
+_INT16 = np.iinfo(np.int16)
+_INT32 = np.iinfo(np.int32)
+
+# -- user registered mappings, checked before the built-in ones
+_registered_mappings: List[
+    Tuple[Callable[[pd.Series], bool], Callable[[pd.Series], TypeEngine]]
+] = []
+
+
+def register_dtype_mapping(
+    predicate: Callable[[pd.Series], bool],
+    sqlalchemy_type: TypeEngine | Callable[[pd.Series], TypeEngine],
+):
+    """Register a custom mapping from a pandas column to a postgres type.
+    Mappings registered later take precedence over earlier ones and over
+    the built-in mappings.
+
+    :param predicate: function that returns True for columns the mapping
+        applies to
+    :param sqlalchemy_type: the SQLAlchemy type to use, or a function that
+        returns it given the column
+    """
+    is_type_class = isinstance(sqlalchemy_type, type) and issubclass(
+        sqlalchemy_type, TypeEngine
+    )
+    if is_type_class or isinstance(sqlalchemy_type, TypeEngine):
+        type_ = sqlalchemy_type
+
+        def sqlalchemy_type(series):
+            return type_
+
+    _registered_mappings.insert(0, (predicate, sqlalchemy_type))
+
+
+def _get_integer_type(series: pd.Series) -> TypeEngine:
+    dtype = series.dtype
+    if dtype.kind == "u":
+        # -- unsigned integers need the next signed type up
+        return {1: SMALLINT, 2: INTEGER, 4: BIGINT}.get(
+            dtype.itemsize, NUMERIC(20, 0)
+        )
+    if dtype.itemsize <= 2:
+        return SMALLINT
+    if dtype.itemsize == 4:
+        return INTEGER
+
+    # -- int64 is the pandas default, so use the smallest of INTEGER and
+    # BIGINT that fits the data. SMALLINT is not used to leave room for
+    # subsequent appends
+    if series.empty:
+        return INTEGER
+    min_value, max_value = series.min(), series.max()
+    if pd.isna(min_value):
+        return INTEGER
+    if _INT32.min <= min_value and max_value <= _INT32.max:
+        return INTEGER
+    return BIGINT
+
+
+def _get_category_type(
+    series: pd.Series, enum_name: str, schema: str | None, encoding: str
+) -> TypeEngine:
+    categories = series.cat.categories
+    if encoding == "codes":
+        return SMALLINT if len(categories) <= _INT16.max else INTEGER
+    if pd.api.types.infer_dtype(categories, skipna=True) == "string":
+        return ENUM(
+            *categories, name=enum_name, schema=schema, create_type=False
+        )
+
+    logger.debug(
+        f"Categories of column `{series.name}` are not strings... mapping "
+        "column using the dtype of its categories"
+    )
+    return _get_builtin_type(
+        pd.Series(categories), enum_name, schema, encoding
+    )
+
+
+def _get_first_valid_value(series: pd.Series):
+    index = series.first_valid_index()
+    return None if index is None else series[index]
+
+
+def _get_array_type(series: pd.Series) -> TypeEngine:
+    elements = pd.Series(
+        [element for value in series.dropna() for element in value[:1]],
+        dtype=object,
+    )
+    element_type = _get_object_type(elements)
+    if element_type is JSONB or isinstance(element_type, ARRAY):
+        # -- nested or heterogeneous lists are stored as json
+        return JSONB
+    return ARRAY(element_type)
+
+
+def _get_object_type(series: pd.Series) -> TypeEngine:
+    inferred_type = pd.api.types.infer_dtype(series, skipna=True)
+    match inferred_type:
+        case "string" | "empty":
+            return VARCHAR
+        case "boolean":
+            return BOOLEAN
+        case "integer":
+            return BIGINT
+        case "floating" | "mixed-integer-float":
+            return FLOAT
+        case "decimal":
+            return NUMERIC
+        case "date":
+            return DATE
+        case "datetime":
+            value = _get_first_valid_value(series)
+            return TIMESTAMP(timezone=value.tzinfo is not None)
+        case "bytes":
+            return BYTEA
+        case "mixed":
+            value = _get_first_valid_value(series)
+            if isinstance(value, dict):
+                return JSONB
+            if isinstance(value, (list, tuple)):
+                return _get_array_type(series)
+    return VARCHAR
+
+
+def _get_builtin_type(
+    series: pd.Series,
+    enum_name: str,
+    schema: str | None,
+    category_encoding: str,
+) -> TypeEngine:
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        return _get_category_type(series, enum_name, schema, category_encoding)
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        return TIMESTAMP(timezone=True)
+    if pd.api.types.is_bool_dtype(dtype):
+        return BOOLEAN
+    if pd.api.types.is_integer_dtype(dtype):
+        return _get_integer_type(series)
+    if pd.api.types.is_float_dtype(dtype):
+        return REAL if dtype.itemsize == 4 else FLOAT
+    if pd.api.types.is_datetime64_dtype(dtype):
+        return TIMESTAMP
+    if pd.api.types.is_timedelta64_dtype(dtype):
+        # -- pandas writes timedeltas as integer nanoseconds
+        return BIGINT
+    if pd.api.types.is_string_dtype(dtype) and dtype != object:
+        return VARCHAR
+    return _get_object_type(series)
+
+
+def get_pg_datatypes(
+    df: pd.DataFrame,
+    table_name: str,
+    dataset_name: str | None = None,
+    category_encoding: str = "enum",
+) -> Dict[str, TypeEngine]:
+    """Get the postgres type of each column of a dataframe. Types are
+    inferred from the dtypes, and for `object` columns from the values,
+    without converting the dataframe.
+
+    :param df: dataframe to get types for
+    :param table_name: name of the table the dataframe is written to, used
+        to name enum types
+    :param dataset_name: name of the dataset (postgres schema) that the
+        table belongs to, defaults to None
+    :param category_encoding: how to write category columns, either as
+        postgres enums ("enum") or as their integer codes ("codes"),
+        defaults to "enum"
+    :return: mapping of column name to SQLAlchemy type
+    """
+    if category_encoding not in CATEGORY_ENCODINGS:
+        raise ValueError(
+            f"category_encoding must be one of {CATEGORY_ENCODINGS}, "
+            f"got `{category_encoding}`"
+        )
+
+    dtypes = {}
+    for column, series in df.items():
+        for predicate, sqlalchemy_type in _registered_mappings:
+            if predicate(series):
+                dtypes[column] = sqlalchemy_type(series)
+                break
+        else:
+            dtypes[column] = _get_builtin_type(
+                series,
+                enum_name=f"{table_name}_{column}".lower(),
+                schema=dataset_name,
+                category_encoding=category_encoding,
+            )
+    return dtypes
+
+
+def encode_categories(
+    df: pd.DataFrame, category_encoding: str = "enum"
+) -> pd.DataFrame:
+    """Replace category columns by their integer codes if
+    `category_encoding` is "codes". Only the category columns are replaced,
+    the rest of the dataframe is not copied.
+
+    :param df: dataframe to encode
+    :param category_encoding: how category columns are written, defaults
+        to "enum"
+    :return: dataframe with encoded category columns
+    """
+    if category_encoding != "codes":
+        return df
+
+    encoded_columns = {}
+    for column, series in df.items():
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes = series.cat.codes
+            # -- missing values have code -1
+            encoded_columns[column] = codes.astype("Int32").mask(codes == -1)
+    if not encoded_columns:
+        return df
+    return df.assign(**encoded_columns)
+
+
+def create_enum_types(conn, dtypes: Dict[str, TypeEngine]):
+    """Create the enum types used by a table if they do not exist, and add
+    any values that are missing from existing enum types.
+
+    :param conn: SQLAlchemy connection
+    :param dtypes: mapping of column name to SQLAlchemy type
+    """
+    for sqlalchemy_type in dtypes.values():
+        if not isinstance(sqlalchemy_type, ENUM):
+            continue
+        sqlalchemy_type.create(conn, checkfirst=True)
+        preparer = conn.dialect.identifier_preparer
+        enum_name = preparer.format_type(sqlalchemy_type)
+        for value in sqlalchemy_type.enums:
+            conn.exec_driver_sql(
+                f"ALTER TYPE {enum_name} ADD VALUE IF NOT EXISTS %(value)s",
+                {"value": value},
+            )
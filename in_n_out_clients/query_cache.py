@@ -0,0 +1,445 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Iterable, List, Set
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# -- queries that only read data, other queries are never cached
+_READ_QUERY_PATTERN = re.compile(r"^\s*(select|with|values|table)\b", re.I)
+_IDENTIFIER = r'(?:"[^"]+"|[\w$]+)'
+# -- string literals and comments, which can contain anything
+_LITERAL_OR_COMMENT_PATTERN = re.compile(
+    r"'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/|\$(\w*)\$.*?\$\1\$", re.S
+)
+# -- whitespace, and the parts of a query in which whitespace is
+# significant: string literals (including E'' strings with backslash
+# escapes), quoted identifiers and comments
+_WHITESPACE_PATTERN = re.compile(
+    r"(\b[eE]'(?:[^'\\]|\\.|'')*'|'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|"
+    r"--[^\n]*|/\*.*?\*/|\$(\w*)\$.*?\$\2\$)|\s+",
+    re.S,
+)
+_TOKEN_PATTERN = re.compile(r'"(?:[^"]|"")+"|[\w$]+|[^\s\w]')
+# -- keywords that end the list of items of a FROM clause
+_FROM_CLAUSE_END_KEYWORDS = frozenset(
+    {
+        "where",
+        "group",
+        "having",
+        "window",
+        "order",
+        "limit",
+        "offset",
+        "fetch",
+        "union",
+        "intersect",
+        "except",
+        "returning",
+        "for",
+        "select",
+        "set",
+        "values",
+        "into",
+    }
+)
+# -- keywords that can precede a "(" without it being a function call
+_NON_FUNCTION_KEYWORDS = frozenset(
+    {"from", "join", "lateral", "as", "in", "on", "using", "and", "or", "not"}
+)
+# -- parts of SELECT queries that lock rows, create a table or have side
+# effects, so the query can neither run on a replica nor be cached
+_SIDE_EFFECT_PATTERN = re.compile(
+    r"\bfor\s+(?:no\s+key\s+update|update|key\s+share|share)\b|\binto\b|"
+    r"\b(?:nextval|setval|pg_(?:try_)?advisory_\w+|pg_notify|set_config|"
+    r"pg_cancel_backend|pg_terminate_backend|lo_\w+|dblink_exec)\s*\(",
+    re.I,
+)
+_MODIFIED_TABLE_PATTERN = re.compile(
+    r"\b(?:insert\s+into|update|delete\s+from|truncate(?:\s+table)?)\s+"
+    rf"((?:{_IDENTIFIER}\.)?{_IDENTIFIER})",
+    re.I,
+)
+
+
+def normalise_query(query: str) -> str:
+    """Collapse whitespace outside of string literals, quoted identifiers
+    and comments, and strip trailing semicolons, so that trivially different
+    spellings of a query share a cache entry."""
+    return (
+        _WHITESPACE_PATTERN.sub(lambda match: match.group(1) or " ", query)
+        .strip()
+        .rstrip(";")
+        .strip()
+    )
+
+
+def is_read_query(query: str) -> bool:
+    """Whether a query only reads data, i.e. it is a SELECT, WITH, VALUES or
+    TABLE query that does not insert into, update, delete from or truncate
+    a table, lock rows (e.g. `FOR UPDATE`), create a table with
+    `SELECT ... INTO` or call functions with side effects (e.g. `nextval`
+    or `pg_advisory_lock`)."""
+    if _READ_QUERY_PATTERN.match(query) is None:
+        return False
+    return not (
+        _SIDE_EFFECT_PATTERN.search(
+            _LITERAL_OR_COMMENT_PATTERN.sub(" ", query)
+        )
+        or get_modified_tables(query)
+    )
+
+
+def get_referenced_tables(query: str) -> Set[str] | None:
+    """Get the names of the tables (or views) a query reads from, without
+    schema, from the items of its FROM clauses and JOINs.
+
+    :param query: SQL query
+    :return: lower-cased table names, or None if they can not be determined,
+        e.g. if a function is called in a FROM clause
+    """
+    # -- the empty token marks the end of the query
+    tokens = _TOKEN_PATTERN.findall(
+        _LITERAL_OR_COMMENT_PATTERN.sub(" ", query)
+    ) + [""]
+    tables = set()
+    # -- for each level of parentheses, whether it is in a FROM clause, or
+    # None for the arguments of a function call, e.g. EXTRACT(x FROM y)
+    in_from_clause = [False]
+    expects_table = False
+    i = 0
+    while i < len(tokens) - 1:
+        token = tokens[i]
+        keyword = token.lower()
+        if token == "(":
+            in_from_clause.append(
+                None if _is_function_call(tokens, i) else False
+            )
+            expects_table = False
+        elif token == ")":
+            if len(in_from_clause) > 1:
+                in_from_clause.pop()
+            expects_table = False
+        elif in_from_clause[-1] is None:
+            pass
+        elif keyword in ("from", "join") and tokens[i - 1].lower() != (
+            "distinct"
+        ):
+            in_from_clause[-1] = True
+            expects_table = True
+        elif (keyword == "table" and i == 0) or (
+            token == "," and in_from_clause[-1]
+        ):
+            expects_table = True
+        elif keyword in _FROM_CLAUSE_END_KEYWORDS:
+            in_from_clause[-1] = False
+            expects_table = False
+        elif expects_table and keyword not in ("only", "lateral"):
+            table_name, i = _read_table_name(tokens, i)
+            if table_name is None:
+                return None
+            tables.add(table_name)
+            expects_table = False
+        i += 1
+    return tables
+
+
+def _is_function_call(tokens: List[str], i: int) -> bool:
+    """Internal function to check whether the "(" at position `i` opens the
+    arguments of a function call, rather than a subquery or a list."""
+    previous_keyword = tokens[i - 1].lower() if i else ""
+    return (
+        re.fullmatch(r"[\w$]+", previous_keyword) is not None
+        and previous_keyword not in _NON_FUNCTION_KEYWORDS
+        and tokens[i + 1].lower() not in ("select", "with", "values")
+    )
+
+
+def _read_table_name(tokens: List[str], i: int) -> tuple:
+    """Internal function to read a, possibly schema qualified, table name
+    starting at position `i`.
+
+    :return: lower-cased table name without schema, or None if it is a
+        function call, and the position of its last token
+    """
+    table_name = tokens[i]
+    while tokens[i + 1] == "." and tokens[i + 2]:
+        table_name = tokens[i + 2]
+        i += 2
+    if tokens[i + 1] == "(":
+        # -- e.g. generate_series(...), which can read any table
+        return None, i
+    return table_name.strip('"').lower(), i
+
+
+def get_modified_tables(query: str) -> Set[str]:
+    """Get the names of the tables a statement inserts into, updates,
+    deletes from or truncates, without schema.
+
+    :param query: SQL statement
+    :return: lower-cased table names
+    """
+    return {
+        reference.rsplit(".", 1)[-1].strip('"').lower()
+        for reference in _MODIFIED_TABLE_PATTERN.findall(query)
+    }
+
+
+@dataclass
+class _CacheEntry:
+    # -- None if the tables are not known, any write then invalidates it
+    tables: Set[str] | None
+    expires_at: float | None
+    nbytes: int
+    df: pd.DataFrame | None = None
+    path: str | None = None
+
+    def is_expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= (
+            self.expires_at
+        )
+
+
+class QueryCache:
+    """Cache of query results, kept in memory up to a byte budget and
+    optionally spilled to parquet files on disk when evicted from memory.
+
+    Entries are keyed by the normalised query and its parameters, and are
+    invalidated when a client using the cache writes to a table that the
+    query reads from. Queries whose tables can not be determined, e.g.
+    because they call a function in their FROM clause, are invalidated by
+    any write. Results of queries that started before a write to
+    their tables was invalidated are not cached, see `get_version`.
+
+    :param max_bytes: memory budget for cached results, defaults to 256MiB
+    :param ttl: seconds after which entries expire, defaults to None (never)
+    :param disk_dir: directory for the on-disk tier, defaults to None (no
+        disk tier)
+    :param max_disk_bytes: disk budget for cached results, defaults to 1GiB
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 256 * 1024 * 1024,
+        ttl: float | None = None,
+        disk_dir: str | None = None,
+        max_disk_bytes: int = 1024 * 1024 * 1024,
+    ):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+
+        self._memory = OrderedDict()
+        self._disk = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        # -- incremented on every invalidation, and the version each table
+        # was last invalidated at
+        self._version = 0
+        self._invalidated_at = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _get_key(query: str, params: dict | None = None) -> str:
+        params = sorted((params or {}).items())
+        return hashlib.sha256(
+            repr((normalise_query(query), params)).encode()
+        ).hexdigest()
+
+    @staticmethod
+    def is_cacheable(query: str) -> bool:
+        return is_read_query(query)
+
+    def get(self, query: str, params: dict | None = None) -> pd.DataFrame:
+        """Get the cached result of a query.
+
+        :param query: SQL query
+        :param params: parameters of the query, defaults to None
+        :return: copy of the cached result, or None if there is none
+        """
+        key = self._get_key(query, params)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry.is_expired():
+                    self._remove_from_memory(key)
+                else:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return entry.df.copy()
+
+            entry = self._disk.pop(key, None)
+            if entry is not None:
+                self._disk_bytes -= entry.nbytes
+                df = self._read_from_disk(entry)
+                if df is not None:
+                    logger.debug("Promoting cached query result from disk")
+                    entry.df, entry.path = df, None
+                    entry.nbytes = int(df.memory_usage(deep=True).sum())
+                    self._add_to_memory(key, entry)
+                    self.hits += 1
+                    return df.copy()
+
+            self.misses += 1
+            return None
+
+    def get_version(self) -> int:
+        """Get the version of the cache, to pass to `set` for a query that
+        is about to run. Writes invalidated after this point may not be
+        visible to the query, so its result is then not cached."""
+        with self._lock:
+            return self._version
+
+    def set(
+        self,
+        query: str,
+        df: pd.DataFrame,
+        params: dict | None = None,
+        ttl: float | None = None,
+        version: int | None = None,
+        dependent_tables: Iterable[str] = (),
+    ):
+        """Cache the result of a query.
+
+        :param query: SQL query
+        :param df: result of the query
+        :param params: parameters of the query, defaults to None
+        :param ttl: seconds after which the entry expires, defaults to the
+            ttl of the cache
+        :param version: version of the cache when the query started, see
+            `get_version`, defaults to None (the result is always cached)
+        :param dependent_tables: other tables the result depends on, e.g.
+            the tables behind the views the query reads from, defaults to ()
+        """
+        if not self.is_cacheable(query):
+            return
+        ttl = ttl if ttl is not None else self.ttl
+        key = self._get_key(query, params)
+        tables = get_referenced_tables(query)
+        if tables is not None:
+            tables.update(
+                table_name.lower() for table_name in dependent_tables
+            )
+        entry = _CacheEntry(
+            tables=tables,
+            expires_at=None if ttl is None else time.monotonic() + ttl,
+            nbytes=int(df.memory_usage(deep=True).sum()),
+            df=df.copy(),
+        )
+        with self._lock:
+            if version is not None and (
+                self._version > version
+                if entry.tables is None
+                else any(
+                    self._invalidated_at.get(table_name, -1) > version
+                    for table_name in entry.tables
+                )
+            ):
+                logger.debug("Not caching result read before a write...")
+                return
+            self._remove_from_memory(key)
+            self._remove_from_disk(key)
+            self._add_to_memory(key, entry)
+
+    def invalidate(self, table_name: str):
+        """Remove all cached results of queries that read from a table, or
+        whose tables are not known.
+
+        :param table_name: name of the table, without schema
+        """
+        table_name = table_name.lower()
+        with self._lock:
+            self._version += 1
+            self._invalidated_at[table_name] = self._version
+            for key in [
+                key
+                for key, entry in self._memory.items()
+                if entry.tables is None or table_name in entry.tables
+            ]:
+                self._remove_from_memory(key)
+            for key in [
+                key
+                for key, entry in self._disk.items()
+                if entry.tables is None or table_name in entry.tables
+            ]:
+                self._remove_from_disk(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._memory):
+                self._remove_from_memory(key)
+            for key in list(self._disk):
+                self._remove_from_disk(key)
+
+    def _add_to_memory(self, key: str, entry: _CacheEntry):
+        self._memory[key] = entry
+        self._memory_bytes += entry.nbytes
+        while self._memory_bytes > self.max_bytes and self._memory:
+            evicted_key, evicted_entry = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted_entry.nbytes
+            if not evicted_entry.is_expired():
+                self._spill_to_disk(evicted_key, evicted_entry)
+
+    def _remove_from_memory(self, key: str):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= entry.nbytes
+
+    def _spill_to_disk(self, key: str, entry: _CacheEntry):
+        if self.disk_dir is None:
+            return
+        path = os.path.join(self.disk_dir, f"{key}.parquet")
+        try:
+            entry.df.to_parquet(path, index=True)
+        except (
+            ValueError,
+            TypeError,
+            NotImplementedError,
+            ImportError,
+        ) as error:
+            # -- e.g. object columns with mixed types
+            logger.debug(f"Could not spill query result to disk: {error}")
+            return
+        entry.df, entry.path = None, path
+        entry.nbytes = os.path.getsize(path)
+        self._disk[key] = entry
+        self._disk_bytes += entry.nbytes
+        while self._disk_bytes > self.max_disk_bytes and self._disk:
+            self._remove_from_disk(next(iter(self._disk)))
+
+    def _read_from_disk(self, entry: _CacheEntry) -> pd.DataFrame | None:
+        try:
+            if entry.is_expired():
+                return None
+            return pd.read_parquet(entry.path)
+        except OSError:
+            return None
+        finally:
+            _remove_file(entry.path)
+
+    def _remove_from_disk(self, key: str):
+        entry = self._disk.pop(key, None)
+        if entry is not None:
+            self._disk_bytes -= entry.nbytes
+            _remove_file(entry.path)
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,144 @@
+import itertools
+import logging
+import threading
+import time
+from typing import List
+
+import sqlalchemy as db
+
+logger = logging.getLogger(__name__)
+
+# -- seconds since the last replayed transaction, 0 when the replica is
+# connected to the primary and has replayed everything it received. Servers
+# that are not in recovery are not replicas of anything and have no lag.
+# NULL, i.e. unhealthy, if the replica never received WAL from a primary or
+# has not replayed a transaction yet. A disconnected replica can not know how
+# far behind it is, so its lag is the age of its last replayed transaction
+_REPLICATION_LAG_QUERY = """
+SELECT CAST(CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() IS NULL THEN NULL
+    WHEN EXISTS (SELECT 1 FROM pg_stat_wal_receiver)
+        AND pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END AS float)
+"""
+
+
+class ReplicaRouter:
+    """Load balances reads round robin across read replicas that are
+    reachable and not lagging behind the primary by more than `max_lag`
+    seconds.
+
+    Replicas are health checked at most every `health_check_interval`
+    seconds, when an engine is requested. The check runs in a background
+    thread, so reads use the last known health and are never blocked by
+    slow or unreachable replicas. If no replica is (yet known to be)
+    healthy, `get_engine` returns None and reads should go to the primary.
+
+    :param engines: engines of the replicas
+    :param max_lag: maximum replication lag in seconds for a replica to be
+        used, defaults to 10
+    :param health_check_interval: seconds between health checks, defaults
+        to 5
+    """
+
+    def __init__(
+        self,
+        engines: List[db.Engine],
+        max_lag: float = 10.0,
+        health_check_interval: float = 5.0,
+    ):
+        self.engines = engines
+        self.max_lag = max_lag
+        self.health_check_interval = health_check_interval
+
+        self._healthy_engines = []
+        self._round_robin = itertools.cycle([])
+        self._last_health_check = None
+        # -- monotonic time before which everything committed to the
+        # primary has been replayed by the healthy replicas
+        self.replicated_until = None
+        self._lock = threading.Lock()
+        self._health_check_thread = None
+
+    def get_engine(self) -> db.Engine | None:
+        """Get the engine of the next healthy replica.
+
+        :return: engine, or None if no replica is healthy
+        """
+        with self._lock:
+            is_due = (
+                self._last_health_check is None
+                or time.monotonic() - self._last_health_check
+                >= self.health_check_interval
+            )
+            # -- a thread started before a fork is not alive in the child
+            if is_due and not (
+                self._health_check_thread is not None
+                and self._health_check_thread.is_alive()
+            ):
+                self._health_check_thread = threading.Thread(
+                    target=self.check_health,
+                    name="in-n-out-replica-health-check",
+                    daemon=True,
+                )
+                self._health_check_thread.start()
+
+            if not self._healthy_engines:
+                return None
+            return next(self._round_robin)
+
+    def check_health(self):
+        """Check which replicas are reachable and within the lag
+        threshold."""
+        started_at = time.monotonic()
+        healthy_engines = []
+        for engine in self.engines:
+            try:
+                with engine.connect() as con:
+                    lag = con.execute(db.text(_REPLICATION_LAG_QUERY)).scalar()
+            except db.exc.DBAPIError as error:
+                logger.warning(
+                    f"Replica `{engine.url.host}:{engine.url.port}` is "
+                    f"unreachable. Reason: {str(error.orig).strip()}"
+                )
+                continue
+            if lag is None:
+                logger.warning(
+                    f"Replica `{engine.url.host}:{engine.url.port}` is not "
+                    "replicating from the primary... not using it"
+                )
+                continue
+            if lag > self.max_lag:
+                logger.warning(
+                    f"Replica `{engine.url.host}:{engine.url.port}` lags "
+                    f"{lag:.1f}s behind the primary... not using it"
+                )
+                continue
+            healthy_engines.append(engine)
+
+        with self._lock:
+            self._set_healthy_engines(healthy_engines)
+            self._last_health_check = time.monotonic()
+            # -- replay only moves forward, so replicas that lagged at most
+            # max_lag when the check started have replayed everything
+            # committed before then
+            self.replicated_until = started_at - self.max_lag
+
+    def mark_unhealthy(self, engine: db.Engine):
+        """Stop using a replica until the next health check finds it
+        healthy, e.g. after failing to connect to it."""
+        with self._lock:
+            if engine in self._healthy_engines:
+                self._set_healthy_engines(
+                    [e for e in self._healthy_engines if e is not engine]
+                )
+
+    def dispose(self):
+        for engine in self.engines:
+            engine.dispose()
+
+    def _set_healthy_engines(self, engines: List[db.Engine]):
+        self._healthy_engines = engines
+        self._round_robin = itertools.cycle(engines)
@@ -0,0 +1,285 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable
+
+from in_n_out_clients.in_n_out_types import APIResponse
+
+logger = logging.getLogger(__name__)
+
+# -- marker placed on a queue by a stage to tell the next stage that there
+# are no more chunks to process
+_END_OF_STREAM = object()
+
+# -- how often (seconds) a stage blocked on a full/empty queue re-checks
+# whether another stage has failed
+_QUEUE_POLL_INTERVAL = 0.1
+
+
+class TransferAborted(Exception):
+    """Raised inside a pipeline stage when another stage has failed."""
+
+    pass
+
+
+class _StageMetrics:
+    """Timing metrics for a single stage of a transfer pipeline.
+
+    :param name: name of the stage
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.num_chunks = 0
+        self.num_rows = 0
+        self.busy_seconds = 0.0
+        self.wait_seconds = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "num_chunks": self.num_chunks,
+            "num_rows": self.num_rows,
+            "busy_seconds": round(self.busy_seconds, 6),
+            "wait_seconds": round(self.wait_seconds, 6),
+        }
+
+
+def _num_rows(chunk) -> int:
+    try:
+        return len(chunk)
+    except TypeError:
+        return 0
+
+
+def _put(
+    chunk_queue: queue.Queue,
+    item,
+    stop_event: threading.Event,
+    metrics: _StageMetrics,
+):
+    """Put an item on a bounded queue, blocking while it is full (this is
+    where backpressure is applied) but giving up if the pipeline stops."""
+    start = time.perf_counter()
+    while True:
+        if stop_event.is_set():
+            raise TransferAborted()
+        try:
+            chunk_queue.put(item, timeout=_QUEUE_POLL_INTERVAL)
+        except queue.Full:
+            continue
+        else:
+            break
+    metrics.wait_seconds += time.perf_counter() - start
+
+
+def _get(
+    chunk_queue: queue.Queue,
+    stop_event: threading.Event,
+    metrics: _StageMetrics,
+):
+    start = time.perf_counter()
+    while True:
+        if stop_event.is_set():
+            raise TransferAborted()
+        try:
+            item = chunk_queue.get(timeout=_QUEUE_POLL_INTERVAL)
+        except queue.Empty:
+            continue
+        else:
+            break
+    metrics.wait_seconds += time.perf_counter() - start
+    return item
+
+
+def _read_stage(chunks, out_queue, stop_event, metrics, errors):
+    iterator = iter(chunks)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                metrics.busy_seconds += time.perf_counter() - start
+            metrics.num_chunks += 1
+            metrics.num_rows += _num_rows(chunk)
+            _put(out_queue, chunk, stop_event, metrics)
+        _put(out_queue, _END_OF_STREAM, stop_event, metrics)
+    except TransferAborted:
+        pass
+    except Exception as exception:
+        errors.append(("read", exception))
+        stop_event.set()
+    finally:
+        # -- releases resources held by generators, e.g. database cursors
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+
+
+def _transform_stage(
+    transform, in_queue, out_queue, stop_event, metrics, errors
+):
+    try:
+        while True:
+            chunk = _get(in_queue, stop_event, metrics)
+            if chunk is _END_OF_STREAM:
+                break
+            if transform is not None:
+                start = time.perf_counter()
+                chunk = transform(chunk)
+                metrics.busy_seconds += time.perf_counter() - start
+            metrics.num_chunks += 1
+            metrics.num_rows += _num_rows(chunk)
+            _put(out_queue, chunk, stop_event, metrics)
+        _put(out_queue, _END_OF_STREAM, stop_event, metrics)
+    except TransferAborted:
+        pass
+    except Exception as exception:
+        errors.append(("transform", exception))
+        stop_event.set()
+
+
+def _write_stage(write_chunk, in_queue, stop_event, metrics, errors):
+    """Write stage of the pipeline.
+
+    :return: the response of the chunk that the target rejected, if any
+    """
+    try:
+        while True:
+            chunk = _get(in_queue, stop_event, metrics)
+            if chunk is _END_OF_STREAM:
+                break
+            start = time.perf_counter()
+            resp = write_chunk(chunk, metrics.num_chunks)
+            metrics.busy_seconds += time.perf_counter() - start
+            if resp.get("status_code", 200) >= 400:
+                stop_event.set()
+                return resp
+            metrics.num_chunks += 1
+            metrics.num_rows += _num_rows(chunk)
+    except TransferAborted:
+        pass
+    except Exception as exception:
+        errors.append(("write", exception))
+        stop_event.set()
+    return None
+
+
+def run_transfer(
+    chunks: Iterable,
+    write_chunk: Callable[[Any, int], APIResponse],
+    transform: Callable[[Any], Any] | None = None,
+    max_queue_size: int = 4,
+) -> APIResponse:
+    """Stream chunks from a reader into a writer, overlapping the read,
+    transform and write stages on separate threads.
+
+    Stages are connected by bounded queues, so a slow writer throttles the
+    reader instead of the whole source being buffered in memory.
+
+    :param chunks: iterable of chunks to transfer, iteration is done on the
+        reader thread
+    :param write_chunk: function called with `(chunk, chunk_number)` for each
+        chunk, must return an `APIResponse`. Responses with a status code of
+        400 or above stop the transfer
+    :param transform: function applied to each chunk before it is written,
+        defaults to None
+    :param max_queue_size: maximum number of chunks held between two stages,
+        defaults to 4
+    :return: summary of the transfer
+    """
+    if max_queue_size < 1:
+        raise ValueError("max_queue_size must be at least 1")
+
+    stage_metrics = {
+        stage_name: _StageMetrics(stage_name)
+        for stage_name in ("read", "transform", "write")
+    }
+    read_queue = queue.Queue(maxsize=max_queue_size)
+    write_queue = queue.Queue(maxsize=max_queue_size)
+    stop_event = threading.Event()
+    errors = []
+
+    threads = [
+        threading.Thread(
+            target=_read_stage,
+            args=(
+                chunks,
+                read_queue,
+                stop_event,
+                stage_metrics["read"],
+                errors,
+            ),
+            name="in-n-out-transfer-read",
+            daemon=True,
+        ),
+        threading.Thread(
+            target=_transform_stage,
+            args=(
+                transform,
+                read_queue,
+                write_queue,
+                stop_event,
+                stage_metrics["transform"],
+                errors,
+            ),
+            name="in-n-out-transfer-transform",
+            daemon=True,
+        ),
+    ]
+    transfer_start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+
+    # -- the write stage runs on the calling thread
+    write_metrics = stage_metrics["write"]
+    try:
+        failed_response = _write_stage(
+            write_chunk, write_queue, stop_event, write_metrics, errors
+        )
+    finally:
+        # -- unblocks the other stages if the write stage exited early
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+    elapsed_seconds = time.perf_counter() - transfer_start
+
+    summary = {
+        "num_chunks_written": write_metrics.num_chunks,
+        "num_rows_written": write_metrics.num_rows,
+        "elapsed_seconds": round(elapsed_seconds, 6),
+        "stage_metrics": {
+            stage_name: metrics.to_dict()
+            for stage_name, metrics in stage_metrics.items()
+        },
+    }
+
+    if errors:
+        stage_name, exception = errors[0]
+        _msg = (
+            f"Transfer failed during `{stage_name}` stage. Reason: {exception}"
+        )
+        logger.error(_msg)
+        return {"status_code": 500, "msg": _msg, "data": [summary]}
+
+    if failed_response is not None:
+        _msg = (
+            f"Transfer stopped after writing {write_metrics.num_chunks} "
+            "chunks since the target rejected a chunk"
+        )
+        logger.error(_msg)
+        return {
+            "status_code": failed_response["status_code"],
+            "msg": _msg,
+            "data": [summary, {"failed_chunk_response": failed_response}],
+        }
+
+    _msg = (
+        f"Successfully transferred {write_metrics.num_rows} rows in "
+        f"{write_metrics.num_chunks} chunks"
+    )
+    logger.info(_msg)
+    return {"status_code": 200, "msg": _msg, "data": [summary]}
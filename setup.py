@@ -49,7 +49,7 @@ setup(
     # package_data={'': ['api/specs/api.yaml']},
     include_package_data=True,
     license="MIT",
-    # entry_points={
-    #    'console_scripts': ['in-n-out-api=in_n_out.run_api:'],
-    # }
+    entry_points={
+        "console_scripts": ["in-n-out=in_n_out_clients.cli:main"],
+    },
 )
@@ -0,0 +1,54 @@
+import pytest
+
+from tests.benchmarks.conftest import BENCHMARK_CALENDAR_ID
+
+EVENT_COUNTS = [10, 100]
+
+
+def _make_events(num_events: int) -> list:
+    return [
+        {
+            "summary": f"Event {i}",
+            "start": {"dateTime": "2023-08-12T17:00:00", "timeZone": "UTC"},
+            "end": {"dateTime": "2023-08-12T17:15:00", "timeZone": "UTC"},
+        }
+        for i in range(num_events)
+    ]
+
+
+@pytest.mark.parametrize("num_events", EVENT_COUNTS)
+@pytest.mark.parametrize(
+    "on_data_conflict,data_conflict_properties,idempotent",
+    [
+        ("append", None, False),
+        ("ignore", ["summary"], False),
+        ("fail", ["summary"], False),
+        ("ignore", ["summary"], True),
+    ],
+)
+def test_create_events(
+    benchmark,
+    calendar_client,
+    fake_calendar_http,
+    num_events,
+    on_data_conflict,
+    data_conflict_properties,
+    idempotent,
+):
+    events = _make_events(num_events)
+    create_events_params = {
+        "calendar_id": BENCHMARK_CALENDAR_ID,
+        "events": events,
+        "on_data_conflict": on_data_conflict,
+        "data_conflict_properties": data_conflict_properties,
+        "idempotent": idempotent,
+    }
+    # -- requests are counted in a single call, since the benchmark runs a
+    # varying number of rounds and iterations, or none with
+    # --benchmark-disable
+    calendar_client.create_events(**create_events_params)
+    benchmark.extra_info["requests_per_call"] = fake_calendar_http.num_requests
+
+    resp = benchmark(calendar_client.create_events, **create_events_params)
+
+    assert resp["status_code"] == 201
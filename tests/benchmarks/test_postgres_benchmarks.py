@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pytest
+import sqlalchemy as db
+
+from tests.benchmarks.conftest import benchmark_table_name
+
+ROW_COUNTS = [100, 1_000, 10_000]
+COLUMN_COUNTS = [2, 10]
+ROUNDS = 5
+
+
+def _make_dataframe(num_rows: int, num_columns: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    data = {"id": np.arange(num_rows, dtype="int64")}
+    for i in range(num_columns - 1):
+        match i % 3:
+            case 0:
+                data[f"value_{i}"] = rng.random(num_rows)
+            case 1:
+                data[f"label_{i}"] = rng.integers(0, 100, num_rows).astype(str)
+            case 2:
+                data[f"timestamp_{i}"] = pd.Timestamp("2023-01-01") + (
+                    pd.to_timedelta(rng.integers(0, 10**6, num_rows), "s")
+                )
+    return pd.DataFrame(data)
+
+
+def _recreate_table(postgres_client, table_name, df, num_existing_rows):
+    with postgres_client.engine.begin() as con:
+        con.execute(db.text(f"DROP TABLE IF EXISTS {table_name}"))
+    df.head(0).to_sql(table_name, postgres_client.engine, index=False)
+    with postgres_client.engine.begin() as con:
+        con.execute(db.text(f"ALTER TABLE {table_name} ADD PRIMARY KEY (id)"))
+    if num_existing_rows:
+        df.head(num_existing_rows).to_sql(
+            table_name,
+            postgres_client.engine,
+            index=False,
+            if_exists="append",
+            method="multi",
+        )
+
+
+@pytest.mark.parametrize("num_columns", COLUMN_COUNTS)
+@pytest.mark.parametrize("num_rows", ROW_COUNTS)
+@pytest.mark.parametrize(
+    "on_data_conflict", ["append", "ignore", "replace", "fail"]
+)
+def test_write(
+    benchmark,
+    request,
+    postgres_client,
+    on_data_conflict,
+    num_rows,
+    num_columns,
+):
+    table_name = benchmark_table_name(request)
+    df = _make_dataframe(num_rows, num_columns)
+    # -- ignore/replace resolve conflicts against half of the rows, fail and
+    # append write into an empty table so that the write succeeds
+    num_existing_rows = (
+        num_rows // 2 if on_data_conflict in ("ignore", "replace") else 0
+    )
+
+    def setup():
+        _recreate_table(postgres_client, table_name, df, num_existing_rows)
+
+    resp = benchmark.pedantic(
+        postgres_client.write,
+        kwargs={
+            "df": df,
+            "table_name": table_name,
+            "dataset_name": "public",
+            "on_asset_conflict": "append",
+            "on_data_conflict": on_data_conflict,
+            "data_conflict_properties": ["id"],
+        },
+        setup=setup,
+        rounds=ROUNDS,
+    )
+
+    assert resp["status_code"] == 200
+
+
+@pytest.mark.parametrize("num_columns", COLUMN_COUNTS)
+@pytest.mark.parametrize("num_rows", ROW_COUNTS)
+def test_query(benchmark, request, postgres_client, num_rows, num_columns):
+    table_name = benchmark_table_name(request)
+    df = _make_dataframe(num_rows, num_columns)
+    _recreate_table(postgres_client, table_name, df, num_rows)
+
+    result = benchmark.pedantic(
+        postgres_client.query,
+        args=(f"SELECT * FROM {table_name}",),
+        rounds=ROUNDS,
+    )
+
+    assert len(result) == num_rows
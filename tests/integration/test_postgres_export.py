@@ -0,0 +1,56 @@
+import gzip
+import io
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from tests.integration.conftest import PostgresTestCase
+
+
+class TestExport(PostgresTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write(pd.DataFrame({"id": [1, 2, 3], "v": ["a", "b", "100%"]}))
+
+    def test_export_csv(self):
+        f = io.BytesIO()
+
+        resp = self.client.export(
+            f"SELECT * FROM {self.table_name} WHERE id > :id ORDER BY id",
+            f,
+            params={"id": 1},
+        )
+
+        assert resp["data"][0]["num_rows"] == 2
+        assert f.getvalue() == b"id,v\n2,b\n3,100%\n"
+        assert resp["data"][0]["num_bytes"] == len(f.getvalue())
+
+    def test_export_compressed_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "export.csv.gz")
+
+            # -- literal % next to bound parameters
+            self.client.export(
+                f"SELECT v FROM {self.table_name} "
+                "WHERE v LIKE '%!%' ESCAPE '!' AND id > :id",
+                path,
+                compression="gzip",
+                params={"id": 0},
+                header=False,
+            )
+
+            with gzip.open(path) as f:
+                assert f.read() == b"100%\n"
+
+    def test_export_binary(self):
+        f = io.BytesIO()
+
+        self.client.export(f"SELECT * FROM {self.table_name}", f, "binary")
+
+        assert f.getvalue().startswith(b"PGCOPY\n\xff\r\n\x00")
+
+
+if __name__ == "__main__":
+    unittest.main()
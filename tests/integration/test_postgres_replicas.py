@@ -0,0 +1,83 @@
+import os
+import time
+
+import pandas as pd
+import sqlalchemy as db
+from sqlalchemy.engine import make_url
+
+from in_n_out_clients.query_cache import QueryCache
+from tests.integration.conftest import (
+    POSTGRES_REPLICA_URI_ENV_VAR,
+    PostgresTestCase,
+)
+
+# -- seconds to wait for the replica to replay a write
+_REPLAY_TIMEOUT = 10
+
+
+class TestPostgresReplicas(PostgresTestCase):
+    """Tests against a primary and a streaming replica of it. Replay is
+    paused on the replica to simulate lag, which needs superuser."""
+
+    def setUp(self):
+        super().setUp()
+        replica_uri = os.environ.get(POSTGRES_REPLICA_URI_ENV_VAR)
+        if replica_uri is None:
+            self.skipTest(f"{POSTGRES_REPLICA_URI_ENV_VAR} is not set")
+        url = make_url(replica_uri).set(drivername="postgresql+psycopg2")
+        self.replica_engine = db.create_engine(url)
+        self.addCleanup(self.replica_engine.dispose)
+        self.client = self.get_client(
+            query_cache=QueryCache(),
+            replicas=[f"{url.host}:{url.port or 5432}"],
+            max_replica_lag=1,
+        )
+
+    def execute_on_replica(self, statement: str):
+        with self.replica_engine.connect() as con:
+            return con.exec_driver_sql(statement).scalar()
+
+    def wait_for_replay(self):
+        lsn = self.execute("SELECT pg_current_wal_lsn()")[0][0]
+        deadline = time.monotonic() + _REPLAY_TIMEOUT
+        while self.execute_on_replica(
+            f"SELECT pg_last_wal_replay_lsn() < {lsn!r}"
+        ):
+            if time.monotonic() > deadline:
+                self.fail("Replica did not replay the write in time")
+            time.sleep(0.05)
+
+    def count_rows(self) -> tuple:
+        """Count the rows of the table, and whether they were counted on
+        the replica."""
+        df = self.client.query(
+            "SELECT count(*) AS n, pg_is_in_recovery() AS is_replica "
+            f"FROM {self.table_name}"
+        )
+        return int(df["n"][0]), bool(df["is_replica"][0])
+
+    def test_reads_go_to_replica(self):
+        self.client.replica_router.check_health()
+
+        df = self.client.query("SELECT pg_is_in_recovery() AS is_replica")
+
+        assert df["is_replica"][0]
+
+    def test_query_after_write_is_not_cached_from_replica(self):
+        self.write(pd.DataFrame({"a": [1, 2]}))
+        self.wait_for_replay()
+        time.sleep(self.client.replica_router.max_lag)
+        self.client.replica_router.check_health()
+        assert self.count_rows() == (2, True)
+
+        self.execute_on_replica("SELECT pg_wal_replay_pause()")
+        self.addCleanup(
+            self.execute_on_replica, "SELECT pg_wal_replay_resume()"
+        )
+        self.write(pd.DataFrame({"a": [3]}))
+
+        # -- the replica is still known to be healthy, but has not replayed
+        # the write, so the query goes to the primary
+        assert self.count_rows() == (3, False)
+        assert self.count_rows() == (3, False)
+        assert self.client.query_cache.hits == 1
@@ -0,0 +1,423 @@
+import unittest
+
+import pandas as pd
+import sqlalchemy as db
+
+from in_n_out_clients.instrumentation import (
+    MetricsInstrumentation,
+    set_instrumentation,
+)
+from in_n_out_clients.postgres_client import OnDataConflictFail
+from tests.integration.conftest import PostgresTestCase
+
+
+class TestCategoryEncoding(PostgresTestCase):
+    def test_conflicts_on_category_codes(self):
+        df = pd.DataFrame({"k": pd.Categorical(["a", "b"]), "v": [1, 2]})
+        write_params = {
+            "data_conflict_properties": ["k"],
+            "category_encoding": "codes",
+        }
+        self.write(df, create_conflict_index=True, **write_params)
+
+        resp = self.write(df, on_data_conflict="fail", **write_params)
+        assert resp["status_code"] == 409
+        assert resp["data"][0]["num_conflicting_rows"] == 2
+
+        resp = self.write(df, dry_run=True, **write_params)
+        assert resp["data"][0]["num_conflicting_rows"] == 2
+
+
+class TestDryRun(PostgresTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_params = {"data_conflict_properties": ["id"]}
+        self.write(
+            pd.DataFrame({"id": [1, 2], "v": [1, 2]}),
+            create_conflict_index=True,
+            **self.write_params,
+        )
+        self.df = pd.DataFrame({"id": [2, 3], "v": [3, 4]})
+
+    def test_dry_run(self):
+        resp = self.write(
+            self.df,
+            on_data_conflict="replace",
+            dry_run=True,
+            **self.write_params,
+        )
+
+        assert resp["status_code"] == 200
+        assert resp["data"][0]["num_conflicting_rows"] == 1
+        assert resp["data"][0]["first_5_conflicting_rows"] == [{"id": "2"}]
+        assert self.read_table()["v"].tolist() == [1, 2]
+
+    def test_dry_run_on_new_table(self):
+        resp = self.write(
+            self.df,
+            table_name=f"{self.table_name}_new",
+            dry_run=True,
+            **self.write_params,
+        )
+
+        assert resp["data"][0]["num_conflicting_rows"] == 0
+        assert not self.client._table_exists(f"{self.table_name}_new", None)
+
+    def test_fail_writes_nothing(self):
+        resp = self.write(
+            self.df, on_data_conflict="fail", **self.write_params
+        )
+
+        assert resp["status_code"] == 409
+        assert self.read_table()["id"].tolist() == [1, 2]
+
+        resp = self.write(
+            self.df.assign(id=[3, 4]),
+            on_data_conflict="fail",
+            **self.write_params,
+        )
+        assert resp["status_code"] == 200
+        assert self.read_table()["id"].tolist() == [1, 2, 3, 4]
+
+    def test_check_conflicts(self):
+        instrumentation = MetricsInstrumentation()
+        set_instrumentation(instrumentation)
+        self.addCleanup(set_instrumentation, None)
+
+        resp = self.client.check_conflicts(
+            self.df, self.table_name, ["id"], sample_size=0
+        )
+
+        assert resp["data"][0]["num_conflicting_rows"] == 1
+        assert resp["data"][0]["first_5_conflicting_rows"] == []
+        counters = instrumentation.registry.snapshot()["counters"]
+        assert counters["postgres.check_conflicts.conflicting_rows"] == 1
+
+
+class TestConflictIndex(PostgresTestCase):
+    def test_index_on_new_table(self):
+        df = pd.DataFrame({"id": [1, 2]})
+        self.write(
+            df, create_conflict_index=True, data_conflict_properties=["id"]
+        )
+        assert (
+            self.client.ensure_unique_index(self.table_name, ["id"]) is False
+        )
+
+    def test_index_on_existing_table(self):
+        self.write(pd.DataFrame({"id": [1, 2], "v": [1, 2]}))
+
+        self.write(
+            pd.DataFrame({"id": [2, 3], "v": [3, 4]}),
+            on_data_conflict="replace",
+            data_conflict_properties=["id"],
+            create_conflict_index=True,
+        )
+
+        df = self.read_table().sort_values("id")
+        assert df.to_dict(orient="list") == {"id": [1, 2, 3], "v": [1, 3, 4]}
+
+    def test_existing_unique_keys_are_reused(self):
+        self.execute(
+            f"CREATE TABLE {self.table_name} (id int PRIMARY KEY, v int)"
+        )
+        assert not self.client.ensure_unique_index(self.table_name, ["id"])
+
+        # -- a partial index can not be the target of ON CONFLICT
+        self.execute(
+            f"CREATE UNIQUE INDEX {self.table_name}_partial "
+            f"ON {self.table_name} (v) WHERE v > 0"
+        )
+        assert self.client.ensure_unique_index(self.table_name, ["v"])
+        assert not self.client.ensure_unique_index(self.table_name, ["v"])
+
+    def test_duplicate_keys_on_new_table(self):
+        # -- appends are not deduplicated, so the index can not be created
+        with self.assertRaises(db.exc.IntegrityError):
+            self.write(
+                pd.DataFrame({"id": [1, 1]}),
+                create_conflict_index=True,
+                data_conflict_properties=["id"],
+            )
+        assert not self.client._table_exists(self.table_name, None)
+
+
+class TestPartitioning(PostgresTestCase):
+    def test_rows_are_written_to_their_partition(self):
+        df = pd.DataFrame(
+            {
+                "ts": pd.to_datetime(
+                    [
+                        "2024-01-31 23:00",
+                        "2024-02-01 00:00",
+                        "2024-02-15 00:00",
+                    ]
+                ),
+                "v": [1, 2, 3],
+            }
+        )
+        self.write(df, partition_by="ts")
+        # -- missing partitions are added to the existing table
+        self.write(df.assign(ts=pd.Timestamp("2024-03-01")), partition_by="ts")
+
+        partitions = self.execute(
+            f"SELECT tableoid::regclass::text, count(*) FROM {self.table_name} "
+            "GROUP BY 1 ORDER BY 1"
+        )
+        assert [tuple(partition) for partition in partitions] == [
+            (f"{self.table_name}_p202401", 1),
+            (f"{self.table_name}_p202402", 2),
+            (f"{self.table_name}_p202403", 3),
+        ]
+
+    def test_upsert_into_partitions(self):
+        df = pd.DataFrame(
+            {"ts": pd.to_datetime(["2024-01-01", "2025-01-01"]), "v": [1, 2]}
+        )
+        write_params = {
+            "partition_by": "ts",
+            "partition_interval": "year",
+            "data_conflict_properties": ["ts"],
+            "create_conflict_index": True,
+        }
+        self.write(df, **write_params)
+
+        self.write(
+            df.assign(v=[3, 4]), on_data_conflict="replace", **write_params
+        )
+
+        assert self.read_table().sort_values("ts")["v"].tolist() == [3, 4]
+
+
+class TestColumnSubset(PostgresTestCase):
+    def setUp(self):
+        super().setUp()
+        self.execute(
+            f"CREATE TABLE {self.table_name} "
+            "(id int PRIMARY KEY, a int NOT NULL DEFAULT 0, b int)"
+        )
+        self.execute(f"INSERT INTO {self.table_name} VALUES (1, 5, 5)")
+        self.df = pd.DataFrame({"id": [1, 2], "b": [7, 8]})
+
+    def read_rows(self):
+        df = self.read_table().sort_values("id")
+        return df[["id", "a", "b"]].values.tolist()
+
+    def test_replace(self):
+        resp = self.write(
+            self.df,
+            on_data_conflict="replace",
+            data_conflict_properties=["id"],
+            column_subset=True,
+        )
+
+        assert resp["status_code"] == 200
+        assert self.read_rows() == [[1, 5, 7], [2, 0, 8]]
+
+    def test_ignore(self):
+        self.write(
+            self.df,
+            on_data_conflict="ignore",
+            data_conflict_properties=["id"],
+            column_subset=True,
+        )
+
+        assert self.read_rows() == [[1, 5, 5], [2, 0, 8]]
+
+    def test_skip_unchanged(self):
+        write_params = {
+            "on_data_conflict": "replace",
+            "data_conflict_properties": ["id"],
+            "column_subset": True,
+            "skip_unchanged": True,
+        }
+        self.write(self.df, **write_params)
+
+        resp = self.write(self.df.assign(b=[7, 9]), **write_params)
+
+        assert resp["data"][0] == {
+            "num_rows": 2,
+            "num_duplicate_rows_dropped": 0,
+            "num_inserted": 0,
+            "num_updated": 1,
+            "num_unchanged": 1,
+        }
+        assert self.read_rows() == [[1, 5, 7], [2, 0, 9]]
+
+
+class TestTransaction(PostgresTestCase):
+    def test_writes_are_atomic(self):
+        df = pd.DataFrame({"id": [1, 2]})
+        self.write(
+            df, create_conflict_index=True, data_conflict_properties=["id"]
+        )
+
+        with self.assertRaises(RuntimeError):
+            with self.client.transaction():
+                self.write(df.assign(id=[3, 4]))
+                raise RuntimeError()
+
+        assert self.read_table()["id"].tolist() == [1, 2]
+
+    def test_nested_transaction_rolls_back_alone(self):
+        df = pd.DataFrame({"id": [1, 2]})
+        with self.client.transaction():
+            self.write(df)
+            with self.assertRaises(RuntimeError):
+                with self.client.transaction():
+                    self.write(df.assign(id=[3, 4]))
+                    raise RuntimeError()
+            # -- reads inside the transaction see its writes
+            df_read = self.client.query(f"SELECT id FROM {self.table_name}")
+            assert df_read["id"].tolist() == [1, 2]
+
+        assert self.read_table()["id"].tolist() == [1, 2]
+
+    def test_conflicts_fail_the_transaction(self):
+        write_params = {
+            "data_conflict_properties": ["id"],
+            "create_conflict_index": True,
+        }
+        df = pd.DataFrame({"id": [1, 2]})
+        self.write(df, **write_params)
+
+        with self.assertRaises(OnDataConflictFail):
+            with self.client.transaction():
+                self.write(df.assign(id=[3, 4]), **write_params)
+                self.write(df, on_data_conflict="fail", **write_params)
+
+        assert self.read_table()["id"].tolist() == [1, 2]
+
+    def test_new_enum_values(self):
+        self.addCleanup(
+            self.execute, f"DROP TYPE IF EXISTS {self.table_name}_k CASCADE"
+        )
+        with self.client.transaction():
+            self.write(pd.DataFrame({"k": pd.Categorical(["a", "b"])}))
+            self.write(pd.DataFrame({"k": pd.Categorical(["a", "c"])}))
+
+        df = self.read_table()
+        assert df["k"].tolist() == ["a", "b", "a", "c"]
+
+
+class TestReplace(PostgresTestCase):
+    def get_indexes(self):
+        return sorted(
+            index_name
+            for index_name, in self.execute(
+                "SELECT indexname FROM pg_indexes "
+                f"WHERE tablename = {self.table_name!r}"
+            )
+        )
+
+    def test_truncate(self):
+        self.execute(
+            f"CREATE TABLE {self.table_name} "
+            "(id int PRIMARY KEY, v text DEFAULT 'x')"
+        )
+        oid = self.execute(f"SELECT {self.table_name!r}::regclass::oid")
+        df = pd.DataFrame({"id": [1, 2], "v": ["a", "b"]})
+
+        self.write(
+            df, on_asset_conflict="replace", replace_strategy="truncate"
+        )
+
+        assert self.read_table().to_dict(orient="list") == df.to_dict(
+            orient="list"
+        )
+        assert (
+            self.execute(f"SELECT {self.table_name!r}::regclass::oid") == oid
+        )
+
+        # -- columns changed, so the table is swapped
+        self.write(
+            df[["id"]],
+            on_asset_conflict="replace",
+            replace_strategy="truncate",
+        )
+        assert self.read_table().columns.tolist() == ["id"]
+        assert self.get_indexes() == [f"{self.table_name}_pkey"]
+
+    def test_swap_copies_indexes_and_grants(self):
+        index_name = f"{self.table_name} v"
+        self.execute(
+            f"CREATE TABLE {self.table_name} (id int PRIMARY KEY, v int)"
+        )
+        preparer = self.client.engine.dialect.identifier_preparer
+        self.execute(
+            f"CREATE INDEX {preparer.quote(index_name)} "
+            f"ON {self.table_name} (v)"
+        )
+        self.execute(f"GRANT SELECT ON {self.table_name} TO PUBLIC")
+        df = pd.DataFrame({"id": [1, 2], "v": [1, 2]})
+
+        self.write(df, on_asset_conflict="replace", replace_strategy="swap")
+
+        assert self.get_indexes() == [index_name, f"{self.table_name}_pkey"]
+        grants = self.execute(
+            "SELECT grantee, privilege_type "
+            "FROM information_schema.role_table_grants "
+            f"WHERE table_name = {self.table_name!r} AND grantee = 'PUBLIC'"
+        )
+        assert [tuple(grant) for grant in grants] == [("PUBLIC", "SELECT")]
+
+        # -- indexes on dropped columns are not copied
+        self.write(
+            df[["id"]], on_asset_conflict="replace", replace_strategy="swap"
+        )
+        assert self.get_indexes() == [f"{self.table_name}_pkey"]
+
+    def test_swap_copies_constraints(self):
+        self.execute(
+            f"CREATE TABLE {self.table_name} ("
+            "id serial PRIMARY KEY, "
+            f"parent int REFERENCES {self.table_name} (id), "
+            "v int NOT NULL CHECK (v > 0))"
+        )
+        df = pd.DataFrame(
+            {
+                "id": [1, 2],
+                "parent": pd.array([None, 1], dtype="Int64"),
+                "v": [1, 2],
+            }
+        )
+        self.write(df, on_asset_conflict="replace", replace_strategy="swap")
+
+        constraints = self.execute(
+            "SELECT contype FROM pg_constraint "
+            f"WHERE conrelid = {self.table_name!r}::regclass"
+        )
+        assert sorted(contype for contype, in constraints) == ["c", "f", "p"]
+        with self.assertRaises(db.exc.IntegrityError):
+            self.execute(f"INSERT INTO {self.table_name} (v) VALUES (NULL)")
+        self.execute(f"SELECT setval('{self.table_name}_id_seq', 2)")
+        self.execute(f"INSERT INTO {self.table_name} (v) VALUES (3)")
+        assert self.read_table()["id"].tolist() == [1, 2, 3]
+
+    def test_swap_with_dependent_view(self):
+        view_name = f"{self.table_name}_v"
+        df = pd.DataFrame({"id": [1, 2]})
+        self.write(df)
+        self.execute(
+            f"CREATE VIEW {view_name} AS SELECT * FROM {self.table_name}"
+        )
+
+        # -- the table is truncated instead
+        self.write(
+            df.assign(id=[3, 4]),
+            on_asset_conflict="replace",
+            replace_strategy="swap",
+        )
+        assert self.read_table(view_name)["id"].tolist() == [3, 4]
+
+        with self.assertRaises(ValueError):
+            self.write(
+                df.assign(v=1),
+                on_asset_conflict="replace",
+                replace_strategy="swap",
+            )
+        assert self.read_table()["id"].tolist() == [3, 4]
+
+
+if __name__ == "__main__":
+    unittest.main()
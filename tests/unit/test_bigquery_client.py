@@ -0,0 +1,178 @@
+import io
+import unittest
+from unittest import mock
+
+import pandas as pd
+import pyarrow.parquet as pq
+from google.api_core.exceptions import NotFound
+
+from in_n_out_clients.bigquery_client import BigQueryClient
+
+
+def _mock_bigquery(table_exists=True, query_rows=None):
+    client = mock.MagicMock()
+    client.project = "project"
+    if not table_exists:
+        client.get_table.side_effect = NotFound("table not found")
+    client.query.return_value.result.return_value = query_rows or []
+    return client
+
+
+class TestBigQueryClient(unittest.TestCase):
+    def setUp(self):
+        self.df = pd.DataFrame(
+            {"currency": ["EUR", "GBP", "AED"], "value": [1.0, 2.0, 3.0]}
+        )
+
+    def test_append_uses_chunked_parquet_load_jobs(self):
+        client = _mock_bigquery()
+        bq_client = BigQueryClient(client=client, max_bytes_per_load_job=1)
+
+        resp = bq_client._write("prices", self.df, dataset_name="finance")
+
+        assert resp["status_code"] == 200
+        assert resp["data"][0]["num_load_jobs"] == 3
+        client.query.assert_not_called()
+        parquet_file, table_id = client.load_table_from_file.call_args[0]
+        assert table_id == "finance.prices"
+        loaded = pq.read_table(io.BytesIO(parquet_file.getvalue()))
+        assert loaded.column_names == ["currency", "value"]
+
+    def test_replace_merges_from_staging_table(self):
+        client = _mock_bigquery()
+        bq_client = BigQueryClient(client=client)
+
+        resp = bq_client._write(
+            "prices",
+            self.df,
+            dataset_name="finance",
+            on_data_conflict="replace",
+            data_conflict_properties=["currency"],
+        )
+
+        assert resp["status_code"] == 200
+        staging_table_id = client.load_table_from_file.call_args[0][1]
+        assert staging_table_id.startswith("finance.prices__staging_")
+        (staging_table,) = client.create_table.call_args[0]
+        assert staging_table.table_id == staging_table_id.split(".")[-1]
+        assert staging_table.expires is not None
+        statement = client.query.call_args[0][0]
+        assert statement.startswith(
+            f"MERGE `finance.prices` T USING `{staging_table_id}` S"
+        )
+        assert "WHEN MATCHED THEN UPDATE SET `value` = S.`value`" in statement
+        client.delete_table.assert_called_once_with(
+            staging_table_id, not_found_ok=True
+        )
+
+    def test_fail_returns_conflicts_without_writing(self):
+        client = _mock_bigquery(
+            query_rows=[{"num_conflicts": 1, "currency": "EUR"}]
+        )
+        bq_client = BigQueryClient(client=client)
+
+        resp = bq_client._write(
+            "prices",
+            self.df,
+            dataset_name="finance",
+            on_data_conflict="fail",
+            data_conflict_properties=["currency"],
+        )
+
+        assert resp["status_code"] == 409
+        assert client.query.call_count == 1
+        client.delete_table.assert_called_once()
+
+    def test_new_table_is_loaded_directly(self):
+        client = _mock_bigquery(table_exists=False)
+        bq_client = BigQueryClient(client=client)
+
+        resp = bq_client._write(
+            "prices",
+            self.df,
+            dataset_name="finance",
+            on_data_conflict="ignore",
+            data_conflict_properties=["currency"],
+        )
+
+        assert resp["status_code"] == 200
+        assert client.load_table_from_file.call_args[0][1] == "finance.prices"
+        client.query.assert_not_called()
+
+    def test_chunked_replace_is_copied_from_staging_table(self):
+        client = _mock_bigquery()
+        bq_client = BigQueryClient(client=client, max_bytes_per_load_job=1)
+
+        resp = bq_client._write(
+            "prices",
+            self.df,
+            dataset_name="finance",
+            on_asset_conflict="replace",
+        )
+
+        assert resp["status_code"] == 200
+        staging_table_ids = {
+            call[0][1] for call in client.load_table_from_file.call_args_list
+        }
+        (staging_table_id,) = staging_table_ids
+        assert staging_table_id.startswith("finance.prices__staging_")
+        (source, destination), kwargs = client.copy_table.call_args
+        assert (source, destination) == (staging_table_id, "finance.prices")
+        assert kwargs["job_config"].write_disposition == "WRITE_TRUNCATE"
+        client.delete_table.assert_called_once_with(
+            staging_table_id, not_found_ok=True
+        )
+
+    def test_single_chunk_replace_is_loaded_directly(self):
+        client = _mock_bigquery()
+        bq_client = BigQueryClient(client=client)
+
+        bq_client._write(
+            "prices",
+            self.df,
+            dataset_name="finance",
+            on_asset_conflict="replace",
+        )
+
+        _, table_id = client.load_table_from_file.call_args[0]
+        job_config = client.load_table_from_file.call_args[1]["job_config"]
+        assert table_id == "finance.prices"
+        assert job_config.write_disposition == "WRITE_TRUNCATE"
+        client.copy_table.assert_not_called()
+
+    def test_replace_with_empty_data_truncates(self):
+        client = _mock_bigquery()
+        bq_client = BigQueryClient(client=client)
+
+        resp = bq_client._write(
+            "prices",
+            self.df.iloc[:0],
+            dataset_name="finance",
+            on_asset_conflict="replace",
+        )
+
+        assert resp["status_code"] == 200
+        client.query.assert_called_once_with("TRUNCATE TABLE `finance.prices`")
+        client.load_table_from_file.assert_not_called()
+
+    def test_duplicate_keys_are_dropped_before_merge(self):
+        client = _mock_bigquery()
+        bq_client = BigQueryClient(client=client)
+        df = pd.concat([self.df, self.df.assign(value=4.0)])
+
+        resp = bq_client._write(
+            "prices",
+            df,
+            dataset_name="finance",
+            on_data_conflict="replace",
+            data_conflict_properties=["currency"],
+        )
+
+        assert resp["data"][0]["num_duplicate_rows_dropped"] == 3
+        parquet_file = client.load_table_from_file.call_args[0][0]
+        loaded = pq.read_table(io.BytesIO(parquet_file.getvalue()))
+        assert loaded.column("value").to_pylist() == [4.0, 4.0, 4.0]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+import os
+import tempfile
+import threading
+import unittest
+
+import pandas as pd
+
+from in_n_out_clients.buffered_writer import (
+    DEAD_LETTER_DIR_NAME,
+    BufferedWriter,
+)
+
+
+class FakeClient:
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.writes = []
+        self.lock = threading.Lock()
+
+    def write(self, **write_params):
+        with self.lock:
+            self.writes.append(write_params)
+        return {"status_code": self.status_code, "msg": ""}
+
+
+class TestBufferedWriter(unittest.TestCase):
+    def setUp(self):
+        self.df = pd.DataFrame({"a": [1, 2]})
+
+    def test_flush_groups_writes_by_table_and_strategy(self):
+        client = FakeClient()
+        writer = BufferedWriter(client, flush_interval=60)
+
+        for _ in range(3):
+            writer.write("t", self.df)
+        writer.write("t", self.df, on_data_conflict="ignore")
+        responses = writer.flush()
+        writer.close()
+
+        assert len(responses) == 2
+        assert [len(write["data"]) for write in client.writes] == [6, 2]
+        assert client.writes[1]["on_data_conflict"] == "ignore"
+
+    def test_flush_on_size(self):
+        client = FakeClient()
+        flushed = threading.Event()
+        client.write = lambda **write_params: flushed.set() or {
+            "status_code": 200
+        }
+
+        with BufferedWriter(client, max_rows=4, flush_interval=60) as writer:
+            writer.write("t", self.df)
+            assert not flushed.is_set()
+            writer.write("t", self.df)
+
+            assert flushed.wait(5)
+
+    def test_backpressure(self):
+        client = FakeClient(status_code=500)
+        writer = BufferedWriter(
+            client, max_buffered_rows=2, flush_interval=60, write_timeout=0.1
+        )
+        self.addCleanup(writer.close)
+
+        writer.write("t", self.df)
+        with self.assertRaises(TimeoutError):
+            writer.write("t", self.df)
+
+        # -- failed flushes keep the rows buffered
+        writer.flush()
+        assert writer._num_buffered_rows == 2
+
+    def test_created_responses_are_not_retried(self):
+        client = FakeClient(status_code=201)
+        with BufferedWriter(client, flush_interval=60) as writer:
+            writer.write("t", self.df)
+            writer.flush()
+            assert writer._num_buffered_rows == 0
+
+        assert len(client.writes) == 1
+
+    def test_permanently_failing_rows_are_dead_lettered(self):
+        dead_letters = []
+        with tempfile.TemporaryDirectory() as spool_dir:
+            with BufferedWriter(
+                FakeClient(status_code=409),
+                max_buffered_rows=2,
+                flush_interval=60,
+                write_timeout=1,
+                spool_dir=spool_dir,
+                on_dead_letter=lambda *args: dead_letters.append(args),
+            ) as writer:
+                # -- rejected rows do not fill up the buffer
+                for _ in range(3):
+                    writer.write("t", self.df)
+                    writer.flush()
+
+                assert writer._num_buffered_rows == 0
+
+            assert len(dead_letters) == 3
+            write_params, df, resp = dead_letters[0]
+            assert write_params["table_name"] == "t"
+            assert resp["status_code"] == 409
+            assert (
+                len(os.listdir(os.path.join(spool_dir, DEAD_LETTER_DIR_NAME)))
+                == 3
+            )
+
+    def test_retries_are_bounded(self):
+        client = FakeClient(status_code=500)
+        dead_letters = []
+        with BufferedWriter(
+            client,
+            flush_interval=60,
+            max_attempts=3,
+            on_dead_letter=lambda *args: dead_letters.append(args),
+        ) as writer:
+            writer.write("t", self.df)
+            for _ in range(3):
+                writer.flush()
+            assert writer._num_buffered_rows == 0
+
+        assert len(client.writes) == 3
+        assert len(dead_letters) == 1
+
+    def test_spool_is_replayed(self):
+        with tempfile.TemporaryDirectory() as spool_dir:
+            crashed_writer = BufferedWriter(
+                FakeClient(), spool_dir=spool_dir, flush_interval=60
+            )
+            crashed_writer.write("t", self.df)
+            crashed_writer._spool_file.close()
+
+            client = FakeClient()
+            with BufferedWriter(client, spool_dir=spool_dir) as writer:
+                assert writer._num_buffered_rows == 2
+
+            assert len(client.writes) == 1
+            assert os.listdir(spool_dir) == []
+
+
+if __name__ == "__main__":
+    unittest.main()
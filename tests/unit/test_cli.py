@@ -0,0 +1,138 @@
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from in_n_out_clients.cli import infer_file_format, main
+
+
+class TestCli(unittest.TestCase):
+    def test_infer_file_format(self):
+        assert infer_file_format("data/events.CSV.gz") == "csv"
+        assert infer_file_format("events.json") == "jsonl"
+        with self.assertRaises(ValueError):
+            infer_file_format("events.txt")
+
+    def test_load_files_in_parallel(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = [os.path.join(tmp_dir, "a.csv")]
+            pd.DataFrame({"id": range(10)}).to_csv(paths[0], index=False)
+            paths.append(os.path.join(tmp_dir, "b.parquet"))
+            pd.DataFrame({"id": range(10, 15)}).to_parquet(paths[1])
+
+            stdout, stderr = io.StringIO(), io.StringIO()
+            with contextlib.redirect_stdout(stdout):
+                with contextlib.redirect_stderr(stderr):
+                    exit_code = main(
+                        [
+                            "load",
+                            "--database-type=parquet",
+                            f"--database-name={tmp_dir}",
+                            "--table-name=t",
+                            "--chunksize=3",
+                            *paths,
+                        ]
+                    )
+
+            assert exit_code == 0
+            df = pd.read_parquet(os.path.join(tmp_dir, "t"))
+            assert sorted(df["id"]) == list(range(15))
+
+    def test_asset_conflict_on_existing_table(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "a.csv")
+            pd.DataFrame({"id": range(10)}).to_csv(path, index=False)
+            os.makedirs(os.path.join(tmp_dir, "t"))
+            pd.DataFrame({"id": [-1, -2]}).to_parquet(
+                os.path.join(tmp_dir, "t", "part-0.parquet")
+            )
+
+            for on_asset_conflict, expected_exit_code in (
+                ("ignore", 0),
+                ("fail", 1),
+            ):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    with contextlib.redirect_stderr(io.StringIO()):
+                        exit_code = main(
+                            [
+                                "load",
+                                "--database-type=parquet",
+                                f"--database-name={tmp_dir}",
+                                "--table-name=t",
+                                "--chunksize=3",
+                                f"--on-asset-conflict={on_asset_conflict}",
+                                path,
+                            ]
+                        )
+
+                assert exit_code == expected_exit_code
+                df = pd.read_parquet(os.path.join(tmp_dir, "t"))
+                assert sorted(df["id"]) == [-2, -1]
+
+    def test_first_chunk_creates_table_before_parallel_writes(self):
+        class FakeClient:
+            """Fails writes that race with the creation of the table, like
+            concurrent CREATE TABLE statements do."""
+
+            def __init__(self, **kwargs):
+                self.num_rows = 0
+                self.table_state = None
+                self.lock = threading.Lock()
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                return False
+
+            def resolve_asset_conflict(self, *args):
+                return None, "append"
+
+            def write(self, data, **write_params):
+                with self.lock:
+                    table_state = self.table_state
+                    if table_state is None:
+                        self.table_state = "creating"
+                if table_state == "creating":
+                    return {"status_code": 500, "msg": "UniqueViolation"}
+                if table_state is None:
+                    time.sleep(0.1)
+                    self.table_state = "created"
+                with self.lock:
+                    self.num_rows += len(data)
+                return {"status_code": 200, "msg": ""}
+
+        client = FakeClient()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = []
+            for file_number in range(4):
+                paths.append(os.path.join(tmp_dir, f"{file_number}.csv"))
+                pd.DataFrame({"id": range(10)}).to_csv(paths[-1], index=False)
+
+            with mock.patch(
+                "in_n_out_clients.cli.InNOutClient", return_value=client
+            ):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    with contextlib.redirect_stderr(io.StringIO()):
+                        exit_code = main(
+                            [
+                                "load",
+                                "--database-type=pg",
+                                "--table-name=t",
+                                "--chunksize=5",
+                                *paths,
+                            ]
+                        )
+
+        assert exit_code == 0
+        assert client.num_rows == 40
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+import unittest
+
+import pandas as pd
+
+from in_n_out_clients.deduplication import drop_duplicate_keys
+
+
+class TestDropDuplicateKeys(unittest.TestCase):
+    def setUp(self):
+        self.df = pd.DataFrame({"id": [1, 1, 2, 3, 3], "v": [1, 2, 3, 4, 5]})
+
+    def test_default_policy_follows_strategy(self):
+        df, num_dropped = drop_duplicate_keys(self.df, "replace", ["id"])
+        assert num_dropped == 2
+        assert df["v"].tolist() == [2, 3, 5]
+
+        df, _ = drop_duplicate_keys(self.df, "ignore", ["id"])
+        assert df["v"].tolist() == [1, 3, 4]
+
+        df, num_dropped = drop_duplicate_keys(self.df, "append", ["id"])
+        assert num_dropped == 0
+
+    def test_aggregate_policy(self):
+        df, _ = drop_duplicate_keys(self.df, "replace", ["id"], {"v": "sum"})
+
+        assert df.to_dict(orient="list") == {"id": [1, 2, 3], "v": [3, 3, 9]}
+
+
+if __name__ == "__main__":
+    unittest.main()
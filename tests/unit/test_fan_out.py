@@ -0,0 +1,68 @@
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from in_n_out_clients.google_calendar_client import GoogleCalendarClient
+from in_n_out_clients.main import InNOutClient
+
+
+class TestFanOut(unittest.TestCase):
+    def test_writes_to_all_targets(self):
+        records = [{"id": i, "v": i * 2} for i in range(10)]
+        with tempfile.TemporaryDirectory() as database_name:
+            client = InNOutClient("parquet", database_name=database_name)
+
+            resp = InNOutClient.fan_out(
+                records,
+                targets=[
+                    {"client": client, "table_name": "a"},
+                    {
+                        "client": client,
+                        "table_name": "b",
+                        "on_data_conflict": "ignore",
+                    },
+                ],
+            )
+
+            assert resp["status_code"] == 207
+            assert [
+                target["response"]["status_code"] for target in resp["data"]
+            ] == [200, 400]
+            df = pd.concat(client.read(table_name="a"))
+            assert len(df) == 10
+
+    def test_created_responses_are_successes(self):
+        df = pd.DataFrame({"summary": ["a", "b"]})
+        with mock.patch.object(
+            GoogleCalendarClient, "initialise"
+        ), mock.patch.object(
+            GoogleCalendarClient,
+            "create_events",
+            return_value={"status_code": 201, "msg": "created"},
+        ) as create_events:
+            calendar_client = InNOutClient("google_calendar")
+            with tempfile.TemporaryDirectory() as database_name:
+                resp = InNOutClient.fan_out(
+                    df,
+                    targets=[
+                        {
+                            "client": InNOutClient(
+                                "parquet", database_name=database_name
+                            ),
+                            "table_name": "a",
+                        },
+                        {"client": calendar_client, "table_name": "calendar"},
+                    ],
+                )
+
+        assert resp["status_code"] == 200
+        assert create_events.call_args.kwargs["events"] == [
+            {"summary": "a"},
+            {"summary": "b"},
+        ]
+
+
+if __name__ == "__main__":
+    unittest.main()
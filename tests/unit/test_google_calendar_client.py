@@ -0,0 +1,96 @@
+import json
+import unittest
+
+import httplib2
+from googleapiclient.discovery import build
+
+from in_n_out_clients.google_calendar_client import GoogleCalendarClient
+
+CALENDAR_ID = "test@group.calendar.google.com"
+
+
+class FakeCalendarHttp:
+    """Fake transport for the google calendar api that stores events by
+    id."""
+
+    def __init__(self):
+        self.events = {}
+        self.requests = []
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        self.requests.append((method, uri))
+        status = "200"
+        if "/calendarList" in uri:
+            content = {"items": [{"id": CALENDAR_ID}]}
+        elif method == "POST":
+            event = json.loads(body)
+            if event["id"] in self.events:
+                status = "409"
+                content = {"error": {"code": 409, "message": "duplicate"}}
+            else:
+                self.events[event["id"]] = event
+                content = event
+        elif method == "PUT":
+            event = json.loads(body)
+            self.events[event["id"]] = event
+            content = event
+        else:
+            content = {"items": []}
+        return (
+            httplib2.Response({"status": status}),
+            json.dumps(content).encode(),
+        )
+
+
+class TestGoogleCalendarClient(unittest.TestCase):
+    def setUp(self):
+        self.http = FakeCalendarHttp()
+        self.client = GoogleCalendarClient.__new__(GoogleCalendarClient)
+        self.client.client = build(
+            "calendar", "v3", http=self.http, static_discovery=True
+        )
+        self.events = [
+            {"summary": f"Event {i}", "description": "old"} for i in range(2)
+        ]
+
+    def _create_events(self, events, on_data_conflict):
+        return self.client.create_events(
+            calendar_id=CALENDAR_ID,
+            events=events,
+            on_data_conflict=on_data_conflict,
+            data_conflict_properties=["summary"],
+            idempotent=True,
+        )
+
+    def test_idempotent_writes(self):
+        resp = self._create_events(self.events, "ignore")
+        assert resp["status_code"] == 201
+        assert len(self.http.events) == 2
+        # -- no conflict lookups
+        assert [method for method, _ in self.http.requests] == [
+            "GET",
+            "POST",
+            "POST",
+        ]
+
+        resp = self._create_events(self.events, "ignore")
+        assert len(resp["data"][0]["ignored_events_due_to_conflict"]) == 2
+        assert len(self.http.events) == 2
+
+        resp = self._create_events(self.events, "fail")
+        assert resp["status_code"] == 409
+
+        new_events = [{**event, "description": "new"} for event in self.events]
+        resp = self._create_events(new_events, "replace")
+        assert resp["status_code"] == 201
+        assert {
+            event["description"] for event in self.http.events.values()
+        } == {"new"}
+
+    def test_idempotent_append_raises(self):
+        with self.assertRaises(ValueError):
+            self._create_events(self.events, "append")
+
+
+if __name__ == "__main__":
+    unittest.main()
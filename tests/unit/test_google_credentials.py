@@ -0,0 +1,136 @@
+import datetime
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from google.auth.exceptions import DefaultCredentialsError, TransportError
+from google.oauth2.credentials import Credentials
+
+from in_n_out_clients.google_credentials import (
+    _REFRESH_RETRY_INTERVAL,
+    GoogleCredentialProvider,
+    _rearm_refresh_timers_after_fork,
+)
+
+SCOPES = ["https://www.googleapis.com/auth/calendar"]
+
+
+def _write_token(path, token, expires_in):
+    expiry = datetime.datetime.now(datetime.timezone.utc).replace(
+        tzinfo=None
+    ) + datetime.timedelta(seconds=expires_in)
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "token": token,
+                "refresh_token": "refresh-token",
+                "client_id": "client-id",
+                "client_secret": "client-secret",
+                "scopes": SCOPES,
+                "expiry": expiry.isoformat() + "Z",
+            },
+            f,
+        )
+
+
+class TestGoogleCredentialProvider(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.token_file = os.path.join(self.directory.name, "token.json")
+        self.provider = GoogleCredentialProvider(
+            SCOPES,
+            token_file=self.token_file,
+            service_account_file=None,
+            refresh_margin=60,
+            allow_interactive=False,
+        )
+
+    def tearDown(self):
+        self.provider.close()
+        self.directory.cleanup()
+
+    def test_credentials_are_cached(self):
+        _write_token(self.token_file, "token", expires_in=3600)
+
+        with mock.patch.object(Credentials, "refresh") as refresh:
+            credentials = self.provider.get_credentials()
+            assert self.provider.get_credentials() is credentials
+
+        refresh.assert_not_called()
+        assert credentials.token == "token"
+        assert self.provider._refresh_timer is not None
+
+    def test_uses_token_refreshed_by_another_process(self):
+        _write_token(self.token_file, "expired-token", expires_in=-10)
+        credentials = Credentials.from_authorized_user_file(
+            self.token_file, SCOPES
+        )
+        self.provider.credentials = credentials
+        self.provider._uses_token_file = True
+        _write_token(self.token_file, "new-token", expires_in=3600)
+
+        with mock.patch.object(Credentials, "refresh") as refresh:
+            assert self.provider.get_credentials() is credentials
+
+        refresh.assert_not_called()
+        assert credentials.token == "new-token"
+
+    def test_background_refresh_retries_after_transport_error(self):
+        _write_token(self.token_file, "token", expires_in=3600)
+        self.provider.get_credentials()
+        _write_token(self.token_file, "token", expires_in=-10)
+
+        with mock.patch.object(
+            Credentials, "refresh", side_effect=TransportError("timed out")
+        ):
+            self.provider._background_refresh()
+
+        assert self.provider._refresh_timer.interval == (
+            _REFRESH_RETRY_INTERVAL
+        )
+        assert self.provider._refresh_timer.is_alive()
+
+    def test_no_credentials_without_interaction_raises(self):
+        with mock.patch(
+            "google.auth.default", side_effect=DefaultCredentialsError()
+        ):
+            with self.assertRaises(ConnectionError):
+                self.provider.get_credentials()
+
+    def test_no_terminal_without_stdin(self):
+        self.provider.allow_interactive = None
+
+        with mock.patch(
+            "google.auth.default", side_effect=DefaultCredentialsError()
+        ), mock.patch("sys.stdin", None):
+            with self.assertRaises(ConnectionError):
+                self.provider.get_credentials()
+
+    def test_refresh_is_rearmed_after_fork(self):
+        _write_token(self.token_file, "token", expires_in=3600)
+        self.provider.get_credentials()
+        refresh_timer = self.provider._refresh_timer
+
+        _rearm_refresh_timers_after_fork()
+
+        assert self.provider._refresh_timer is not refresh_timer
+        assert self.provider._refresh_timer.is_alive()
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires os.fork")
+    def test_refresh_timer_in_forked_child(self):
+        _write_token(self.token_file, "token", expires_in=3600)
+        self.provider.get_credentials()
+
+        pid = os.fork()
+        if pid == 0:  # -- child
+            timer = self.provider._refresh_timer
+            os._exit(0 if timer is not None and timer.is_alive() else 1)
+        _, status = os.waitpid(pid, 0)
+
+        assert os.waitstatus_to_exitcode(status) == 0
+
+
+if __name__ == "__main__":
+    unittest.main()
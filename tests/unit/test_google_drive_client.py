@@ -0,0 +1,173 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from in_n_out_clients.google_drive_client import (
+    UPLOAD_CHUNK_SIZE_MULTIPLE,
+    GoogleDriveClient,
+)
+
+
+class FakeDriveState:
+    def __init__(self):
+        self.files = {}
+        self.sessions = {}
+        self.fail_next_chunk = False
+        self.num_range_requests = 0
+        self.lock = threading.Lock()
+
+
+class FakeDriveHandler(BaseHTTPRequestHandler):
+    """Minimal implementation of the drive v3 endpoints used by the
+    client."""
+
+    state: FakeDriveState
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status_code, body, headers=None):
+        content = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _send_308(self, received):
+        self.send_response(308)
+        if received:
+            self.send_header("Range", f"bytes=0-{received - 1}")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        metadata = json.loads(self.rfile.read(length))
+        with self.state.lock:
+            session_id = str(len(self.state.sessions))
+            self.state.sessions[session_id] = {
+                "metadata": metadata,
+                "data": b"",
+            }
+        host, port = self.server.server_address
+        self._send_json(
+            200,
+            {},
+            headers={"Location": f"http://{host}:{port}/session/{session_id}"},
+        )
+
+    def do_PUT(self):
+        session = self.state.sessions[self.path.rsplit("/", 1)[1]]
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        content_range = self.headers["Content-Range"]
+        byte_range, total_size = content_range.removeprefix("bytes ").split(
+            "/"
+        )
+
+        if byte_range != "*":
+            if self.state.fail_next_chunk:
+                self.state.fail_next_chunk = False
+                # -- simulate a chunk that was only half received
+                start = int(byte_range.split("-")[0])
+                if start == len(session["data"]):
+                    session["data"] += body[: len(body) // 2]
+                self._send_json(503, {})
+                return
+            start = int(byte_range.split("-")[0])
+            assert start == len(session["data"])
+            session["data"] += body
+
+        if len(session["data"]) == int(total_size):
+            file_id = f"file-{len(self.state.files)}"
+            self.state.files[file_id] = session["data"]
+            self._send_json(
+                200, {"id": file_id, "name": session["metadata"]["name"]}
+            )
+        else:
+            self._send_308(len(session["data"]))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path == "/drive/v3/files":
+            self._send_json(200, {"files": []})
+            return
+
+        content = self.state.files[url.path.rsplit("/", 1)[1]]
+        if params.get("alt") != ["media"]:
+            self._send_json(200, {"size": str(len(content))})
+            return
+
+        start, end = self.headers["Range"].removeprefix("bytes=").split("-")
+        with self.state.lock:
+            self.state.num_range_requests += 1
+        start, end = int(start), int(end) + 1
+        partial_content = content[start:end]
+        self.send_response(206)
+        self.send_header("Content-Length", str(len(partial_content)))
+        self.end_headers()
+        self.wfile.write(partial_content)
+
+
+class TestGoogleDriveClient(unittest.TestCase):
+    def setUp(self):
+        self.state = FakeDriveState()
+        handler = type("Handler", (FakeDriveHandler,), {"state": self.state})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        host, port = self.server.server_address
+        self.client = GoogleDriveClient(
+            session=requests.Session(),
+            api_url=f"http://{host}:{port}",
+            upload_chunk_size=UPLOAD_CHUNK_SIZE_MULTIPLE,
+            download_chunk_size=100_000,
+        )
+        self.content = os.urandom(3 * UPLOAD_CHUNK_SIZE_MULTIPLE + 123)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_upload_resumes_after_failed_chunk(self):
+        self.state.fail_next_chunk = True
+
+        resp = self.client._write("export.csv", self.content)
+
+        assert resp["status_code"] == 201
+        file_id = resp["data"][0]["id"]
+        assert self.state.files[file_id] == self.content
+
+    def test_parallel_download(self):
+        self.state.files["file-0"] = self.content
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "export.csv")
+            resp = self.client.download("file-0", path)
+            with open(path, "rb") as f:
+                downloaded = f.read()
+
+        assert resp["status_code"] == 200
+        assert downloaded == self.content
+        assert self.state.num_range_requests == resp["data"][0]["num_ranges"]
+        assert resp["data"][0]["num_ranges"] > 1
+
+    def test_read_streams_chunks(self):
+        self.state.files["file-0"] = self.content
+
+        chunks = list(self.client._read("file-0"))
+
+        assert b"".join(chunks) == self.content
+
+
+if __name__ == "__main__":
+    unittest.main()
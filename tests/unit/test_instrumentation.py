@@ -0,0 +1,41 @@
+import unittest
+
+from in_n_out_clients.instrumentation import (
+    Instrumentation,
+    MetricsInstrumentation,
+)
+
+
+class TestInstrumentation(unittest.TestCase):
+    def test_noop_span(self):
+        instrumentation = Instrumentation()
+
+        with instrumentation.span("postgres.write", table_name="t") as span:
+            span.add("rows", 10)
+
+        assert not instrumentation.enabled
+
+    def test_metrics_instrumentation_records_spans(self):
+        instrumentation = MetricsInstrumentation()
+
+        for _ in range(2):
+            with instrumentation.span("postgres.write") as span:
+                span.add("rows", 10)
+                span.add("round_trips")
+        with self.assertRaises(ValueError):
+            with instrumentation.span("postgres.write"):
+                raise ValueError()
+
+        metrics = instrumentation.registry.snapshot()
+        assert metrics["counters"]["postgres.write.calls"] == 3
+        assert metrics["counters"]["postgres.write.errors"] == 1
+        assert metrics["counters"]["postgres.write.rows"] == 20
+        assert metrics["counters"]["postgres.write.round_trips"] == 2
+        assert (
+            metrics["summaries"]["postgres.write.duration_seconds"]["count"]
+            == 3
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,222 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from in_n_out_clients.main import InNOutClient
+from in_n_out_clients.parquet_client import KEY_INDEX_FILE_NAME, ParquetClient
+
+
+class TestParquetClient(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.root = temp_dir.name
+        self.client = InNOutClient("parquet", database_name=self.root)
+        self.df = pd.DataFrame(
+            {
+                "currency": ["EUR", "GBP", "AED", "EUR"],
+                "year": [2023, 2023, 2024, 2024],
+                "value": [1.0, 2.0, 3.0, 4.0],
+            }
+        )
+        self.keys = ["currency", "year"]
+
+    def _read_table(self, **read_params):
+        df = pd.concat(self.client.read(table_name="prices", **read_params))
+        return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+    def test_write_partitioned_dataset_and_read_with_pushdown(self):
+        resp = self.client.write(
+            "prices", self.df, partition_cols=["year"], dataset_name=None
+        )
+
+        assert resp["status_code"] == 200
+        assert sorted(os.listdir(os.path.join(self.root, "prices"))) == [
+            "year=2023",
+            "year=2024",
+        ]
+        df = self._read_table(
+            columns=["currency", "value"], filters=[("year", "=", 2024)]
+        )
+        assert df.to_dict(orient="list") == {
+            "currency": ["AED", "EUR"],
+            "value": [3.0, 4.0],
+        }
+
+    def test_data_conflict_strategies(self):
+        self.client.write(
+            "prices",
+            self.df,
+            data_conflict_properties=self.keys,
+            partition_cols=["year"],
+        )
+        new_df = pd.DataFrame(
+            {
+                "currency": ["EUR", "USD"],
+                "year": [2024, 2024],
+                "value": [9.0, 9.0],
+            }
+        )
+        kwargs = {
+            "data_conflict_properties": self.keys,
+            "partition_cols": ["year"],
+        }
+
+        resp = self.client.write(
+            "prices", new_df, on_data_conflict="fail", **kwargs
+        )
+        assert resp["status_code"] == 409
+        assert resp["msg"] == "Found 1 conflicting rows"
+
+        self.client.write(
+            "prices", new_df, on_data_conflict="ignore", **kwargs
+        )
+        df = self._read_table()
+        assert len(df) == 5
+        assert df.loc[df["currency"] == "EUR", "value"].tolist() == [1.0, 4.0]
+
+        self.client.write(
+            "prices", new_df, on_data_conflict="replace", **kwargs
+        )
+        df = self._read_table()
+        assert len(df) == 5
+        assert df.loc[df["currency"] == "EUR", "value"].tolist() == [1.0, 9.0]
+
+    def test_replace_drops_duplicate_keys(self):
+        self.client.write(
+            "prices", self.df, data_conflict_properties=self.keys
+        )
+        new_df = pd.DataFrame(
+            {
+                "currency": ["EUR", "EUR", "USD"],
+                "year": [2024, 2024, 2024],
+                "value": [8.0, 9.0, 9.0],
+            }
+        )
+
+        resp = self.client.write(
+            "prices",
+            new_df,
+            on_data_conflict="replace",
+            data_conflict_properties=self.keys,
+        )
+
+        assert resp["data"][0]["num_duplicate_rows_dropped"] == 1
+        df = self._read_table()
+        assert len(df) == 5
+        assert df.loc[df["currency"] == "EUR", "value"].tolist() == [1.0, 9.0]
+        key_index = pd.read_parquet(
+            os.path.join(self.root, "prices", KEY_INDEX_FILE_NAME)
+        )
+        assert not key_index.duplicated(self.keys).any()
+
+    def test_failed_replace_keeps_replaced_rows(self):
+        self.client.write(
+            "prices", self.df, data_conflict_properties=self.keys
+        )
+        write_temp_file = ParquetClient._write_temp_file
+
+        def _fail_after_new_file(client, *args):
+            # -- the new rows are written first, then the old file rewritten
+            if _fail_after_new_file.num_calls:
+                raise OSError("disk full")
+            _fail_after_new_file.num_calls += 1
+            return write_temp_file(client, *args)
+
+        _fail_after_new_file.num_calls = 0
+
+        for method_name, side_effect in (
+            ("_write_files", OSError("disk full")),
+            ("_write_temp_file", _fail_after_new_file),
+        ):
+            with mock.patch.object(
+                ParquetClient,
+                method_name,
+                side_effect=side_effect,
+                autospec=True,
+            ):
+                with self.assertRaises(OSError):
+                    self.client.write(
+                        "prices",
+                        self.df.head(2).assign(value=9.0),
+                        on_data_conflict="replace",
+                        data_conflict_properties=self.keys,
+                    )
+
+            df = self._read_table()
+            assert df.loc[df["value"] != 9.0, "value"].tolist() == [
+                3.0,
+                1.0,
+                4.0,
+                2.0,
+            ]
+            assert not any(
+                name.endswith(".tmp")
+                for name in os.listdir(os.path.join(self.root, "prices"))
+            )
+
+    def test_key_index_is_rebuilt_when_missing(self):
+        self.client.write(
+            "prices", self.df, data_conflict_properties=self.keys
+        )
+        os.remove(os.path.join(self.root, "prices", KEY_INDEX_FILE_NAME))
+
+        resp = self.client.write(
+            "prices",
+            self.df,
+            on_data_conflict="fail",
+            data_conflict_properties=self.keys,
+        )
+
+        assert resp["status_code"] == 409
+
+    def test_replace_table(self):
+        self.client.write("prices", self.df)
+
+        self.client.write(
+            "prices", self.df.head(1), on_asset_conflict="replace"
+        )
+
+        assert len(self._read_table()) == 1
+        assert sorted(os.listdir(self.root)) == [".prices.lock", "prices"]
+
+    def test_concurrent_writes_keep_key_index_consistent(self):
+        errors = []
+
+        def _write(start):
+            df = pd.DataFrame({"id": range(start, start + 10), "value": 1.0})
+            try:
+                resp = self.client.write(
+                    "prices",
+                    df,
+                    on_data_conflict="ignore",
+                    data_conflict_properties=["id"],
+                )
+                assert resp["status_code"] == 200
+            except Exception as error:
+                errors.append(error)
+
+        threads = [
+            threading.Thread(target=_write, args=(start,))
+            for start in range(0, 40, 5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        df = self._read_table()
+        assert sorted(df["id"]) == list(range(45))
+        key_index = pd.read_parquet(
+            os.path.join(self.root, "prices", KEY_INDEX_FILE_NAME)
+        )
+        assert sorted(key_index["id"]) == list(range(45))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,206 @@
+import contextlib
+import gzip
+import io
+import os
+import tempfile
+import types
+import unittest
+
+import pandas as pd
+import sqlalchemy as db
+
+from in_n_out_clients.postgres_client import (
+    _INDEX_DEFINITION_PATTERN,
+    _engines,
+    _open_export_sink,
+    _prepare,
+    _reset_pools_after_fork,
+    _split_into_partitions,
+    add_row_hash,
+)
+
+
+class TestAddRowHash(unittest.TestCase):
+    def test_hash_ignores_keys(self):
+        df = pd.DataFrame({"id": [1, 2, 3], "v": [{"a": 1}, {"a": 1}, None]})
+
+        row_hash = add_row_hash(df, "row_hash", ["id"])["row_hash"]
+
+        assert row_hash.dtype == "int64"
+        assert row_hash[0] == row_hash[1] != row_hash[2]
+
+
+class FakeConnection:
+    """Fake SQLAlchemy connection that records the statements it runs."""
+
+    def __init__(self):
+        self.connection = types.SimpleNamespace(info={})
+        self.statements = []
+
+    def exec_driver_sql(self, statement, params=None):
+        self.statements.append(statement)
+
+
+class TestPrepare(unittest.TestCase):
+    def test_placeholders_are_rewritten(self):
+        con = FakeConnection()
+        query = (
+            "SELECT CAST(:a AS int), '100%' FROM t WHERE b::text = :b "
+            "AND c > :a AND d = ARRAY[1,2][1:2]"
+        )
+
+        statement, is_prepared_now = _prepare(con, query)
+
+        assert is_prepared_now
+        (prepare_statement,) = con.statements
+        assert prepare_statement.startswith("PREPARE in_n_out_")
+        assert prepare_statement.endswith(
+            " AS SELECT CAST($1 AS int), '100%%' FROM t WHERE b::text = $2 "
+            "AND c > $1 AND d = ARRAY[1,2][1:2]"
+        )
+        statement_name = prepare_statement.split()[1]
+        assert statement == f"EXECUTE {statement_name} (%(a)s, %(b)s)"
+
+    def test_statements_are_prepared_once_per_connection(self):
+        con = FakeConnection()
+        _prepare(con, "SELECT 1")
+
+        statement, is_prepared_now = _prepare(con, "SELECT 1")
+
+        assert not is_prepared_now
+        assert len(con.statements) == 1
+        assert statement == con.statements[0].split(" AS ")[0].replace(
+            "PREPARE", "EXECUTE"
+        )
+        assert _prepare(FakeConnection(), "SELECT 1")[1]
+
+
+class TestSplitIntoPartitions(unittest.TestCase):
+    def setUp(self):
+        self.df = pd.DataFrame(
+            {
+                "ts": pd.to_datetime(
+                    [
+                        "2024-02-01 00:00",
+                        "2024-01-31 23:00",
+                        "2024-02-15 00:00",
+                    ]
+                ),
+                "v": [1, 2, 3],
+            }
+        )
+
+    def test_split_by_month(self):
+        partitions = list(_split_into_partitions(self.df, "ts", "month"))
+
+        assert [partition[:3] for partition in partitions] == [
+            ("202401", "2024-01-01 00:00:00", "2024-02-01 00:00:00"),
+            ("202402", "2024-02-01 00:00:00", "2024-03-01 00:00:00"),
+        ]
+        assert [partition[3]["v"].tolist() for partition in partitions] == [
+            [2],
+            [1, 3],
+        ]
+
+    def test_timezone_aware_bounds_are_utc(self):
+        df = self.df.assign(ts=self.df["ts"].dt.tz_localize("Europe/Berlin"))
+
+        partitions = list(_split_into_partitions(df, "ts", "year"))
+
+        assert [partition[:3] for partition in partitions] == [
+            ("2024", "2024-01-01 00:00:00+00:00", "2025-01-01 00:00:00+00:00")
+        ]
+
+        partitions = list(_split_into_partitions(df, "ts", "day"))
+        assert [partition[0] for partition in partitions] == [
+            "20240131",
+            "20240214",
+        ]
+
+    def test_invalid_partitions(self):
+        with self.assertRaises(ValueError):
+            list(_split_into_partitions(self.df, "ts", "week"))
+
+        with self.assertRaises(ValueError):
+            list(
+                _split_into_partitions(
+                    self.df.assign(ts=[None, *self.df["ts"][1:]]), "ts", "day"
+                )
+            )
+
+
+class TestIndexDefinitionPattern(unittest.TestCase):
+    def test_index_and_table_are_replaced(self):
+        for indexdef, expected in [
+            (
+                "CREATE UNIQUE INDEX t_pkey ON public.t USING btree (id)",
+                "CREATE UNIQUE INDEX new ON s.shadow USING btree (id)",
+            ),
+            (
+                'CREATE INDEX "my ""ix""" ON ONLY "my schema"."T 1" '
+                'USING btree ("a b")',
+                'CREATE INDEX new ON ONLY s.shadow USING btree ("a b")',
+            ),
+        ]:
+            assert (
+                _INDEX_DEFINITION_PATTERN.sub(
+                    r"\g<1>new\g<3>s.shadow", indexdef, count=1
+                )
+                == expected
+            )
+
+
+class TestOpenExportSink(unittest.TestCase):
+    def export(self, compression) -> bytes:
+        f = io.BytesIO()
+        with contextlib.ExitStack() as stack:
+            _open_export_sink(stack, f, compression).write(b"a,b\n")
+
+        # -- file-like objects are left open for the caller
+        assert not f.closed
+        return f.getvalue()
+
+    def test_compression(self):
+        assert self.export(None) == b"a,b\n"
+        assert gzip.decompress(self.export("gzip")) == b"a,b\n"
+
+    def test_zstd_compression(self):
+        try:
+            import zstandard
+        except ImportError:
+            self.skipTest("zstandard is not installed")
+
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        assert decompressor.decompress(self.export("zstd")) == b"a,b\n"
+
+    def test_path_is_closed(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "export.csv.gz")
+            with contextlib.ExitStack() as stack:
+                sink = _open_export_sink(stack, path, "gzip")
+                sink.write(b"a,b\n")
+
+            assert sink.closed
+            with gzip.open(path) as f:
+                assert f.read() == b"a,b\n"
+
+    def test_invalid_compression(self):
+        with self.assertRaises(ValueError):
+            with contextlib.ExitStack() as stack:
+                _open_export_sink(stack, io.BytesIO(), "bz2")
+
+
+class TestForkSafety(unittest.TestCase):
+    def test_pools_are_reset_after_fork(self):
+        engine = db.create_engine("sqlite://")
+        engine.connect().close()
+        pool = engine.pool
+        _engines.add(engine)
+
+        _reset_pools_after_fork()
+
+        assert engine.pool is not pool
+
+
+if __name__ == "__main__":
+    unittest.main()
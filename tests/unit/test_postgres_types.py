@@ -0,0 +1,85 @@
+import datetime
+import decimal
+import unittest
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import (
+    BIGINT,
+    DATE,
+    FLOAT,
+    INTEGER,
+    NUMERIC,
+    REAL,
+    SMALLINT,
+    VARCHAR,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, ENUM, JSONB
+
+from in_n_out_clients import postgres_types
+from in_n_out_clients.postgres_types import (
+    encode_categories,
+    get_pg_datatypes,
+    register_dtype_mapping,
+)
+
+
+class TestGetPgDatatypes(unittest.TestCase):
+    def test_type_matrix(self):
+        df = pd.DataFrame(
+            {
+                "int64": [1, 2],
+                "bigint": [1, 2**40],
+                "int16": np.array([1, 2], dtype="int16"),
+                "nullable_int": pd.array([1, None], dtype="Int64"),
+                "float32": np.array([1.5, 2], dtype="float32"),
+                "float64": [1.5, None],
+                "string": pd.array(["a", None], dtype="string"),
+                "date": [datetime.date(2020, 1, 1), None],
+                "decimal": [decimal.Decimal("1.1"), None],
+                "json": [{"a": 1}, None],
+                "array": [[1, 2], [3]],
+                "nested_array": [[[1]], [[2]]],
+            }
+        )
+
+        dtypes = get_pg_datatypes(df, table_name="t")
+
+        assert dtypes["int64"] is INTEGER
+        assert dtypes["bigint"] is BIGINT
+        assert dtypes["int16"] is SMALLINT
+        assert dtypes["nullable_int"] is INTEGER
+        assert dtypes["float32"] is REAL
+        assert dtypes["float64"] is FLOAT
+        assert dtypes["string"] is VARCHAR
+        assert dtypes["date"] is DATE
+        assert dtypes["decimal"] is NUMERIC
+        assert dtypes["json"] is JSONB
+        assert isinstance(dtypes["array"], ARRAY)
+        assert dtypes["array"].item_type.__class__ is BIGINT
+        assert dtypes["nested_array"] is JSONB
+
+    def test_category_encodings(self):
+        df = pd.DataFrame({"colour": pd.Categorical(["red", None, "blue"])})
+
+        enum_type = get_pg_datatypes(df, table_name="t")["colour"]
+        assert isinstance(enum_type, ENUM)
+        assert enum_type.name == "t_colour"
+        assert enum_type.enums == ["blue", "red"]
+
+        dtypes = get_pg_datatypes(df, "t", category_encoding="codes")
+        assert dtypes["colour"] is SMALLINT
+        encoded_df = encode_categories(df, category_encoding="codes")
+        assert encoded_df["colour"].tolist() == [1, pd.NA, 0]
+
+    def test_register_dtype_mapping(self):
+        self.addCleanup(postgres_types._registered_mappings.clear)
+        register_dtype_mapping(lambda series: series.name == "id", BIGINT)
+
+        dtypes = get_pg_datatypes(pd.DataFrame({"id": [1], "x": [1]}), "t")
+
+        assert dtypes == {"id": BIGINT, "x": INTEGER}
+
+
+if __name__ == "__main__":
+    unittest.main()
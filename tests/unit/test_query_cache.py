@@ -0,0 +1,149 @@
+import tempfile
+import time
+import unittest
+
+import pandas as pd
+
+from in_n_out_clients.query_cache import (
+    QueryCache,
+    get_modified_tables,
+    get_referenced_tables,
+    is_read_query,
+    normalise_query,
+)
+
+
+class TestQueryCache(unittest.TestCase):
+    def setUp(self):
+        self.df = pd.DataFrame({"a": range(100)})
+
+    def test_hit_with_normalised_query(self):
+        cache = QueryCache()
+        cache.set("SELECT a FROM t;", self.df)
+
+        df = cache.get("SELECT   a\nFROM t")
+
+        pd.testing.assert_frame_equal(df, self.df)
+        assert cache.get("SELECT a FROM t", params={"x": 1}) is None
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_whitespace_in_literals_is_kept(self):
+        cache = QueryCache()
+        cache.set("SELECT a FROM t WHERE s = 'a  b'", self.df)
+
+        assert cache.get("SELECT a FROM t WHERE s = 'a b'") is None
+        assert cache.get('SELECT "a  b" FROM t') is None
+        assert cache.get("SELECT a  FROM t\nWHERE s = 'a  b';") is not None
+        assert normalise_query("SELECT $$a  b$$,  E'\\'  '") == (
+            "SELECT $$a  b$$, E'\\'  '"
+        )
+
+    def test_write_queries_are_not_cached(self):
+        cache = QueryCache()
+        cache.set("DELETE FROM t RETURNING a", self.df)
+
+        assert cache.get("DELETE FROM t RETURNING a") is None
+
+    def test_invalidate_by_table(self):
+        cache = QueryCache()
+        cache.set("SELECT a FROM public.t JOIN u ON t.a = u.a", self.df)
+        cache.set("SELECT a FROM v", self.df)
+
+        cache.invalidate("U")
+
+        assert cache.get("SELECT a FROM public.t JOIN u ON t.a = u.a") is None
+        assert cache.get("SELECT a FROM v") is not None
+
+    def test_results_read_before_invalidation_are_not_cached(self):
+        cache = QueryCache()
+        version = cache.get_version()
+        cache.invalidate("t")
+
+        cache.set("SELECT a FROM t", self.df, version=version)
+        cache.set("SELECT a FROM u", self.df, version=version)
+
+        assert cache.get("SELECT a FROM t") is None
+        assert cache.get("SELECT a FROM u") is not None
+
+    def test_ttl(self):
+        cache = QueryCache()
+        cache.set("SELECT a FROM t", self.df, ttl=0.01)
+
+        time.sleep(0.02)
+
+        assert cache.get("SELECT a FROM t") is None
+
+    def test_eviction_spills_to_disk(self):
+        nbytes = int(self.df.memory_usage(deep=True).sum())
+        with tempfile.TemporaryDirectory() as disk_dir:
+            cache = QueryCache(max_bytes=nbytes, disk_dir=disk_dir)
+            cache.set("SELECT a FROM t", self.df)
+            cache.set("SELECT a FROM u", self.df)
+
+            assert len(cache._memory) == 1
+            assert len(cache._disk) == 1
+            pd.testing.assert_frame_equal(
+                cache.get("SELECT a FROM t"), self.df
+            )
+
+    def test_get_referenced_tables(self):
+        tables = get_referenced_tables(
+            'select * from "Sales" s join public.items i on s.id = i.id'
+        )
+
+        assert tables == {"sales", "items"}
+
+    def test_get_referenced_tables_of_comma_joins(self):
+        assert get_referenced_tables("SELECT * FROM a, b") == {"a", "b"}
+        tables = get_referenced_tables(
+            "select * from a x, public.b as y, (select * from c) z "
+            "join d using (id), e where extract(year from f) in "
+            "(select year from g)"
+        )
+
+        assert tables == {"a", "b", "c", "d", "e", "g"}
+
+    def test_unknown_tables_are_invalidated_by_any_write(self):
+        query = "SELECT * FROM generate_series(1, 3)"
+        assert get_referenced_tables(query) is None
+        cache = QueryCache()
+        cache.set(query, self.df)
+        cache.set("SELECT * FROM v", self.df, dependent_tables=["T"])
+
+        cache.invalidate("t")
+
+        assert cache.get(query) is None
+        assert cache.get("SELECT * FROM v") is None
+
+    def test_is_read_query(self):
+        for query in [
+            "SELECT * FROM t",
+            "with x as (select 1) select * from x",
+            "SELECT 'for update', nextval_count FROM t -- into",
+            "SELECT substring(a from 1 for 2) FROM t",
+        ]:
+            assert is_read_query(query), query
+
+        for query in [
+            "SELECT * FROM t FOR UPDATE",
+            "select * from t for no key update skip locked",
+            "SELECT * FROM t FOR SHARE OF t",
+            "SELECT * FROM t for key share",
+            "SELECT * INTO t2 FROM t",
+            "SELECT nextval('t_id_seq')",
+            "SELECT pg_advisory_lock(1)",
+            "SELECT pg_try_advisory_xact_lock(1)",
+            "WITH d AS (DELETE FROM t RETURNING *) SELECT * FROM d",
+        ]:
+            assert not is_read_query(query), query
+
+    def test_get_modified_tables(self):
+        tables = get_modified_tables(
+            "insert into public.sales (id) select id from items"
+        )
+
+        assert tables == {"sales"}
+
+
+if __name__ == "__main__":
+    unittest.main()
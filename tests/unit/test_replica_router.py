@@ -0,0 +1,79 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+import sqlalchemy as db
+
+from in_n_out_clients.replica_router import ReplicaRouter
+
+
+def _get_replica_engine(lag=0.0, is_reachable=True):
+    engine = mock.MagicMock()
+    con = engine.connect.return_value.__enter__.return_value
+    if is_reachable:
+        con.execute.return_value.scalar.return_value = lag
+    else:
+        con.execute.side_effect = db.exc.OperationalError(
+            "SELECT 1", {}, Exception("connection refused")
+        )
+    return engine
+
+
+class TestReplicaRouter(unittest.TestCase):
+    def test_round_robin_over_healthy_replicas(self):
+        engines = [
+            _get_replica_engine(),
+            _get_replica_engine(lag=60),
+            _get_replica_engine(is_reachable=False),
+            _get_replica_engine(lag=1),
+            # -- not replicating
+            _get_replica_engine(lag=None),
+        ]
+        router = ReplicaRouter(engines, max_lag=10)
+        router.check_health()
+
+        chosen = [router.get_engine() for _ in range(4)]
+
+        assert chosen == [engines[0], engines[3], engines[0], engines[3]]
+
+    def test_falls_back_to_primary(self):
+        engine = _get_replica_engine()
+        router = ReplicaRouter([engine], health_check_interval=60)
+        router.check_health()
+        assert router.get_engine() is engine
+
+        router.mark_unhealthy(engine)
+
+        assert router.get_engine() is None
+
+    def test_replicated_until(self):
+        router = ReplicaRouter([_get_replica_engine()], max_lag=10)
+        assert router.replicated_until is None
+
+        before = time.monotonic()
+        router.check_health()
+
+        assert before - 10 <= router.replicated_until <= time.monotonic() - 10
+
+    def test_health_check_does_not_block_reads(self):
+        engine = _get_replica_engine()
+        is_reachable = threading.Event()
+        engine.connect.side_effect = lambda: (
+            is_reachable.wait(),
+            engine.connect.return_value,
+        )[1]
+        router = ReplicaRouter([engine], health_check_interval=60)
+
+        # -- reads go to the primary until the replica is known to be healthy
+        assert router.get_engine() is None
+        assert router.get_engine() is None
+
+        is_reachable.set()
+        router._health_check_thread.join()
+        assert router.get_engine() is engine
+        assert engine.connect.call_count == 1
+
+
+if __name__ == "__main__":
+    unittest.main()
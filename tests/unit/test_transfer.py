@@ -0,0 +1,101 @@
+import tempfile
+import unittest
+
+import pandas as pd
+
+from in_n_out_clients.main import InNOutClient
+from in_n_out_clients.transfer import run_transfer
+
+
+class TestRunTransfer(unittest.TestCase):
+    def test_transfers_all_chunks(self):
+        chunks = [[1, 2], [3], [4, 5, 6]]
+        written = []
+
+        def write_chunk(chunk, chunk_number):
+            written.append((chunk_number, chunk))
+            return {"status_code": 201}
+
+        resp = run_transfer(
+            chunks,
+            write_chunk,
+            transform=lambda chunk: [x * 10 for x in chunk],
+            max_queue_size=1,
+        )
+
+        assert resp["status_code"] == 200
+        assert written == [(0, [10, 20]), (1, [30]), (2, [40, 50, 60])]
+        summary = resp["data"][0]
+        assert summary["num_rows_written"] == 6
+        assert set(summary["stage_metrics"]) == {"read", "transform", "write"}
+
+    def test_stops_on_rejected_chunk(self):
+        resp = run_transfer(
+            ([i] for i in range(100)),
+            lambda chunk, chunk_number: {
+                "status_code": 409 if chunk_number == 1 else 200
+            },
+        )
+
+        assert resp["status_code"] == 409
+        assert resp["data"][0]["num_chunks_written"] == 1
+
+    def test_read_failure(self):
+        def chunks():
+            yield [1]
+            raise RuntimeError("read failed")
+
+        resp = run_transfer(chunks(), lambda chunk, n: {"status_code": 200})
+
+        assert resp["status_code"] == 500
+        assert "read" in resp["msg"]
+
+
+class TestTransferAssetConflict(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.client = InNOutClient("parquet", database_name=temp_dir.name)
+        self.client.write("source", pd.DataFrame({"a": [1, 2, 3]}))
+        self.client.write("target", pd.DataFrame({"a": [10, 20]}))
+
+    def transfer(self, table_name, on_asset_conflict):
+        return InNOutClient.transfer(
+            self.client,
+            self.client,
+            table_name=table_name,
+            read_params={"table_name": "source", "chunksize": 1},
+            on_asset_conflict=on_asset_conflict,
+        )
+
+    def read(self, table_name):
+        return pd.concat(self.client.read(table_name=table_name))
+
+    def test_ignore_existing_table(self):
+        resp = self.transfer("target", "ignore")
+
+        assert resp["status_code"] == 200
+        assert "request dropped" in resp["msg"]
+        assert sorted(self.read("target")["a"]) == [10, 20]
+
+    def test_fail_existing_table(self):
+        resp = self.transfer("target", "fail")
+
+        assert resp["status_code"] == 409
+        assert sorted(self.read("target")["a"]) == [10, 20]
+
+    def test_fail_new_table(self):
+        resp = self.transfer("new_target", "fail")
+
+        assert resp["status_code"] == 200
+        assert sorted(self.read("new_target")["a"]) == [1, 2, 3]
+
+    def test_replace_existing_table(self):
+        resp = self.transfer("target", "replace")
+
+        assert resp["status_code"] == 200
+        assert sorted(self.read("target")["a"]) == [1, 2, 3]
+
+
+if __name__ == "__main__":
+    unittest.main()